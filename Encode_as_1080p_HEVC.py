@@ -4,8 +4,30 @@ import platform
 import sys
 import pathlib
 import subprocess
+import contextlib
 import datetime as dt
 import humanize as hm
+from encoder_lib.archive import archive_source, resume_archive_moves, wait_for_archive_moves
+from encoder_lib.cache import cached_output, content_fingerprint, reuse_output, settings_key, store_output
+from encoder_lib.cli import parse_cli
+from encoder_lib.complexity import analyze_complexity, with_rate_control
+from encoder_lib.filters import plan_video_filters
+from encoder_lib.governor import Governor
+from encoder_lib.history import describe_forecast, forecast_batch, record_run
+from encoder_lib.ledger import ledger_queue, ledger_unfinished, ledger_update, resume_plan
+from encoder_lib.logsink import LogSink
+from encoder_lib.pool import resolve_jobs, run_pool, x265_pool_params
+from encoder_lib.predict import prediction_filter
+from encoder_lib.preflight import preflight
+from encoder_lib.probe import probe_cached, source_duration, summarize
+from encoder_lib.quality import search_crf
+from encoder_lib.progress import EncodeAborted, EncodeCancelled, run_with_progress, size_watchdog
+from encoder_lib.renditions import plan_rendition, profile_settings, rendition_paths, rendition_switches
+from encoder_lib.schedule import order_targets, record_cost
+from encoder_lib.scratch import ScratchStager
+from encoder_lib.segments import segment_encode
+from encoder_lib.streams import REMUX_VIDEO_SWITCHES, needs_remux, plan_streams, splice_switches
+from encoder_lib.verify import Verifier, expected_streams, verify_output
 
 ####################################################################################
 # Global variables
@@ -19,6 +41,9 @@ TRASH_DIR = '/Users/scott/.Trash/'
 # Define Archive_Fail_Over_Dir
 ARCHIVE_FAIL_OVER_DIR = '/Users/scott/_Encoder_Archive'
 
+# Profile name used for the shared per-profile settings in encoder_lib
+PROFILE = '1080p'
+
 # Notification Parameters
 MSG_TITLE = 'Encode as 1080p HEVC'
 
@@ -29,9 +54,28 @@ SPACER = ' '
 LOG_DIR = '/Users/scott/Logs/ffmpeg/Encode_as_1080p_HEVC'
 LOG_NAME = f'{TODAY_DATESTAMP}.log'
 LOGFILE_FULL_PATH = os.path.join(LOG_DIR, LOG_NAME)
+JSONL_FULL_PATH = os.path.join(LOG_DIR, f'{TODAY_DATESTAMP}.jsonl')
 
 # Create "LOG_DIR" if it doesn't exist
 os.makedirs(LOG_DIR, exist_ok=True)
+
+# Buffered writer for the logfile, plus per-file records for later analysis
+LOG_SINK = LogSink(LOGFILE_FULL_PATH, JSONL_FULL_PATH)
+
+# ffmpeg Parameters
+FF_BIN = '/usr/local/bin/ffmpeg'
+FF_EXECUTION_FLAGS = ['-hide_banner', '-i']
+
+# After multiple tests, I wasn't happy with the hevc_videotoolbox results, so skipping for now
+# if platform.node().startswith('Scotts-M1-MBP'):
+#     VIDEO_PARAMS = ['-c:v', 'hevc_videotoolbox', '-crf', '20']
+VIDEO_FILTERS = ['-vf', 'scale=-1:1080']
+VIDEO_PARAMS = ['-c:v', 'libx265', '-crf', '25', '-preset', 'medium']
+AUDIO_PARAMS = ['-c:a', 'copy']
+FF_SWITCHES = [*VIDEO_FILTERS, *VIDEO_PARAMS, *AUDIO_PARAMS, '-map_metadata', '-1', '-metadata']
+
+# 10-bit sources stay 10-bit (Main10) instead of being dithered down to the profile's 8-bit pix_fmt
+ALLOW_10_BIT = True
 ####################################################################################
 # End Globals
 
@@ -58,14 +102,13 @@ def logger(status, data):
     else:
         status_key = status.upper()
 
-    # Write to logfile
-    with open(LOGFILE_FULL_PATH, "a") as log_pipe:
-        log_timestamp = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        if status_key == 'NONE':
-            log_data = data
-        else:
-            log_data = '{:23} || {:^7} || {:<80}\n'.format(log_timestamp, status_key, data)
-        log_pipe.write(f'{log_data}')
+    # Hand the line to the log writer thread
+    log_timestamp = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    if status_key == 'NONE':
+        log_data = data
+    else:
+        log_data = '{:23} || {:^7} || {:<80}\n'.format(log_timestamp, status_key, data)
+    LOG_SINK.write(f'{log_data}')
 ####################################################################################
 
 
@@ -118,7 +161,7 @@ def create_notification_content(total_count, failed_list, body_str):
 
 
 ####################################################################################
-def encode(target_file):
+def encode(target_file, x265_params=None, segments=1, abort_ratio=0, stager=None, adaptive=False, renditions=(), verifier=None, cache=True, quality_target=None, cancel=None, jobs=1):
     p = pathlib.Path(target_file)
     ppp = pathlib.PurePosixPath(target_file)
     ts_now = dt.datetime.now()
@@ -127,7 +170,6 @@ def encode(target_file):
     output_file_stem = str(ppp.stem)
     output_file_ext = str(ppp.suffix)
     temp_file_name = f'{output_file_stem}.TEMP{output_file_ext}'
-    temp_file_full_path = os.path.join(p.parent, temp_file_name)
     before_size_raw = os.path.getsize(target_file)
 
     # Use pathlib to extract the volume name parts, else use ARCHIVE_FAIL_OVER_DIR
@@ -149,55 +191,334 @@ def encode(target_file):
     # Create filename for our working copy, before downgrading.
     temp_file = os.path.join(output_dir, temp_file_name)
 
-    # ffmpeg Parameters
-    ff_bin = '/usr/local/bin/ffmpeg -hide_banner -i'
+    # Encode from a scratch copy of the source when one has been staged
+    staged_input = stager.acquire(target_file) if stager else None
+    input_file = staged_input or target_file
+    output_file = stager.output_path(target_file, temp_file_name) if staged_input else temp_file
 
-    # After multiple tests, I wasn't happy with the hevc_videotoolbox results, so skipping for now
-    # if platform.node().startswith('Scotts-M1-MBP'):
-    #     video_codec = 'hevc_videotoolbox -crf 20'
-    # else:
-    #     video_codec = 'libx265 -crf 25'
-    video_codec = 'libx265 -crf 25'
-    ff_switches = f'-vf "scale=-1:1080" -c:v {video_codec} -preset medium -c:a copy -map_metadata -1 -metadata title="{metadata_title}"'
-    convert_cmd = f'{ff_bin} "{target_file}" {ff_switches} "{temp_file}"'
+    # Record the job in the ledger so an interrupted run can pick up from here
+    ledger_update(target_file, PROFILE, 'encoding', temp_file=temp_file, archive_dir=encoder_archive, before_size=before_size_raw)
+
+    # Assemble metadata title string
+    metadata_title_string = f'title={metadata_title}'
+
+    # Per-encode CPU budget when running alongside other encodes
+    x265_switches = ['-x265-params', x265_params] if x265_params else []
+
+    # Plan the encode for this source: the filter graph (no upscaling, a scaler suited to the
+    # ratio, 10-bit kept 10-bit) and whether to copy, transcode or drop each audio/subtitle stream
+    ff_switches, video_switches, audio_switches = FF_SWITCHES, [*VIDEO_FILTERS, *VIDEO_PARAMS], AUDIO_PARAMS
+    remux = False
+    probe_data = None
+    source_summary = {}
+    try:
+        probe_data = probe_cached(input_file)
+        source_summary = summarize(probe_data)
+        planned_ff, filter_graph = plan_video_filters(ff_switches, source_summary, ALLOW_10_BIT)
+        planned_video, _ = plan_video_filters(video_switches, source_summary, ALLOW_10_BIT)
+        stream_switches, stream_notes = plan_streams(probe_data, AUDIO_PARAMS, output_file_ext)
+        planned_ff = splice_switches(planned_ff, AUDIO_PARAMS, ['-map', '0:V:0', *stream_switches])
+        planned_audio, _ = plan_streams(probe_data, AUDIO_PARAMS, output_file_ext, input_index=1)
+
+        # Already HEVC and nothing to filter: copy the video and just fix the tag
+        remux = '-vf' not in planned_ff and needs_remux(source_summary, output_file_ext)
+        if remux:
+            planned_ff = splice_switches(planned_ff, planned_video, REMUX_VIDEO_SWITCHES)
+        ff_switches, video_switches, audio_switches = planned_ff, planned_video, planned_audio
+        logger('info', f'{SPACER * 3} Filter graph:\t {filter_graph}')
+        logger('info', f'{SPACER * 3} Streams:\t {stream_notes}')
+        if remux:
+            x265_switches = []
+            logger('info', f'{SPACER * 3} Video is already HEVC. Remuxing with the hvc1 tag instead of encoding')
+    except Exception as e:
+        remux = False
+        logger('warning', f'{SPACER * 3} Could not plan the encode ({str(e)}). Using the profile settings')
+
+    # Pick CRF/preset from a quick complexity scan of the source
+    encode_choice = {}
+    if adaptive and not remux:
+        try:
+            encode_choice = analyze_complexity(input_file) or {}
+        except Exception as e:
+            logger('warning', f'{SPACER * 3} Complexity scan failed ({str(e)}). Using the profile settings')
+        if encode_choice:
+            ff_switches = with_rate_control(ff_switches, encode_choice['crf'], encode_choice['preset'])
+            video_switches = with_rate_control(video_switches, encode_choice['crf'], encode_choice['preset'])
+            logger('info', f'{SPACER * 3} Complexity:\t {encode_choice["complexity"]} (bpp {encode_choice["bpp"]}, '
+                   f'{encode_choice["cuts_per_minute"]} cuts/min). CRF {encode_choice["crf"]}, preset {encode_choice["preset"]}')
+
+    # Renditions for other profiles take the complexity pick, but not a CRF searched for this profile's output
+    rendition_choice = encode_choice
+
+    # Search sampled windows for the highest CRF that still meets the quality target
+    if quality_target and not remux:
+        try:
+            search = search_crf(input_file, video_switches, quality_target, PROFILE, logger, complexity=encode_choice or None,
+                                x265_switches=x265_switches)
+        except Exception as e:
+            search = None
+            logger('warning', f'{SPACER * 3} CRF search failed ({str(e)}). Keeping CRF {encode_choice.get("crf", "from the profile")}')
+        if search:
+            encode_choice = {**encode_choice, **search}
+            ff_switches = with_rate_control(ff_switches, search['crf'], search['preset'])
+            video_switches = with_rate_control(video_switches, search['crf'], search['preset'])
+            search_cost = f'cached ({search["search_cached"]} match)' if search['search_cached'] else f'{search["search_encodes"]} sample encodes'
+            logger('info', f'{SPACER * 3} Quality:\t CRF {search["crf"]} for {search["quality_metric"]} >= {search["quality_target"]} '
+                   f'(scored {search["quality_score"]:.4g}). Search: {search_cost}, {search["search_seconds"]}s')
+
+    # ffmpeg command
+    convert_cmd = [
+        FF_BIN,
+        *FF_EXECUTION_FLAGS,
+        input_file,
+        *x265_switches,
+        *ff_switches,
+        metadata_title_string,
+        output_file
+    ]
+
+    # Extra renditions share the decode: the video is split in the filter graph and each
+    # branch is encoded with its own profile's settings, next to this profile's output
+    rendition_files = {}
+    if renditions and probe_data and not remux:
+        try:
+            outputs = [(plan_rendition(([*VIDEO_FILTERS, *VIDEO_PARAMS], AUDIO_PARAMS, ALLOW_10_BIT), probe_data,
+                                       source_summary, output_file_ext, encode_choice), output_file)]
+            for profile in renditions:
+                rendition_files[profile] = rendition_paths(target_file, profile)
+                plan = plan_rendition(profile_settings(profile), probe_data, source_summary, output_file_ext, rendition_choice)
+                outputs.append((plan, rendition_files[profile][0]))
+                logger('info', f'{SPACER * 3} Rendition {profile}:\t {plan["filter_graph"]}; {plan["stream_notes"]}')
+            convert_cmd = [
+                FF_BIN,
+                *FF_EXECUTION_FLAGS,
+                input_file,
+                *rendition_switches(outputs, [*x265_switches, '-map_metadata', '-1', '-metadata', metadata_title_string])
+            ]
+        except Exception as e:
+            rendition_files = {}
+            logger('warning', f'{SPACER * 3} Could not plan the renditions ({str(e)}). Encoding {PROFILE} only')
 
     # Assemble object movement commands
     repl_src_file_cmd = f'mv -f "{temp_file}" "{target_file}"'
     del_tmp_file_cmd = f'mv "{temp_file}" "{TRASH_DIR}"'
-    arc_src_file_cmd = f'mv "{target_file}" "{encoder_archive}"'
+
+    # Same content encoded earlier with the same settings: copy that output instead of encoding
+    cache_key, reused_output = None, None
+    if not remux and not rendition_files:
+        try:
+            cache_key = (content_fingerprint(target_file), settings_key(PROFILE, ff_switches))
+            reused_output = cached_output(*cache_key) if cache else None
+        except Exception as e:
+            logger('warning', f'{SPACER * 3} Could not fingerprint the source ({str(e)}). Encoding it')
+        if reused_output:
+            logger('info', f'{SPACER * 3} Same content was encoded before as "{reused_output}". Reusing that output')
 
     # Convert File
     logger('info', f'{SPACER * 3} Begin encoding of target file....')
+    encode_started = dt.datetime.now()
+
+    # Time spent in each stage, for the metrics (see encoder_lib.metrics)
+    stage_seconds = {'prepare': round((encode_started - ts_now).total_seconds(), 3)}
+
+    # A worker agent sets cancel when the job server gives this file to another worker
+    # (see encoder_lib.worker)
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    # Add the job to the run history the forecaster and Encoder_History.py read
+    def record_history(result, output_size=None):
+        mode = 'cache' if reused_output else 'remux' if remux else 'renditions' if rendition_files else 'segments' if segmented else 'encode'
+        record_run(PROFILE, target_file, source_summary, result, mode, before_size_raw, output_size, stage_seconds.get('encode'))
+
+    # Once the file is another worker's, its temp outputs belong to the new attempt: stop without touching them
+    def give_up_file(reason):
+        logger('warning', f'{SPACER * 3} The job server gave "{p.name}" to another worker. Leaving its files alone')
+        ledger_update(target_file, PROFILE, 'failed', error=f'job taken back by the server: {reason}')
+        record_history('cancelled')
+        LOG_SINK.event(
+            'file', profile=PROFILE, path=target_file, result='cancelled', error=reason,
+            before_size=before_size_raw, after_size=before_size_raw,
+            seconds=round((dt.datetime.now() - ts_now).total_seconds(), 3), stages=stage_seconds, **encode_choice
+        )
+        if staged_input:
+            stager.release(target_file)
+
     try:
-        subprocess.run(convert_cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Large sources can be split at keyframes and encoded as parallel segments
+        segmented = False
+        encode_stats = {}
+        if reused_output:
+            reuse_output(reused_output, output_file, metadata_title_string)
+        elif segments > 1 and not remux and not rendition_files:
+            segmented = segment_encode(
+                input_file, output_file,
+                video_switches, audio_switches,
+                ['-map_metadata', '-1', '-metadata', metadata_title_string],
+                segments, x265_params, logger, cancel=cancel
+            )
+        if not segmented and not reused_output:
+            duration = source_duration(input_file)
+
+            # Stop early when the output is heading past abort_ratio of the source size
+            watchdog = size_watchdog(before_size_raw, duration, abort_ratio) if duration and abort_ratio and not remux else None
+            encode_stats = run_with_progress(convert_cmd, logger, duration=duration, watchdog=watchdog)
+        if cancelled():
+            raise EncodeCancelled('lease lost during the encode')
 
     except Exception as e:
+        stage_seconds['encode'] = round((dt.datetime.now() - encode_started).total_seconds(), 3)
+        if cancelled():
+            give_up_file(str(e))
+            return 0, p.name, before_size_raw, before_size_raw
+
         # Downgrade process failed. Log event
         logger('failure', f'{SPACER * 3}')
         logger('failure', f'{SPACER * 6} *** Encoding failed *** Response: "{str(e)}". Cleaning up.....')
         logger('failure', f'{SPACER * 3}')
+        if isinstance(e, EncodeAborted):
+            logger('warning', f'{SPACER * 6} *** Not worth encoding. Marked to skip on later runs')
+            ledger_update(target_file, PROFILE, 'not_worth_it', error=str(e))
+        else:
+            ledger_update(target_file, PROFILE, 'failed', error=str(e))
+        record_history('not_worth_it' if isinstance(e, EncodeAborted) else 'failed')
+        LOG_SINK.event(
+            'file', profile=PROFILE, path=target_file,
+            result='not_worth_it' if isinstance(e, EncodeAborted) else 'failed', error=str(e),
+            before_size=before_size_raw, after_size=before_size_raw,
+            seconds=round((dt.datetime.now() - ts_now).total_seconds(), 3), stages=stage_seconds, **encode_choice
+        )
 
         # Delete temp file
         logger('info', f'{SPACER * 3} Deleting temp file')
-        file_event('delete', del_tmp_file_cmd)
+        if staged_input:
+            stager.release(target_file)
+        else:
+            file_event('delete', del_tmp_file_cmd)
+        for rendition_temp, _ in rendition_files.values():
+            if os.path.exists(rendition_temp):
+                file_event('delete', f'mv "{rendition_temp}" "{TRASH_DIR}"')
         return 0, p.name, before_size_raw, before_size_raw
 
     # Downgraded successfully
-    after_size_raw = os.path.getsize(temp_file_full_path)
+    stage_seconds['encode'] = round((dt.datetime.now() - encode_started).total_seconds(), 3)
+    after_size_raw = os.path.getsize(output_file)
     after_size = hm.naturalsize(after_size_raw)
 
+    # Feed the scheduler's cost model. Remuxes and multi-rendition runs say nothing about a plain encode.
+    if probe_data and not remux and not rendition_files and not reused_output:
+        record_cost(PROFILE, source_summary, stage_seconds['encode'], jobs=jobs, segments=segments if segmented else 1)
+    rendition_sizes = {profile: os.path.getsize(paths[0]) for profile, paths in rendition_files.items()}
+
     logger('success', f'{SPACER * 3} Successfully encoded "{temp_file_name}"!')
     logger('info', f'{SPACER * 3} Encoded file size:\t {after_size}\t Reduction:\t ({percentage_decrease(after_size_raw, before_size_raw)}%)')
-
-    # Move target_file to encoder_archive
-    logger('info', f'{SPACER * 3} Moving source file to encoder archive')
-    file_event('move', arc_src_file_cmd)
-
-    # Overwrite target_file with temp_file
-    # Rename encoded file as original
-    logger('info', f'{SPACER * 3} Renaming encoded file as source file name')
-    file_event('rename', repl_src_file_cmd)
-    logger('info', f'{SPACER * 3} File encoding process completed')
+    for profile, size in rendition_sizes.items():
+        logger('info', f'{SPACER * 3} {profile} rendition size:\t {hm.naturalsize(size)}')
+
+    # Archive the source and rename the encoded file into place
+    def finish_file():
+        if cancelled():
+            give_up_file('lease lost before archiving')
+            return
+        finish_started = dt.datetime.now()
+
+        # Only now is the complete output at temp_file, so a restart may finish the job from here
+        ledger_update(target_file, PROFILE, 'encoded', after_size=after_size_raw)
+
+        # Move target_file to encoder_archive
+        logger('info', f'{SPACER * 3} Moving source file to encoder archive')
+        try:
+            archive_source(target_file, encoder_archive, logger)
+            ledger_update(target_file, PROFILE, 'archived')
+            logger('success', f'{SPACER * 3} File moved successfully')
+            archive_failed = 0
+        except Exception as e:
+            logger('failure', f'{SPACER * 3} Failed to move file. Please perform manually')
+            logger('failure', f'{SPACER * 3} Response:\t {str(e)}')
+            archive_failed = 1
+
+        # Overwrite target_file with temp_file
+        # Rename encoded file as original
+        logger('info', f'{SPACER * 3} Renaming encoded file as source file name')
+        rename_failed = file_event('rename', repl_src_file_cmd)
+        if not rename_failed:
+            ledger_update(target_file, PROFILE, 'renamed')
+
+        # Put each extra rendition next to the source under its final name
+        for profile, (rendition_temp, rendition_file) in rendition_files.items():
+            logger('info', f'{SPACER * 3} Renaming {profile} rendition as "{os.path.basename(rendition_file)}"')
+            rename_failed |= file_event('rename', f'mv -f "{rendition_temp}" "{rendition_file}"')
+        logger('info', f'{SPACER * 3} File encoding process completed')
+
+        if archive_failed or rename_failed:
+            ledger_update(target_file, PROFILE, 'failed', error='archive or rename failed')
+        else:
+            ledger_update(target_file, PROFILE, 'done', after_size=after_size_raw)
+            if cache_key:
+                store_output(*cache_key, target_file)
+
+        stage_seconds['finish'] = round((dt.datetime.now() - finish_started).total_seconds(), 3)
+        record_history('file_ops_failed' if archive_failed or rename_failed else 'encoded', after_size_raw)
+        LOG_SINK.event(
+            'file', profile=PROFILE, path=target_file,
+            result='file_ops_failed' if archive_failed or rename_failed else 'encoded',
+            before_size=before_size_raw, after_size=after_size_raw,
+            reduction=percentage_decrease(after_size_raw, before_size_raw),
+            seconds=round((dt.datetime.now() - ts_now).total_seconds(), 3), renditions=rendition_sizes, reused_from=reused_output,
+            stages=stage_seconds, **encode_choice, **encode_stats
+        )
+
+    # Finishing on a background thread raised part way (see Verifier and ScratchStager)
+    def file_ops_failed(reason):
+        ledger_update(target_file, PROFILE, 'failed', error=reason)
+        record_history('file_ops_failed', after_size_raw)
+        LOG_SINK.event(
+            'file', profile=PROFILE, path=target_file, result='file_ops_failed', error=reason,
+            before_size=before_size_raw, after_size=after_size_raw,
+            seconds=round((dt.datetime.now() - ts_now).total_seconds(), 3), stages=stage_seconds, **encode_choice
+        )
+
+    # A scratch output is copied back on the write-back thread, which then
+    # finishes the file, so the next encode can start straight away
+    def hand_off():
+        if cancelled():
+            give_up_file('lease lost before archiving')
+            return
+        if staged_input:
+            logger('info', f'{SPACER * 3} Copying encoded file back from scratch')
+            stager.write_back(target_file, output_file, temp_file, finish_file, on_error=file_ops_failed)
+        else:
+            finish_file()
+
+    # An output that fails verification is binned and the source left as it was
+    def reject_file(reason):
+        if cancelled():
+            give_up_file(reason)
+            return
+        logger('failure', f'{SPACER * 3} "{p.name}" failed verification: {reason}. Source left in place')
+        ledger_update(target_file, PROFILE, 'failed', error=f'verification failed: {reason}')
+        record_history('verify_failed')
+        LOG_SINK.event(
+            'file', profile=PROFILE, path=target_file, result='verify_failed', error=reason,
+            before_size=before_size_raw, after_size=before_size_raw,
+            seconds=round((dt.datetime.now() - ts_now).total_seconds(), 3), stages=stage_seconds, **encode_choice
+        )
+        if staged_input:
+            stager.release(target_file)
+        else:
+            file_event('delete', del_tmp_file_cmd)
+        for rendition_temp, _ in rendition_files.values():
+            file_event('delete', f'mv "{rendition_temp}" "{TRASH_DIR}"')
+
+    # Check the output before anything destructive happens. The checks run on the
+    # verifier's threads, alongside the next encode.
+    if verifier:
+        logger('info', f'{SPACER * 3} Verifying encoded file')
+        expected_duration, expected = source_duration(input_file), expected_streams(ff_switches)
+        verifier.submit(target_file, lambda: verify_output(output_file, expected_duration, expected), hand_off, reject_file,
+                        timings=stage_seconds, on_error=file_ops_failed)
+    else:
+        hand_off()
 
     execution_time = hm.precisedelta(dt.datetime.now() - ts_now)
     logger('info', '{:<62} {:>16}'.format('File processing time:', execution_time))
@@ -206,66 +527,163 @@ def encode(target_file):
 
 
 ####################################################################################
-def main():
+# Run one batch of targets and return the notification content
+def run_batch(options):
+    # Batches can run back to back in one process (see Encoder_Daemon.py)
+    global START_TIME
+    START_TIME = dt.datetime.now()
+
     logger('none', f'\n\n{MARKER_CHAR * 140}\n')
     logger('info', f'Starting encoder script:\t {__file__}')
     if platform.node().startswith('_Scotts-M1-MBP'):
         logger('info', 'Executing machine supports hardware encoding. Using HEVC_VideoToolBox ')
     logger('info', 'Checking for targets.... ')
     logger('none', f'{MARKER_CHAR * 140}\n')
-    if len(sys.argv) > 1:
-        if isinstance(sys.argv[1], int):
-            targets_list = sys.argv[2:]
-            logger('info', f"Found {(len(targets_list))} targets to encode. Let's begin!")
-        else:
-            targets_list = sys.argv[1:]
-            logger('info', f"Found {(len(targets_list))} targets to encode. Let's begin!")
-    else:
+    targets_list = options.targets
+    if options.resume:
+        # Add every job an earlier run of this profile left unfinished
+        targets_list += [t for t in ledger_unfinished(PROFILE) if t not in targets_list]
+    skipped_list = []
+    recovered_results = {}
+
+    # Each target's encode() style result, by absolute path, for callers that report per file
+    options.outcomes = {}
+    if targets_list:
+        logger('info', f"Found {(len(targets_list))} targets to encode. Let's begin!")
+
+        # Ledger check: skip finished jobs, finish interrupted ones, clean up partial outputs
+        targets_list, recovered_results, skipped_list = resume_plan(targets_list, PROFILE, logger, force=options.force)
+
+        # Pre-flight probe: drop targets that are already HEVC, already small enough or already low bitrate
+        targets_list, preflight_skipped = preflight(targets_list, PROFILE, logger, force=options.force)
+        skipped_list += preflight_skipped
+
+        # Sample-encode predictor: drop targets that won't save enough to be worth the CPU
+        if options.min_savings is not None and targets_list:
+            targets_list, predict_skipped = prediction_filter(targets_list, options.min_savings, [*VIDEO_FILTERS, *VIDEO_PARAMS], AUDIO_PARAMS, logger, ALLOW_10_BIT)
+            skipped_list += predict_skipped
+        if skipped_list:
+            logger('info', f'Skipped {len(skipped_list)} targets. {len(targets_list)} left to encode')
+        ledger_queue(targets_list, PROFILE)
+        for name, reason in skipped_list:
+            LOG_SINK.event('skip', profile=PROFILE, name=name, reason=reason)
+        for result, name, old_size, new_size in recovered_results.values():
+            LOG_SINK.event('file', profile=PROFILE, name=name, result='recovered' if result else 'failed',
+                           before_size=old_size, after_size=new_size)
+
+    if not targets_list and not recovered_results:
         logger('failure', f' *** Nothing found to encode ***. Exiting.....')
         logger('info', f'{MARKER_CHAR * 100}')
 
         execution_time = hm.precisedelta(dt.datetime.now() - START_TIME)
-        message_content = f' Automator Task Completed | {MSG_TITLE} | Nothing found to encode\nTotal runtime: {human_but_smaller(execution_time)} '
+        message_content = f' Automator Task Completed | {MSG_TITLE} | Nothing found to encode{f" ({len(skipped_list)} skipped)" if skipped_list else ""}\nTotal runtime: {human_but_smaller(execution_time)} '
         logger('info', f'Display Notification data:\t"{message_content[20:]}"...')
         logger('info', '{:<62} {:>16}'.format(f'Execution completed. Total runtime:', human_but_smaller(execution_time)))
         logger('none', f'{MARKER_CHAR * 140}\n')
-        print(message_content)
-
-        # Make sure to flush stdout to ensure immediate output
-        sys.stdout.flush()
-        exit(0)
+        return message_content
+
+    # Size the worker pool and give each ffmpeg (or segment) its share of the cores
+    jobs = resolve_jobs(options.jobs, PROFILE, len(targets_list))
+    segments = max(1, options.segments)
+    x265_params = x265_pool_params(jobs * segments) if jobs * segments > 1 else None
+    if jobs > 1:
+        logger('info', f'Encoding {jobs} targets at a time. x265 params per encode:\t {x265_params}')
+    renditions = [profile for profile in options.rendition or [] if profile != PROFILE]
+    if renditions:
+        logger('info', f'Also writing renditions from the same decode:\t {", ".join(renditions)}')
+    if options.target_quality:
+        logger('info', f'Searching each target for the highest CRF with {options.target_quality[0]} >= {options.target_quality[1]}')
+    if segments > 1:
+        logger('info', f'Splitting each target into up to {segments} segments. x265 params per segment:\t {x265_params}')
+
+    # Most (or least) expensive targets first, with --priority matches ahead of the rest
+    targets_list = order_targets(targets_list, PROFILE, options.order, options.priority, logger, workers=jobs, segments=segments)
+
+    # Forecast the batch from earlier runs: how long it should take and how much space it should give back
+    forecast = forecast_batch(targets_list, PROFILE, workers=jobs, segments=segments) if targets_list else None
+    if forecast:
+        logger('info', f'Forecast:\t {describe_forecast(forecast)}')
+
+    # Finish any background archive copies an earlier run left behind
+    resume_archive_moves(logger)
+
+    # Stage targets on fast local storage ahead of their encodes
+    stager = None
+    if options.scratch:
+        stager = ScratchStager(options.scratch, int(options.scratch_budget * 1024 ** 3), logger)
+        logger('info', f'Staging targets on scratch:\t {stager.work_dir}')
+        stager.prefetch_all(targets_list)
+
+    # Outputs are checked before their sources are archived (see encode())
+    verifier = None if options.no_verify else Verifier(logger)
+
+    # Back off while someone is using the machine: fewer encodes, lower priority, or paused
+    governor = None
+    if options.governor:
+        governor = Governor(logger, jobs)
+        governor.start()
+
+    def encode_target(loop_counter, f):
+        with governor.slot() if governor else contextlib.nullcontext():
+            logger('info', f'{MARKER_CHAR * 100}')
+            logger('info', f'Target ({loop_counter} of {len(targets_list)}):\t {f}')
+            return encode(f, x265_params=x265_params, segments=segments, abort_ratio=options.abort_ratio, stager=stager, adaptive=options.adaptive,
+                          renditions=renditions, verifier=verifier, cache=not options.no_cache,
+                          quality_target=options.target_quality, cancel=options.cancel, jobs=jobs)
 
-    loop_counter = 1
     success_counter = 0
     failed_list = []
     before_size_raw = 0
     after_size_raw = 0
-    for f in targets_list:
-        logger('info', f'{MARKER_CHAR * 100}')
-        logger('info', f'Target ({loop_counter} of {len(targets_list)})')
-        result, name, old_size, new_size = encode(f)
+    results = run_pool(encode_target, targets_list, jobs)
+
+    # Outputs that failed verification left their sources alone, and ones whose copy
+    # back from scratch or file operations failed never finished. Count them as failures.
+    failures = {}
+    if verifier:
+        verifier.close()
+        failures.update(verifier.failures)
+    if stager:
+        stager.close()
+        failures.update(stager.failures)
+    if failures:
+        results = [(0, name, old_size, old_size) if os.path.abspath(target) in failures else (result, name, old_size, new_size)
+                   for target, (result, name, old_size, new_size) in zip(targets_list, results)]
+    options.outcomes = {os.path.abspath(target): result for target, result in [*recovered_results.items(), *zip(targets_list, results)]}
+    results = [*recovered_results.values(), *results]
+    for result, name, old_size, new_size in results:
         success_counter = success_counter + result
         if result == 0:
             failed_list.append(name)
         before_size_raw += old_size
         after_size_raw += new_size
-        loop_counter += 1
+
+    if governor:
+        governor.stop()
+
+    # Let background archive copies finish before reporting
+    wait_for_archive_moves()
     logger('info', f'{MARKER_CHAR * 100}')
 
     execution_time = hm.precisedelta(dt.datetime.now() - START_TIME)
     saved_size = hm.naturalsize(before_size_raw - after_size_raw)
     body_str = 'Disk space recovered:  {}   ({}%)\nAvg. encode time: {}\nTime: {}'.format(
         saved_size, percentage_decrease(after_size_raw, before_size_raw),
-        human_but_smaller(hm.precisedelta((dt.datetime.now() - START_TIME) / len(targets_list))),
+        human_but_smaller(hm.precisedelta((dt.datetime.now() - START_TIME) / len(results))),
         human_but_smaller(execution_time)
     )
+    if skipped_list:
+        body_str += f'\nSkipped: {len(skipped_list)} (see log)'
+    if forecast:
+        body_str += f'\nForecast was: {describe_forecast(forecast, brief=True)}'
+
+    LOG_SINK.event(
+        'batch', profile=PROFILE, targets=len(results), failed=len(failed_list), skipped=len(skipped_list),
+        before_size=before_size_raw, after_size=after_size_raw, jobs=jobs, segments=segments,
+        seconds=round((dt.datetime.now() - START_TIME).total_seconds(), 3)
+    )
 
-    # Print notification content to stdout
-    message_content = create_notification_content(len(targets_list), failed_list, body_str)
-    print(message_content)
-
-    # Make sure to flush stdout to ensure immediate output
-    sys.stdout.flush()
+    message_content = create_notification_content(len(results), failed_list, body_str)
 
     # Write cumulative results to logfile
     logger('info', '{:>35} {:>16}'.format(' Total file size (targets passed): ', hm.naturalsize(before_size_raw)))
@@ -273,11 +691,25 @@ def main():
     logger('info', '{:>36} {:6} {:<16}'.format(
     	' Average file encoding time: ',
     	'',
-    	human_but_smaller(hm.precisedelta((dt.datetime.now() - START_TIME) / len(targets_list)))
+    	human_but_smaller(hm.precisedelta((dt.datetime.now() - START_TIME) / len(results)))
     ))
     logger('info', '{:>35} {:>16}'.format(' Total disk space recovered: ', saved_size))
     logger('info', '{:<62} {:>16}'.format(f'Execution completed. Total runtime: ', human_but_smaller(execution_time)))
     logger('none', f'{MARKER_CHAR * 140}\n')
+    return message_content
+####################################################################################
+
+
+####################################################################################
+def main():
+    options = parse_cli(sys.argv[1:], prog=os.path.basename(__file__))
+    message_content = run_batch(options)
+
+    # Print notification content to stdout
+    print(message_content)
+
+    # Make sure to flush stdout to ensure immediate output
+    sys.stdout.flush()
 ####################################################################################
 
 
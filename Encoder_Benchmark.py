@@ -0,0 +1,76 @@
+#!/usr/local/bin/python3.11
+import os
+import sys
+import argparse
+import datetime as dt
+from encoder_lib.benchmark import BASELINE_PATH, BENCH_DIR, CLIP_SPECS, compare, load_report, run_benchmark, save_report
+from encoder_lib.profiles import PROFILE_SCRIPTS
+
+####################################################################################
+# Global variables
+####################################################################################
+# Usage:
+#   Encoder_Benchmark.py                     run every profile against every clip and
+#                                            compare with the saved baseline
+#   Encoder_Benchmark.py --save-baseline     ...and make this run the new baseline
+#   Encoder_Benchmark.py --profile 720p --clip 1080p_medium_10s --repeat 3
+# Exits with status 1 when a result regressed against the baseline.
+START_TIME = dt.datetime.now()
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+####################################################################################
+# End Globals
+
+
+####################################################################################
+def logger(status, data):
+    # Benchmark output goes to the terminal. Failures are flagged, everything else printed as is.
+    prefix = '*** ' if status == 'failure' else ''
+    print(f'{prefix}{data}')
+    sys.stdout.flush()
+####################################################################################
+
+
+####################################################################################
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__))
+    parser.add_argument('--profile', action='append', choices=list(PROFILE_SCRIPTS),
+                        help='Profile to benchmark (repeatable, default all)')
+    parser.add_argument('--clip', action='append', choices=[spec['name'] for spec in CLIP_SPECS],
+                        help='Clip to encode (repeatable, default all)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Encode each clip N times and keep the median run')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='Baseline results to compare against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Save this run as the new baseline')
+    options = parser.parse_args()
+
+    profiles = options.profile or list(PROFILE_SCRIPTS)
+    clip_specs = [spec for spec in CLIP_SPECS if not options.clip or spec['name'] in options.clip]
+    report = run_benchmark(profiles, clip_specs, logger, repeat=options.repeat)
+
+    results_path = os.path.join(RESULTS_DIR, f'{START_TIME.strftime("%Y-%m-%d_%H%M%S")}.json')
+    save_report(report, results_path)
+    logger('info', f'Results saved to {results_path}')
+
+    regressions = []
+    if os.path.exists(options.baseline):
+        regressions = compare(report, load_report(options.baseline))
+        for line in regressions:
+            logger('failure', f'Regression: {line}')
+        if not regressions:
+            logger('info', f'No regressions against {options.baseline}')
+    else:
+        logger('info', 'No baseline to compare against yet. Save one with --save-baseline')
+
+    if options.save_baseline:
+        save_report(report, options.baseline)
+        logger('info', f'Baseline saved to {options.baseline}')
+
+    sys.exit(1 if regressions else 0)
+####################################################################################
+
+
+####################################################################################
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/local/bin/python3.11
+import os
+import sys
+import shlex
+import argparse
+import datetime as dt
+from encoder_lib.daemon import EncoderDaemon
+from encoder_lib.logsink import LogSink
+from encoder_lib.watch import SETTLE_SECONDS
+
+####################################################################################
+# Global variables
+####################################################################################
+MARKER_CHAR = '#'
+
+# Logging Parameters
+TODAY_DATESTAMP = dt.date.today().strftime("%Y-%m-%d")
+LOG_DIR = '/Users/scott/Logs/ffmpeg/Encoder_Daemon'
+LOG_NAME = f'{TODAY_DATESTAMP}.log'
+LOGFILE_FULL_PATH = os.path.join(LOG_DIR, LOG_NAME)
+
+# Create "LOG_DIR" if it doesn't exist
+os.makedirs(LOG_DIR, exist_ok=True)
+
+# Buffered writer for the logfile. Each batch also logs to its own script's logfile.
+LOG_SINK = LogSink(LOGFILE_FULL_PATH)
+####################################################################################
+# End Globals
+
+
+####################################################################################
+def logger(status, data):
+    status_list = ['none', 'info', 'success', 'failure', 'warning']
+    if status.lower() not in status_list:
+        status_key = 'UNKNOWN'
+    else:
+        status_key = status.upper()
+
+    # Hand the line to the log writer thread
+    log_timestamp = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    if status_key == 'NONE':
+        log_data = data
+    else:
+        log_data = '{:23} || {:^7} || {:<80}\n'.format(log_timestamp, status_key, data)
+    LOG_SINK.write(f'{log_data}')
+####################################################################################
+
+
+####################################################################################
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__))
+    parser.add_argument('--watch', action='append', default=[], metavar='PROFILE=DIR',
+                        help='Encode new files dropped into DIR with PROFILE (repeatable)')
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS, metavar='SECONDS',
+                        help=f'How long a dropped file must stop changing before it is queued (default {SETTLE_SECONDS})')
+    parser.add_argument('--watch-options', default='', metavar='OPTIONS',
+                        help='Encoder options for watched files, e.g. --watch-options="--jobs auto --force"')
+    options = parser.parse_args()
+    if any('=' not in item for item in options.watch):
+        parser.error('--watch takes PROFILE=DIR')
+    folders = dict(item.split('=', 1) for item in options.watch)
+
+    logger('none', f'\n\n{MARKER_CHAR * 140}\n')
+    logger('info', f'Starting encoder daemon:\t {__file__} (pid {os.getpid()})')
+    try:
+        daemon = EncoderDaemon(logger)
+        if folders:
+            daemon.watch(folders, argv=shlex.split(options.watch_options), settle_seconds=options.settle)
+        daemon.serve()
+    except (RuntimeError, ValueError) as e:
+        logger('failure', str(e))
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        logger('info', 'Encoder daemon stopped')
+####################################################################################
+
+
+####################################################################################
+if __name__ == "__main__":
+    main()
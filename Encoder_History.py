@@ -0,0 +1,95 @@
+#!/usr/local/bin/python3.11
+import os
+import sys
+import json
+import argparse
+import datetime as dt
+import humanize as hm
+from encoder_lib.history import REPORT_GROUPS, describe_forecast, forecast_batch, history_report, run_history
+from encoder_lib.profiles import PROFILE_SCRIPTS
+
+####################################################################################
+# Global variables
+####################################################################################
+# Usage:
+#   Encoder_History.py                          every finished job, by profile
+#   Encoder_History.py --by codec --days 30     last month's jobs, by source codec
+#   Encoder_History.py --profile 1080p --forecast <files>
+#                                               what a batch of files should take and save
+# Jobs are recorded by the encoding scripts in ~/.ffmpeg_encoding/run_history.sqlite.
+COLUMNS = ('runs', 'encoded', 'failed', 'average_seconds', 'speed', 'median_ratio', 'saved_bytes')
+####################################################################################
+# End Globals
+
+
+####################################################################################
+def logger(status, data):
+    # Report output goes to the terminal. Failures are flagged, everything else printed as is.
+    prefix = '*** ' if status == 'failure' else ''
+    print(f'{prefix}{data}')
+    sys.stdout.flush()
+####################################################################################
+
+
+####################################################################################
+def format_cell(column, value):
+    if value is None:
+        return '-'
+    if column == 'saved_bytes':
+        return hm.naturalsize(value)
+    if column == 'average_seconds':
+        return hm.precisedelta(dt.timedelta(seconds=value))
+    return str(value)
+####################################################################################
+
+
+####################################################################################
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__))
+    parser.add_argument('--profile', choices=list(PROFILE_SCRIPTS),
+                        help='Only jobs run with this profile (required with --forecast)')
+    parser.add_argument('--days', type=float, metavar='N',
+                        help='Only jobs finished in the last N days')
+    parser.add_argument('--by', choices=REPORT_GROUPS, default='profile',
+                        help='Group the report by this field (default profile)')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as JSON')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Concurrent encodes to forecast for (default 1)')
+    parser.add_argument('--forecast', nargs='+', metavar='FILE',
+                        help='Forecast the encode time and savings of these files instead of reporting')
+    options = parser.parse_args()
+
+    if options.forecast:
+        if not options.profile:
+            parser.error('--forecast needs --profile')
+        forecast = forecast_batch(options.forecast, options.profile, workers=max(1, options.jobs))
+        if options.json:
+            logger('info', json.dumps(forecast, default=str, indent=2))
+        else:
+            logger('info', f'{options.profile}, {forecast["targets"]} files: {describe_forecast(forecast)}')
+            logger('info', f'Based on {forecast["history"]} earlier encodes')
+        return
+
+    since = dt.datetime.now() - dt.timedelta(days=options.days) if options.days else None
+    rows = run_history(options.profile, since)
+    report = history_report(rows, options.by)
+    if options.json:
+        logger('info', json.dumps(report, indent=2))
+        return
+    if not report:
+        logger('info', 'No jobs recorded yet')
+        return
+
+    table = [[options.by, *COLUMNS]]
+    table += [[str(line[options.by]), *(format_cell(column, line[column]) for column in COLUMNS)] for line in report]
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    for row in table:
+        logger('info', '  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+    logger('info', f'{len(rows)} jobs from {rows[-1]["finished"]} to {rows[0]["finished"]}')
+####################################################################################
+
+
+####################################################################################
+if __name__ == "__main__":
+    main()
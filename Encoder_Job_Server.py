@@ -0,0 +1,85 @@
+#!/usr/local/bin/python3.11
+import os
+import sys
+import argparse
+import datetime as dt
+from encoder_lib.client import JOB_SERVER_PORT, JOB_SERVER_TOKEN_PATH, job_server_token
+from encoder_lib.jobserver import LEASE_SECONDS, JobServer
+from encoder_lib.logsink import LogSink
+
+####################################################################################
+# Global variables
+####################################################################################
+# Usage:
+#   Encoder_Job_Server.py [--host 0.0.0.0] [--port 8765]
+# Then start Encoder_Worker.py on each encoding host, and hand files over with
+# Send_to_Job_Server.py. Every host must see the files at the same path.
+# Listening on anything but loopback needs a shared token in $ENCODER_JOB_TOKEN
+# or ~/.ffmpeg_encoding/job_server.token, on this host and every other one.
+MARKER_CHAR = '#'
+
+# Logging Parameters
+TODAY_DATESTAMP = dt.date.today().strftime("%Y-%m-%d")
+LOG_DIR = '/Users/scott/Logs/ffmpeg/Encoder_Job_Server'
+LOG_NAME = f'{TODAY_DATESTAMP}.log'
+LOGFILE_FULL_PATH = os.path.join(LOG_DIR, LOG_NAME)
+
+# Create "LOG_DIR" if it doesn't exist
+os.makedirs(LOG_DIR, exist_ok=True)
+
+# Buffered writer for the logfile
+LOG_SINK = LogSink(LOGFILE_FULL_PATH)
+####################################################################################
+# End Globals
+
+
+####################################################################################
+def logger(status, data):
+    status_list = ['none', 'info', 'success', 'failure', 'warning']
+    if status.lower() not in status_list:
+        status_key = 'UNKNOWN'
+    else:
+        status_key = status.upper()
+
+    # Hand the line to the log writer thread
+    log_timestamp = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    if status_key == 'NONE':
+        log_data = data
+    else:
+        log_data = '{:23} || {:^7} || {:<80}\n'.format(log_timestamp, status_key, data)
+    LOG_SINK.write(f'{log_data}')
+####################################################################################
+
+
+####################################################################################
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__))
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on (default 127.0.0.1; 0.0.0.0 for all interfaces, which needs a token)')
+    parser.add_argument('--port', type=int, default=JOB_SERVER_PORT,
+                        help=f'Port to listen on (default {JOB_SERVER_PORT})')
+    parser.add_argument('--lease', type=float, default=LEASE_SECONDS, metavar='SECONDS',
+                        help=f'Requeue a job when its worker has been silent this long (default {LEASE_SECONDS})')
+    options = parser.parse_args()
+
+    logger('none', f'\n\n{MARKER_CHAR * 140}\n')
+    logger('info', f'Starting job server:\t {__file__} (pid {os.getpid()})')
+    try:
+        JobServer(logger, lease_seconds=options.lease).serve(options.host, options.port, token=job_server_token())
+    except ValueError as e:
+        message = f'{str(e)}. Set $ENCODER_JOB_TOKEN or write one to {JOB_SERVER_TOKEN_PATH}'
+        logger('failure', message)
+        print(message, file=sys.stderr)
+        sys.exit(1)
+    except OSError as e:
+        logger('failure', str(e))
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        logger('info', 'Job server stopped')
+####################################################################################
+
+
+####################################################################################
+if __name__ == "__main__":
+    main()
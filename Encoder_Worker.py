@@ -0,0 +1,76 @@
+#!/usr/local/bin/python3.11
+import os
+import argparse
+import platform
+import datetime as dt
+from encoder_lib.client import JOB_SERVER_URL
+from encoder_lib.logsink import LogSink
+from encoder_lib.worker import MISSED_HEARTBEATS, EncoderWorker
+
+####################################################################################
+# Global variables
+####################################################################################
+# Usage:
+#   Encoder_Worker.py [--server http://encoder-host:8765] [--name NAME]
+# Pulls jobs from Encoder_Job_Server.py one at a time. Each job also logs to its
+# profile's own logfile on this host. Several workers can run on one machine
+# (give them different names).
+MARKER_CHAR = '#'
+
+# Logging Parameters
+TODAY_DATESTAMP = dt.date.today().strftime("%Y-%m-%d")
+LOG_DIR = '/Users/scott/Logs/ffmpeg/Encoder_Worker'
+LOG_NAME = f'{TODAY_DATESTAMP}.log'
+LOGFILE_FULL_PATH = os.path.join(LOG_DIR, LOG_NAME)
+
+# Create "LOG_DIR" if it doesn't exist
+os.makedirs(LOG_DIR, exist_ok=True)
+
+# Buffered writer for the logfile
+LOG_SINK = LogSink(LOGFILE_FULL_PATH)
+####################################################################################
+# End Globals
+
+
+####################################################################################
+def logger(status, data):
+    status_list = ['none', 'info', 'success', 'failure', 'warning']
+    if status.lower() not in status_list:
+        status_key = 'UNKNOWN'
+    else:
+        status_key = status.upper()
+
+    # Hand the line to the log writer thread
+    log_timestamp = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    if status_key == 'NONE':
+        log_data = data
+    else:
+        log_data = '{:23} || {:^7} || {:<80}\n'.format(log_timestamp, status_key, data)
+    LOG_SINK.write(f'{log_data}')
+####################################################################################
+
+
+####################################################################################
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__))
+    parser.add_argument('--server', default=JOB_SERVER_URL,
+                        help=f'Job server URL (default {JOB_SERVER_URL}, or $ENCODER_JOB_SERVER)')
+    parser.add_argument('--name', default=platform.node(),
+                        help='Worker name reported to the server (default the host name)')
+    parser.add_argument('--missed-heartbeats', type=int, default=MISSED_HEARTBEATS, metavar='N',
+                        help=f'Give the job up after N heartbeats in a row fail to reach the server (default {MISSED_HEARTBEATS})')
+    options = parser.parse_args()
+
+    logger('none', f'\n\n{MARKER_CHAR * 140}\n')
+    logger('info', f'Starting encoder worker:\t {__file__} (pid {os.getpid()})')
+    try:
+        EncoderWorker(logger, name=options.name, server_url=options.server,
+                      missed_heartbeats=options.missed_heartbeats).run()
+    except KeyboardInterrupt:
+        logger('info', 'Encoder worker stopped')
+####################################################################################
+
+
+####################################################################################
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/local/bin/python3.11
+import os
+import sys
+import time
+import subprocess
+from encoder_lib.client import daemon_running, send_request
+
+####################################################################################
+# Global variables
+####################################################################################
+# Usage (as a Quick Action, or from a shell):
+#   Send_to_Encoder_Daemon.py 1080p|720p|reencode [encoder options] <files>
+# Hands the files to the resident encoder daemon and returns straight away. The
+# daemon is started if it isn't running, and posts the batch notification itself.
+DAEMON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Encoder_Daemon.py')
+DAEMON_START_SECONDS = 10
+
+# Notification Parameters
+MSG_TITLE = 'Encoder Daemon'
+####################################################################################
+# End Globals
+
+
+####################################################################################
+def start_daemon():
+    subprocess.Popen(
+        [sys.executable, DAEMON_SCRIPT],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    deadline = time.monotonic() + DAEMON_START_SECONDS
+    while time.monotonic() < deadline:
+        if daemon_running():
+            return True
+        time.sleep(0.2)
+    return False
+####################################################################################
+
+
+####################################################################################
+def main():
+    if len(sys.argv) < 2:
+        print(f'{MSG_TITLE}|No profile given|Usage: {os.path.basename(__file__)} 1080p|720p|reencode [options] <files>')
+        sys.exit(2)
+    profile, argv = sys.argv[1], sys.argv[2:]
+
+    if not daemon_running() and not start_daemon():
+        print(f'{MSG_TITLE}|Could not start the encoder daemon|See the Encoder_Daemon log')
+        sys.exit(1)
+
+    reply = send_request({'op': 'submit', 'profile': profile, 'argv': argv, 'cwd': os.getcwd()})
+    if reply.get('ok'):
+        message_content = f'{MSG_TITLE}|Queued for {profile}|Position in queue: {reply["position"]}'
+    else:
+        message_content = f'{MSG_TITLE}|Nothing queued|{reply.get("error")}'
+
+    # Print notification content to stdout
+    print(message_content)
+
+    # Make sure to flush stdout to ensure immediate output
+    sys.stdout.flush()
+####################################################################################
+
+
+####################################################################################
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/local/bin/python3.11
+import os
+import sys
+from encoder_lib.client import JOB_SERVER_URL, server_request
+
+####################################################################################
+# Global variables
+####################################################################################
+# Usage (as a Quick Action, or from a shell):
+#   Send_to_Job_Server.py 1080p|720p|reencode [encoder options] <files>
+# Queues each file as its own job on the job server ($ENCODER_JOB_SERVER, default
+# http://localhost:8765) and returns straight away. The files must be on storage
+# the worker hosts mount at the same path.
+
+# Notification Parameters
+MSG_TITLE = 'Encoder Job Server'
+####################################################################################
+# End Globals
+
+
+####################################################################################
+def main():
+    if len(sys.argv) < 2:
+        print(f'{MSG_TITLE}|No profile given|Usage: {os.path.basename(__file__)} 1080p|720p|reencode [options] <files>')
+        sys.exit(2)
+    profile, argv = sys.argv[1], sys.argv[2:]
+
+    try:
+        reply = server_request('/submit', {'profile': profile, 'argv': argv, 'cwd': os.getcwd()})
+    except OSError as e:
+        print(f'{MSG_TITLE}|Could not reach the job server|{JOB_SERVER_URL}: {str(e)}')
+        sys.exit(1)
+    if reply.get('ok'):
+        message_content = f'{MSG_TITLE}|Queued for {profile}|{reply["queued"]} jobs'
+    else:
+        message_content = f'{MSG_TITLE}|Nothing queued|{reply.get("error")}'
+
+    # Print notification content to stdout
+    print(message_content)
+
+    # Make sure to flush stdout to ensure immediate output
+    sys.stdout.flush()
+####################################################################################
+
+
+####################################################################################
+if __name__ == "__main__":
+    main()
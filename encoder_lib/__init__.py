@@ -0,0 +1,3 @@
+# Shared helpers for the Encode_as_*/Re-encode_as_* Quick Action scripts.
+# Each script stays runnable on its own; anything used by more than one
+# of them lives here.
@@ -0,0 +1,173 @@
+import os
+import queue
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+import humanize as hm
+from encoder_lib.common import INDENT, STATE_DIR
+
+####################################################################################
+# Archive parameters
+####################################################################################
+# Cross-volume copies waiting for the background mover. When it is this far
+# behind, the next archive waits for a slot instead of piling up copies.
+MAX_PENDING_MOVES = 2
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+COPY_LOG_FRACTION = 0.25
+
+# Copies are verified by size plus a hash of evenly spaced samples, which
+# catches truncated or misplaced data without reading both files in full again
+VERIFY_SAMPLES = 16
+VERIFY_SAMPLE_BYTES = 1024 * 1024
+
+# Moves still in flight, so a run that dies mid-copy can finish them next time
+MOVES_DB_PATH = os.path.join(STATE_DIR, 'archive_moves.sqlite')
+MOVES_DB_LOCK = threading.Lock()
+####################################################################################
+
+_move_queue = queue.Queue(maxsize=MAX_PENDING_MOVES)
+_mover_lock = threading.Lock()
+_mover = None
+
+
+####################################################################################
+def _moves_connection():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    connection = sqlite3.connect(MOVES_DB_PATH, timeout=30)
+    connection.execute('CREATE TABLE IF NOT EXISTS moves (staged TEXT PRIMARY KEY, dest TEXT)')
+    return connection
+####################################################################################
+
+
+####################################################################################
+def _record_move(staged, dest):
+    with MOVES_DB_LOCK, closing(_moves_connection()) as connection, connection:
+        connection.execute('INSERT OR REPLACE INTO moves (staged, dest) VALUES (?, ?)', (staged, dest))
+####################################################################################
+
+
+####################################################################################
+def _forget_move(staged):
+    with MOVES_DB_LOCK, closing(_moves_connection()) as connection, connection:
+        connection.execute('DELETE FROM moves WHERE staged = ?', (staged,))
+####################################################################################
+
+
+####################################################################################
+def sampled_digest(path, size):
+    digest = hashlib.blake2b()
+    offsets = {max(0, (size - VERIFY_SAMPLE_BYTES) * i // max(1, VERIFY_SAMPLES - 1)) for i in range(VERIFY_SAMPLES)}
+    with open(path, 'rb') as pipe:
+        for offset in sorted(offsets):
+            pipe.seek(offset)
+            digest.update(pipe.read(VERIFY_SAMPLE_BYTES))
+    return digest.hexdigest()
+####################################################################################
+
+
+####################################################################################
+# Copy to "<dest>.partial", fsync, verify, then rename into place, so the
+# archive never holds a half-written file under the real name
+def copy_verified(source, dest, log):
+    size = os.path.getsize(source)
+    partial = f'{dest}.partial'
+    name = os.path.basename(dest)
+    next_log = COPY_LOG_FRACTION
+    copied = 0
+
+    with open(source, 'rb') as src_pipe, open(partial, 'wb') as dst_pipe:
+        while True:
+            chunk = src_pipe.read(COPY_CHUNK_BYTES)
+            if not chunk:
+                break
+            dst_pipe.write(chunk)
+            copied += len(chunk)
+            if size and copied / size >= next_log and copied < size:
+                log('info', f'{INDENT}Archive copy of "{name}":\t {copied / size:.0%} of {hm.naturalsize(size)}')
+                while next_log <= copied / size:
+                    next_log += COPY_LOG_FRACTION
+        dst_pipe.flush()
+        os.fsync(dst_pipe.fileno())
+
+    if os.path.getsize(partial) != size or sampled_digest(partial, size) != sampled_digest(source, size):
+        os.remove(partial)
+        raise OSError(f'Archive copy of "{name}" did not verify')
+    os.replace(partial, dest)
+####################################################################################
+
+
+####################################################################################
+def _mover_loop():
+    while True:
+        staged, dest, log = _move_queue.get()
+        name = os.path.basename(dest)
+        try:
+            copy_verified(staged, dest, log)
+            os.remove(staged)
+            _forget_move(staged)
+            log('success', f'{INDENT}Archive copy of "{name}" verified and completed')
+        except Exception as e:
+            log('failure', f'{INDENT}Background archive of "{name}" failed. Source left at "{staged}". Please perform manually')
+            log('failure', f'{INDENT}Response:\t {str(e)}')
+        finally:
+            _move_queue.task_done()
+####################################################################################
+
+
+####################################################################################
+def _queue_move(staged, dest, log):
+    global _mover
+    with _mover_lock:
+        if _mover is None or not _mover.is_alive():
+            _mover = threading.Thread(target=_mover_loop, name='archive-mover', daemon=True)
+            _mover.start()
+    _move_queue.put((staged, dest, log))
+####################################################################################
+
+
+####################################################################################
+# Move a source file into archive_dir without holding up the encode loop.
+#   Same volume:   one atomic rename, whatever the file size. A reflink or
+#                  hardlink would cost more and neither can cross volumes.
+#   Other volume:  rename the source aside on its own volume (instant, frees its
+#                  name for the encoded file), then copy, verify and delete it
+#                  on the background mover.
+# Returns 'renamed' or 'queued'. Raises OSError if the source can't be moved at all.
+def archive_source(target_file, archive_dir, log):
+    os.makedirs(archive_dir, exist_ok=True)
+    name = os.path.basename(target_file)
+    dest = os.path.join(archive_dir, name)
+
+    if os.stat(target_file).st_dev == os.stat(archive_dir).st_dev:
+        os.replace(target_file, dest)
+        return 'renamed'
+
+    staged = os.path.join(os.path.dirname(os.path.abspath(target_file)), f'.{name}.ARCHIVING')
+    os.replace(target_file, staged)
+    _record_move(staged, dest)
+    log('info', f'{INDENT}Archive is on another volume. Copying "{name}" in the background')
+    _queue_move(staged, dest, log)
+    return 'queued'
+####################################################################################
+
+
+####################################################################################
+# Re-queue copies an earlier run staged but never finished
+def resume_archive_moves(log):
+    with MOVES_DB_LOCK, closing(_moves_connection()) as connection:
+        rows = connection.execute('SELECT staged, dest FROM moves').fetchall()
+    for staged, dest in rows:
+        if os.path.exists(staged):
+            log('info', f'{INDENT}Resuming background archive of "{os.path.basename(dest)}"')
+            _queue_move(staged, dest, log)
+        else:
+            _forget_move(staged)
+####################################################################################
+
+
+####################################################################################
+# Block until every queued archive copy has finished
+def wait_for_archive_moves():
+    _move_queue.join()
+####################################################################################
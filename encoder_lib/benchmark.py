@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import datetime as dt
+from encoder_lib.common import FF_BIN, INDENT, STATE_DIR, run_ffmpeg
+from encoder_lib.profiles import load_profile
+
+####################################################################################
+# Benchmark parameters
+####################################################################################
+BENCH_DIR = os.path.join(STATE_DIR, 'benchmarks')
+CLIP_DIR = os.path.join(BENCH_DIR, 'clips')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+# Synthetic sources, from flat bars through to a busy pattern with temporal noise.
+# Every parameter is fixed (including the noise seed), so the same clip comes out
+# of the same ffmpeg build every time.
+CLIP_RATE = 24
+COMPLEXITY_SOURCES = {
+    'low': 'smptehdbars=size={width}x{height}:rate={rate}',
+    'medium': 'testsrc2=size={width}x{height}:rate={rate}',
+    'high': 'testsrc2=size={width}x{height}:rate={rate},noise=alls=30:allf=t+u:all_seed=1',
+}
+CLIP_SPECS = [
+    {'name': '720p_medium_10s', 'width': 1280, 'height': 720, 'seconds': 10, 'complexity': 'medium'},
+    {'name': '1080p_low_10s', 'width': 1920, 'height': 1080, 'seconds': 10, 'complexity': 'low'},
+    {'name': '1080p_medium_10s', 'width': 1920, 'height': 1080, 'seconds': 10, 'complexity': 'medium'},
+    {'name': '1080p_high_10s', 'width': 1920, 'height': 1080, 'seconds': 10, 'complexity': 'high'},
+    {'name': '1080p_medium_30s', 'width': 1920, 'height': 1080, 'seconds': 30, 'complexity': 'medium'},
+    {'name': '2160p_medium_10s', 'width': 3840, 'height': 2160, 'seconds': 10, 'complexity': 'medium'},
+]
+
+# Source clips are high-bitrate H.264 + AAC, like the files the profiles usually get
+CLIP_SWITCHES = [
+    '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '16', '-pix_fmt', 'yuv420p', '-x264-params', 'threads=4',
+    '-c:a', 'aac', '-b:a', '192k', '-fflags', '+bitexact', '-flags', '+bitexact',
+]
+
+# Changes beyond these against the baseline are reported as regressions
+FPS_TOLERANCE = 0.05
+CPU_TOLERANCE = 0.05
+SIZE_TOLERANCE = 0.02
+####################################################################################
+
+
+####################################################################################
+# Generate a clip the first time it's needed, then reuse it
+def make_clip(spec):
+    os.makedirs(CLIP_DIR, exist_ok=True)
+    clip_path = os.path.join(CLIP_DIR, f'{spec["name"]}.mp4')
+    if os.path.exists(clip_path):
+        return clip_path
+
+    video_source = COMPLEXITY_SOURCES[spec['complexity']].format(rate=CLIP_RATE, **spec)
+    partial = f'{clip_path}.partial.mp4'
+    run_ffmpeg([
+        FF_BIN, '-hide_banner', '-y',
+        '-f', 'lavfi', '-i', video_source,
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(spec['seconds']), *CLIP_SWITCHES, partial
+    ])
+    os.replace(partial, clip_path)
+    return clip_path
+####################################################################################
+
+
+####################################################################################
+# Run a command and return its wall time, CPU time (user + system, including
+# ffmpeg's threads) and peak resident set size in bytes
+def measure(command):
+    started = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.monotonic() - started
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return {'wall_time': wall_time, 'cpu_time': usage.ru_utime + usage.ru_stime, 'peak_rss': peak_rss}
+####################################################################################
+
+
+####################################################################################
+# The exact ffmpeg command a profile's encode() runs, minus the per-file extras
+def profile_command(profile, input_file, output_file):
+    module = load_profile(profile)
+    return [module.FF_BIN, '-y', *module.FF_EXECUTION_FLAGS, input_file, *module.FF_SWITCHES, 'title=benchmark', output_file]
+####################################################################################
+
+
+####################################################################################
+def ffmpeg_version():
+    try:
+        return run_ffmpeg([FF_BIN, '-version']).stdout.decode().splitlines()[0]
+    except Exception:
+        return 'unknown'
+####################################################################################
+
+
+####################################################################################
+# Encode every clip with every profile. With repeat > 1 the run with the median
+# wall time is kept. Returns a results document ready to be saved as JSON.
+def run_benchmark(profiles, clip_specs, log, repeat=1):
+    results = []
+    for spec in clip_specs:
+        log('info', f'Preparing clip {spec["name"]}')
+        clip_path = make_clip(spec)
+        clip_size = os.path.getsize(clip_path)
+        frames = spec['seconds'] * CLIP_RATE
+
+        for profile in profiles:
+            output_file = os.path.join(BENCH_DIR, f'out_{profile}_{spec["name"]}.mp4')
+            runs = []
+            for _ in range(max(1, repeat)):
+                runs.append(measure(profile_command(profile, clip_path, output_file)))
+            run = sorted(runs, key=lambda r: r['wall_time'])[len(runs) // 2]
+            output_size = os.path.getsize(output_file)
+            os.remove(output_file)
+
+            result = {
+                'profile': profile,
+                'clip': spec['name'],
+                'fps': round(frames / run['wall_time'], 2),
+                'wall_time': round(run['wall_time'], 3),
+                'cpu_time': round(run['cpu_time'], 3),
+                'peak_rss': run['peak_rss'],
+                'size_ratio': round(output_size / clip_size, 4),
+            }
+            results.append(result)
+            log('info', f'{INDENT}{profile:>8} {spec["name"]:<18} {result["fps"]:>8} fps '
+                        f'{result["cpu_time"]:>9}s cpu {result["peak_rss"] // 2 ** 20:>6} MiB {result["size_ratio"]:>8} size')
+
+    return {
+        'created': dt.datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version(),
+        'repeat': repeat,
+        'results': results,
+    }
+####################################################################################
+
+
+####################################################################################
+# Compare a run against a baseline. Returns human-readable regression lines;
+# an empty list means nothing got worse beyond the tolerances.
+def compare(report, baseline):
+    previous = {(r['profile'], r['clip']): r for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        before = previous.get((result['profile'], result['clip']))
+        if not before:
+            continue
+        key = f'{result["profile"]} / {result["clip"]}'
+        if result['fps'] < before['fps'] * (1 - FPS_TOLERANCE):
+            regressions.append(f'{key}: fps {before["fps"]} -> {result["fps"]}')
+        if result['cpu_time'] > before['cpu_time'] * (1 + CPU_TOLERANCE):
+            regressions.append(f'{key}: cpu time {before["cpu_time"]}s -> {result["cpu_time"]}s')
+        if result['size_ratio'] > before['size_ratio'] * (1 + SIZE_TOLERANCE):
+            regressions.append(f'{key}: size ratio {before["size_ratio"]} -> {result["size_ratio"]}')
+    return regressions
+####################################################################################
+
+
+####################################################################################
+def save_report(report, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as pipe:
+        json.dump(report, pipe, indent=2)
+####################################################################################
+
+
+####################################################################################
+def load_report(path):
+    with open(path) as pipe:
+        return json.load(pipe)
+####################################################################################
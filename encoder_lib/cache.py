@@ -0,0 +1,144 @@
+import os
+import re
+import json
+import shutil
+import sqlite3
+import hashlib
+import threading
+import subprocess
+from contextlib import closing
+from encoder_lib.archive import sampled_digest
+from encoder_lib.common import FF_BIN, STATE_DIR, run_ffmpeg
+from encoder_lib.probe import probe_cached, streams_of_type
+
+####################################################################################
+# Encode cache parameters
+####################################################################################
+# Sources are fingerprinted by size plus a hash of evenly spaced samples (see
+# archive.sampled_digest), so a re-download or a copy on another volume is
+# recognised without reading it in full. Fingerprints are cached by path, size
+# and mtime, like probes.
+#
+# Each finished output is recorded against its source's fingerprint and the
+# encode settings. A later source with the same content and settings gets a
+# copy of that output instead of an encode, for as long as the output is still
+# where it was left, unchanged.
+ENCODE_CACHE_PATH = os.path.join(STATE_DIR, 'encode_cache.sqlite')
+ENCODE_CACHE_LOCK = threading.Lock()
+####################################################################################
+
+
+####################################################################################
+def _cache_connection():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    connection = sqlite3.connect(ENCODE_CACHE_PATH, timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS fingerprints ('
+        'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, fingerprint TEXT)'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS outputs ('
+        'fingerprint TEXT, settings TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, '
+        'PRIMARY KEY (fingerprint, settings))'
+    )
+    return connection
+####################################################################################
+
+
+####################################################################################
+def content_fingerprint(target_file):
+    path = os.path.abspath(target_file)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+
+    with ENCODE_CACHE_LOCK, closing(_cache_connection()) as connection:
+        row = connection.execute(
+            'SELECT fingerprint FROM fingerprints WHERE path = ? AND size = ? AND mtime_ns = ?', key
+        ).fetchone()
+    if row:
+        return row[0]
+
+    fingerprint = f'{stat.st_size}:{sampled_digest(path, stat.st_size)}'
+    with ENCODE_CACHE_LOCK, closing(_cache_connection()) as connection, connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO fingerprints (path, size, mtime_ns, fingerprint) VALUES (?, ?, ?, ?)',
+            (*key, fingerprint)
+        )
+    return fingerprint
+####################################################################################
+
+
+####################################################################################
+# Everything about an encode that shapes its output: the profile and the planned
+# ffmpeg switches (filters, CRF/preset, stream mapping). The per-encode thread
+# budget and the title are left out.
+def settings_key(profile, switches):
+    return hashlib.blake2b(json.dumps([profile, list(switches)]).encode(), digest_size=16).hexdigest()
+####################################################################################
+
+
+####################################################################################
+# The output an earlier encode of this content left, or None. Entries whose
+# output has since been moved, replaced or deleted are dropped.
+def cached_output(fingerprint, settings):
+    with ENCODE_CACHE_LOCK, closing(_cache_connection()) as connection:
+        row = connection.execute(
+            'SELECT path, size, mtime_ns FROM outputs WHERE fingerprint = ? AND settings = ?', (fingerprint, settings)
+        ).fetchone()
+    if not row:
+        return None
+
+    path, size, mtime_ns = row
+    try:
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+            return path
+    except OSError:
+        pass
+    with ENCODE_CACHE_LOCK, closing(_cache_connection()) as connection, connection:
+        connection.execute('DELETE FROM outputs WHERE fingerprint = ? AND settings = ?', (fingerprint, settings))
+    return None
+####################################################################################
+
+
+####################################################################################
+# Record where a finished output ended up
+def store_output(fingerprint, settings, output_file):
+    path = os.path.abspath(output_file)
+    stat = os.stat(path)
+    with ENCODE_CACHE_LOCK, closing(_cache_connection()) as connection, connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO outputs (fingerprint, settings, path, size, mtime_ns) VALUES (?, ?, ?, ?, ?)',
+            (fingerprint, settings, path, stat.st_size, stat.st_mtime_ns)
+        )
+####################################################################################
+
+
+####################################################################################
+# A copy-on-write clone where the filesystem has them (APFS), otherwise a plain copy
+def clone_file(source, dest):
+    if subprocess.run(['cp', '-c', source, dest], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode:
+        shutil.copyfile(source, dest)
+####################################################################################
+
+
+####################################################################################
+# Make output_file from a cached output. The title is the only thing that
+# depends on the file name: when it already matches, the file is cloned;
+# otherwise the streams are copied into a new file with the new title.
+def reuse_output(cached_file, output_file, metadata_title_string):
+    probe_data = probe_cached(cached_file)
+    if f'title={probe_data.get("format", {}).get("tags", {}).get("title")}' == metadata_title_string:
+        clone_file(cached_file, output_file)
+        return
+
+    video_streams = streams_of_type(probe_data, 'video')
+    tag = video_streams[0].get('codec_tag_string', '') if video_streams else ''
+    tag_switches = ['-tag:v', tag] if re.fullmatch(r'[0-9A-Za-z]{4}', tag) else []
+    run_ffmpeg([
+        FF_BIN, '-hide_banner', '-y', '-i', cached_file,
+        '-map', '0', '-c', 'copy', *tag_switches,
+        '-map_metadata', '-1', '-metadata', metadata_title_string,
+        output_file
+    ])
+####################################################################################
@@ -0,0 +1,87 @@
+import io
+import os
+import argparse
+import contextlib
+from encoder_lib.profiles import PROFILE_SCRIPTS
+from encoder_lib.quality import parse_quality_target
+from encoder_lib.schedule import SCHEDULE_ORDERS
+
+
+####################################################################################
+# argparse type for --jobs: a positive number of encodes, or "auto"
+def parse_jobs(value):
+    if value.strip().lower() == 'auto':
+        return 'auto'
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected a number or "auto", got "{value}"')
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(f'expected at least 1, got {jobs}')
+    return jobs
+####################################################################################
+
+
+####################################################################################
+# Parse the Quick Action arguments. Finder passes the selected files as plain
+# positional arguments, so every option has to be optional.
+def parse_cli(argv, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('--jobs', type=parse_jobs, default=1,
+                        help='Concurrent encodes: a number, or "auto" to size by CPU cores')
+    parser.add_argument('--segments', type=int, default=1,
+                        help='Split each file at keyframes and encode N segments in parallel')
+    parser.add_argument('--force', action='store_true',
+                        help='Encode every target, even ones the pre-flight probe would skip')
+    parser.add_argument('--min-savings', type=float, default=None, metavar='PERCENT',
+                        help='Sample-encode each file first and skip it if the predicted saving is below PERCENT')
+    parser.add_argument('--abort-ratio', type=float, default=1.0, metavar='FRACTION',
+                        help='Abort an encode projected to end up larger than FRACTION of the source (0 disables)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Scan each file first and pick CRF/preset by how complex it is')
+    parser.add_argument('--target-quality', type=parse_quality_target, metavar='METRIC=SCORE',
+                        help='Per file, use the highest CRF whose sampled quality meets the target, e.g. vmaf=93 or ssim=0.98')
+    parser.add_argument('--scratch', metavar='DIR',
+                        help='Copy sources to fast local storage in DIR, encode there and copy the output back')
+    parser.add_argument('--scratch-budget', type=float, default=100, metavar='GB',
+                        help='Most space to use under --scratch at once (default 100)')
+    parser.add_argument('--rendition', action='append', choices=list(PROFILE_SCRIPTS), metavar='PROFILE',
+                        help='Also write PROFILE\'s rendition of each file from the same decode (repeatable)')
+    parser.add_argument('--order', choices=SCHEDULE_ORDERS, default='given',
+                        help='Run order: as given, longest-first (shortest batch with --jobs) or shortest-first (space back sooner)')
+    parser.add_argument('--priority', action='append', metavar='PATTERN',
+                        help='Encode targets whose path or name matches this glob first (repeatable, in order)')
+    parser.add_argument('--governor', action='store_true',
+                        help='Back off (fewer encodes, lower priority, pauses) while the machine is in use or short of memory')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='Archive and replace sources without checking the encoded file first')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Encode every target, even ones whose content was encoded before with the same settings')
+    parser.add_argument('--resume', action='store_true',
+                        help='Also pick up every target an earlier run of this profile left unfinished')
+    parser.add_argument('targets', nargs='*')
+
+    # Not options: a worker agent puts a threading.Event in cancel to stop its job, and
+    # reads this run's result for its target from outcomes (see encoder_lib.worker)
+    parser.set_defaults(cancel=None, outcomes=None)
+    return parser.parse_args(argv)
+####################################################################################
+
+
+####################################################################################
+# Parse a command line handed over by a client (the daemon, the job server) for
+# a profile. argparse's complaint is raised as a ValueError for the client
+# instead of going to stderr. Relative targets are taken from the client's cwd.
+def parse_submission(profile, argv, cwd=None):
+    if profile not in PROFILE_SCRIPTS:
+        raise ValueError(f'Unknown profile "{profile}". Expected one of: {", ".join(PROFILE_SCRIPTS)}')
+
+    errors = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(errors):
+            options = parse_cli(argv, prog=PROFILE_SCRIPTS[profile])
+    except SystemExit:
+        raise ValueError(errors.getvalue().strip().splitlines()[-1] if errors.getvalue().strip() else 'Invalid options')
+    options.targets = [os.path.join(cwd or '/', target) for target in options.targets]
+    return options
+####################################################################################
@@ -0,0 +1,75 @@
+import os
+import json
+import socket
+import urllib.request
+from encoder_lib.common import STATE_DIR
+
+####################################################################################
+# Client parameters
+####################################################################################
+# Kept to the standard library so a Quick Action that only hands files to the
+# daemon starts and exits quickly
+SOCKET_PATH = os.path.join(STATE_DIR, 'encoder.sock')
+REQUEST_TIMEOUT_SECONDS = 10
+
+# Job server shared by the encoding hosts (see Encoder_Job_Server.py)
+JOB_SERVER_PORT = 8765
+JOB_SERVER_URL = os.environ.get('ENCODER_JOB_SERVER', f'http://localhost:{JOB_SERVER_PORT}')
+
+# Shared secret the job server, its workers and submitters all hold: taken from
+# $ENCODER_JOB_TOKEN, or else the first line of this file
+JOB_SERVER_TOKEN_PATH = os.path.join(STATE_DIR, 'job_server.token')
+####################################################################################
+
+
+####################################################################################
+# The job server token, or None when neither the variable nor the file is set
+def job_server_token():
+    token = os.environ.get('ENCODER_JOB_TOKEN')
+    if not token and os.path.exists(JOB_SERVER_TOKEN_PATH):
+        with open(JOB_SERVER_TOKEN_PATH) as pipe:
+            token = pipe.readline()
+    return token.strip() if token and token.strip() else None
+####################################################################################
+
+
+####################################################################################
+# Send one JSON request to the daemon and return its JSON reply. Raises OSError
+# (ConnectionRefusedError/FileNotFoundError) when no daemon is listening.
+def send_request(request, socket_path=SOCKET_PATH, timeout=REQUEST_TIMEOUT_SECONDS):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        with connection.makefile('rb') as pipe:
+            reply = pipe.readline()
+    if not reply:
+        raise ConnectionError('Encoder daemon closed the connection without replying')
+    return json.loads(reply)
+####################################################################################
+
+
+####################################################################################
+def daemon_running(socket_path=SOCKET_PATH):
+    try:
+        send_request({'op': 'status'}, socket_path=socket_path, timeout=2)
+        return True
+    except (OSError, ValueError):
+        return False
+####################################################################################
+
+
+####################################################################################
+# POST a JSON request to the job server (GET when there is no payload) and
+# return its JSON reply. Raises OSError (URLError) when the server can't be
+# reached, or turns the request down (HTTPError 401 for a missing or wrong token).
+def server_request(path, payload=None, server_url=JOB_SERVER_URL, timeout=REQUEST_TIMEOUT_SECONDS):
+    data = json.dumps(payload).encode() if payload is not None else None
+    headers = {'Content-Type': 'application/json'}
+    token = job_server_token()
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    request = urllib.request.Request(server_url.rstrip('/') + path, data=data, headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+####################################################################################
@@ -0,0 +1,48 @@
+import contextlib
+import contextvars
+import subprocess
+
+####################################################################################
+# Shared settings
+####################################################################################
+FF_BIN = '/usr/local/bin/ffmpeg'
+FF_PROBE_BIN = '/usr/local/bin/ffprobe'
+
+# Caches and other state kept between runs
+STATE_DIR = '/Users/scott/.ffmpeg_encoding'
+
+# Indent used by the scripts for per-file log lines: f'{SPACER * 3} '
+INDENT = ' ' * 4
+
+# The encode slot (see governor.Governor.slot) the running code belongs to, and
+# the slot each running ffmpeg was started from, so the governor can hold back
+# whole encodes in the order they started
+ENCODE_SLOT = contextvars.ContextVar('encode_slot', default=None)
+PROCESS_SLOTS = {}
+####################################################################################
+
+
+####################################################################################
+# Tie a child process to the current encode slot for as long as it runs
+@contextlib.contextmanager
+def slot_process(pid):
+    slot = ENCODE_SLOT.get()
+    if slot is not None:
+        PROCESS_SLOTS[pid] = slot
+    try:
+        yield
+    finally:
+        PROCESS_SLOTS.pop(pid, None)
+####################################################################################
+
+
+####################################################################################
+# Run an ffmpeg/ffprobe command list, raising CalledProcessError on failure
+def run_ffmpeg(command):
+    with subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process, \
+            slot_process(process.pid):
+        stdout, stderr = process.communicate()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+####################################################################################
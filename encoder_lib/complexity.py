@@ -0,0 +1,106 @@
+import os
+import re
+import tempfile
+from encoder_lib.common import FF_BIN, run_ffmpeg
+from encoder_lib.probe import probe_cached, probe_duration
+
+####################################################################################
+# Complexity parameters
+####################################################################################
+# The scan encodes a few short, downscaled windows of the source with a fast
+# fixed-quality encoder. How many bits that takes per pixel is a cheap stand-in
+# for how much detail and motion the source has; scdet counts the scene cuts.
+ANALYSIS_WIDTH = 320
+WINDOW_COUNT = 3
+WINDOW_SECONDS = 10
+SCENE_THRESHOLD = 10
+
+# Bits per pixel of the scan encode at which a source moves up a class
+CLASS_BPP_LIMITS = (('low', 0.08), ('medium', 0.25))
+# Sources cut this often (sports, trailers, music videos) are at least medium
+CUTS_PER_MINUTE_MEDIUM = 12
+
+# Encoder settings per class: easy content gets a faster preset, demanding
+# content a lower CRF so it keeps its detail
+COMPLEXITY_CLASSES = {
+    'low': {'crf': '26', 'preset': 'fast'},
+    'medium': {'crf': '25', 'preset': 'medium'},
+    'high': {'crf': '23', 'preset': 'medium'},
+}
+####################################################################################
+
+
+####################################################################################
+def window_starts(duration):
+    if duration <= WINDOW_COUNT * WINDOW_SECONDS:
+        return [0.0]
+    return [duration * (i + 0.5) / WINDOW_COUNT - WINDOW_SECONDS / 2 for i in range(WINDOW_COUNT)]
+####################################################################################
+
+
+####################################################################################
+# Scan the source and sort it into a complexity class. Returns a dict with the
+# class, the measurements behind it and the crf/preset to use, or None when the
+# source can't be scanned (no duration).
+def analyze_complexity(target_file):
+    duration = probe_duration(probe_cached(target_file))
+    if not duration:
+        return None
+
+    bits = pixels = cuts = 0
+    scanned_seconds = 0.0
+    with tempfile.TemporaryDirectory(prefix='encode_complexity_') as work_dir:
+        for index, start in enumerate(window_starts(duration)):
+            scan_file = os.path.join(work_dir, f'scan_{index}.mkv')
+            result = run_ffmpeg([
+                FF_BIN, '-hide_banner', '-nostats',
+                '-ss', f'{start:.3f}', '-t', str(WINDOW_SECONDS), '-i', target_file,
+                '-map', '0:v:0', '-an', '-sn',
+                '-vf', f'scale={ANALYSIS_WIDTH}:-2,scdet=threshold={SCENE_THRESHOLD},showinfo',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '23',
+                scan_file
+            ])
+            log_text = result.stderr.decode(errors='replace')
+            frames = len(re.findall(r'\] n:\s*\d+', log_text))
+            size = re.search(r'Video:.* (\d+)x(\d+)', log_text.split('Output #0')[-1])
+            width, height = (int(size.group(1)), int(size.group(2))) if size else (ANALYSIS_WIDTH, ANALYSIS_WIDTH * 9 // 16)
+
+            bits += os.path.getsize(scan_file) * 8
+            pixels += width * height * frames
+            cuts += log_text.count('lavfi.scd.time')
+            scanned_seconds += min(WINDOW_SECONDS, duration - start)
+
+    bpp = bits / pixels if pixels else 0.0
+    cuts_per_minute = cuts * 60 / scanned_seconds if scanned_seconds else 0.0
+
+    complexity = 'high'
+    for name, limit in CLASS_BPP_LIMITS:
+        if bpp < limit:
+            complexity = name
+            break
+    if complexity == 'low' and cuts_per_minute >= CUTS_PER_MINUTE_MEDIUM:
+        complexity = 'medium'
+
+    return {
+        'complexity': complexity,
+        'bpp': round(bpp, 4),
+        'cuts_per_minute': round(cuts_per_minute, 1),
+        **COMPLEXITY_CLASSES[complexity],
+    }
+####################################################################################
+
+
+####################################################################################
+# Copy of an ffmpeg switch list with the CRF and preset swapped in. A list
+# without -preset gets one after the CRF value.
+def with_rate_control(switches, crf, preset):
+    switches = list(switches)
+    if '-crf' in switches:
+        switches[switches.index('-crf') + 1] = crf
+    if '-preset' in switches:
+        switches[switches.index('-preset') + 1] = preset
+    elif '-crf' in switches:
+        position = switches.index('-crf') + 2
+        switches[position:position] = ['-preset', preset]
+    return switches
+####################################################################################
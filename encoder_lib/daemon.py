@@ -0,0 +1,149 @@
+import os
+import json
+import shutil
+import threading
+import subprocess
+import socketserver
+import contextlib
+from encoder_lib.cli import parse_submission
+from encoder_lib.client import SOCKET_PATH, daemon_running
+from encoder_lib.common import INDENT
+from encoder_lib.profiles import PROFILE_SCRIPTS, load_profile
+from encoder_lib.watch import SETTLE_SECONDS, FolderWatcher
+
+
+####################################################################################
+# Show a "title|subtitle|body" notification string, the same one the scripts
+# print for Automator, as a macOS notification. Elsewhere it is only logged.
+def display_notification(message_content, log):
+    parts = [part.strip() for part in message_content.split('|')]
+    title, subtitle, body = (parts + ['', '', ''])[:3]
+    log('info', f'Notification:\t {title} | {subtitle} | {" / ".join(body.splitlines())}')
+    if not shutil.which('osascript'):
+        return
+
+    def quoted(text):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    script = f'display notification {quoted(body)} with title {quoted(title)} subtitle {quoted(subtitle)}'
+    try:
+        subprocess.run(['osascript', '-e', script], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception as e:
+        log('warning', f'Could not display notification ({str(e)})')
+####################################################################################
+
+
+####################################################################################
+# One process owns the job queue, so Quick Actions fired close together queue up
+# behind each other instead of running competing ffmpeg loops.
+#   submit()  parses a profile's command line and queues it, returning at once
+#   run()     runs queued batches one at a time through the profile's run_batch();
+#             submissions for the same profile and options that are waiting when
+#             a batch starts are folded into it
+#   serve()   answers newline-delimited JSON requests on a Unix socket:
+#               {"op": "submit", "profile": "1080p", "argv": [...], "cwd": "..."}
+#               {"op": "status"}
+#   watch()   also queues new files that settle in per-profile drop folders,
+#             once serve() has started
+class EncoderDaemon:
+    def __init__(self, log, notify=display_notification):
+        self.log = log
+        self.notify = notify
+        self.pending = []
+        self.current = None
+        self.condition = threading.Condition()
+        self.watchers = []
+
+    def submit(self, profile, argv, cwd=None):
+        options = parse_submission(profile, argv, cwd)
+
+        with self.condition:
+            self.pending.append((profile, options))
+            self.condition.notify_all()
+            position = len(self.pending) + (1 if self.current else 0)
+        self.log('info', f'Queued {len(options.targets)} targets for {profile} (position {position})')
+        return position
+
+    def status(self):
+        with self.condition:
+            return {
+                'current': self.current,
+                'pending': [{'profile': profile, 'targets': len(options.targets)} for profile, options in self.pending],
+            }
+
+    # Take the next submission, plus any waiting ones it can be merged with
+    def _next_batch(self):
+        profile, options = self.pending.pop(0)
+        settings = {k: v for k, v in vars(options).items() if k != 'targets'}
+        for other in list(self.pending):
+            other_settings = {k: v for k, v in vars(other[1]).items() if k != 'targets'}
+            if other[0] == profile and other_settings == settings:
+                self.pending.remove(other)
+                options.targets += [t for t in other[1].targets if t not in options.targets]
+        return profile, options
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                profile, options = self._next_batch()
+                self.current = {'profile': profile, 'targets': len(options.targets)}
+
+            self.log('info', f'Starting {profile} batch of {len(options.targets)} targets')
+            try:
+                message_content = load_profile(profile).run_batch(options)
+            except Exception as e:
+                self.log('failure', f'{INDENT}{profile} batch failed. Response:\t {str(e)}')
+                message_content = f' Encoder Daemon | {profile} batch failed | {str(e)} '
+            finally:
+                with self.condition:
+                    self.current = None
+            self.notify(message_content, self.log)
+
+    # argv holds encoder options applied to every watched file
+    def watch(self, folders, argv=(), settle_seconds=SETTLE_SECONDS):
+        for profile in folders:
+            if profile not in PROFILE_SCRIPTS:
+                raise ValueError(f'Unknown profile "{profile}". Expected one of: {", ".join(PROFILE_SCRIPTS)}')
+        self.watchers.append(FolderWatcher(
+            folders, lambda profile, paths: self.submit(profile, [*argv, '--', *paths]), self.log, settle_seconds=settle_seconds
+        ))
+
+    def handle(self, request):
+        op = request.get('op')
+        if op == 'submit':
+            position = self.submit(request.get('profile'), request.get('argv', []), request.get('cwd'))
+            return {'ok': True, 'position': position}
+        if op == 'status':
+            return {'ok': True, **self.status()}
+        raise ValueError(f'Unknown request: {op}')
+
+    def serve(self, socket_path=SOCKET_PATH):
+        if daemon_running(socket_path):
+            raise RuntimeError(f'An encoder daemon is already listening on {socket_path}')
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(socket_path)
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+        threading.Thread(target=self.run, name='encoder-daemon-queue', daemon=True).start()
+        for watcher in self.watchers:
+            threading.Thread(target=watcher.run, name='encoder-daemon-watch', daemon=True).start()
+
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    reply = daemon.handle(json.loads(self.rfile.readline()))
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+        with socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler) as server:
+            os.chmod(socket_path, 0o600)
+            self.log('info', f'Encoder daemon listening on {socket_path}')
+            try:
+                server.serve_forever()
+            finally:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(socket_path)
+####################################################################################
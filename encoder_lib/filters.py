@@ -0,0 +1,92 @@
+import re
+
+####################################################################################
+# Filter planner parameters
+####################################################################################
+# Scaler by output/source height ratio: light downscales keep bicubic's
+# sharpness, mid-range ones get lanczos, and 2x or more is averaged with area,
+# which is fast and doesn't alias
+SCALER_BY_RATIO = ((0.5, 'area'), (0.75, 'lanczos'), (1.0, 'bicubic'))
+
+EIGHT_BIT_420 = 'yuv420p'
+TEN_BIT_420 = 'yuv420p10le'
+####################################################################################
+
+
+####################################################################################
+def pix_fmt_depth(pix_fmt):
+    match = re.search(r'(\d+)(le|be)$', pix_fmt or '')
+    if match:
+        return int(match.group(1))
+    return 10 if pix_fmt == 'p010le' else 8
+####################################################################################
+
+
+####################################################################################
+def scaler_for(ratio):
+    for limit, scaler in SCALER_BY_RATIO:
+        if ratio <= limit:
+            return scaler
+    return 'bicubic'
+####################################################################################
+
+
+####################################################################################
+# Pull a switch and its value out of a switch list. Returns (value, remaining switches).
+def take_switch(switches, name):
+    switches = list(switches)
+    if name not in switches:
+        return None, switches
+    index = switches.index(name)
+    value = switches[index + 1]
+    del switches[index:index + 2]
+    return value, switches
+####################################################################################
+
+
+####################################################################################
+# Rebuild a profile's video switches for one probed source (see probe.summarize):
+#   - the profile's "scale=W:H" is dropped when the source is already at or below H,
+#     otherwise it becomes scale=-2:H with a scaler picked by the ratio
+#   - a profile pix_fmt becomes a format step in the same chain, skipped when the
+#     source already has it, and raised to 10-bit 4:2:0 for 10-bit sources when
+#     allow_10_bit is set. Profiles without a pix_fmt leave the format to x265.
+# Returns (switches, description of the planned graph for the log).
+def plan_video_filters(switches, summary, allow_10_bit=True):
+    video_filter, switches = take_switch(switches, '-vf')
+    requested_pix_fmt, switches = take_switch(switches, '-pix_fmt')
+    source_height = summary.get('height')
+    source_pix_fmt = summary.get('pix_fmt')
+    chain, notes = [], []
+
+    target_height = None
+    if video_filter:
+        match = re.search(r'scale=-?\d+:(\d+)', video_filter)
+        target_height = int(match.group(1)) if match else None
+        if not match:
+            # Not a plain scale. Keep the profile's filter as it is.
+            chain.append(video_filter)
+
+    if target_height:
+        if source_height and source_height <= target_height:
+            notes.append(f'source already {source_height}p')
+        else:
+            ratio = target_height / source_height if source_height else 1.0
+            chain.append(f'scale=-2:{target_height}:flags={scaler_for(ratio)}')
+
+    if requested_pix_fmt:
+        target_pix_fmt = requested_pix_fmt
+        if allow_10_bit and requested_pix_fmt == EIGHT_BIT_420 and pix_fmt_depth(source_pix_fmt) > 8:
+            target_pix_fmt = TEN_BIT_420
+        if source_pix_fmt == target_pix_fmt:
+            notes.append(f'source already {source_pix_fmt}')
+        else:
+            chain.append(f'format={target_pix_fmt}')
+
+    if chain:
+        switches = ['-vf', ','.join(chain), *switches]
+    description = ','.join(chain) if chain else 'none'
+    if notes:
+        description += f' ({"; ".join(notes)})'
+    return switches, description
+####################################################################################
@@ -0,0 +1,288 @@
+import os
+import re
+import sys
+import math
+import time
+import signal
+import shutil
+import threading
+import subprocess
+import contextlib
+from encoder_lib.common import ENCODE_SLOT, INDENT, PROCESS_SLOTS
+
+####################################################################################
+# Governor parameters
+####################################################################################
+# How often the machine is sampled
+GOVERNOR_POLL_SECONDS = 5
+
+# Someone has touched the keyboard or mouse within this long: the machine is in use
+USER_IDLE_SECONDS = 120
+
+# 1-minute load per core, not counting the batch's own ffmpegs, above which
+# the machine counts as overloaded
+LOAD_BUSY_PER_CORE = 1.5
+LOAD_AVERAGE_SECONDS = 60
+
+# Pause every encode when less than this fraction of memory is available
+MEMORY_PAUSE_FRACTION = 0.08
+
+# Niceness for ffmpeg while the machine is idle, and while someone is using it.
+# Nice only matters under contention, so an idle machine still gets full speed.
+# Without root the niceness can only go up, so an encode that was backed off
+# stays at NICE_ACTIVE until it finishes.
+NICE_IDLE = 5
+NICE_ACTIVE = 15
+####################################################################################
+
+
+####################################################################################
+def load_per_core():
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+####################################################################################
+
+
+####################################################################################
+# Fraction of memory still available, or None when it can't be read
+def memory_available_fraction():
+    try:
+        if sys.platform == 'darwin':
+            # The kernel's own pressure gauge: percent of memory free
+            level = subprocess.run(['sysctl', '-n', 'kern.memorystatus_level'], check=True,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+            return int(level) / 100
+        with open('/proc/meminfo') as pipe:
+            meminfo = dict(re.findall(r'^(\w+):\s+(\d+)', pipe.read(), re.MULTILINE))
+        return int(meminfo['MemAvailable']) / int(meminfo['MemTotal'])
+    except (OSError, ValueError, KeyError, subprocess.CalledProcessError):
+        return None
+####################################################################################
+
+
+####################################################################################
+# Seconds since the last keyboard/mouse input, or None when there's no way to tell
+def user_idle_seconds():
+    try:
+        if sys.platform == 'darwin':
+            output = subprocess.run(['ioreg', '-c', 'IOHIDSystem', '-d', '4'], check=True,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+            match = re.search(r'"HIDIdleTime" = (\d+)', output)
+            return int(match.group(1)) / 1e9 if match else None
+        if shutil.which('xprintidle') and os.environ.get('DISPLAY'):
+            output = subprocess.run(['xprintidle'], check=True, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, text=True).stdout
+            return int(output) / 1000
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        pass
+    return None
+####################################################################################
+
+
+####################################################################################
+# ps cputime ([DD-][HH:]MM:SS[.ss]) in seconds
+def parse_cpu_time(value):
+    days, _, clock = value.strip().rpartition('-')
+    seconds = 0.0
+    for part in clock.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds + int(days or 0) * 86400
+####################################################################################
+
+
+####################################################################################
+# CPU seconds each of these processes has used so far. Processes that have
+# exited in the meantime are left out.
+def process_cpu_seconds(pids):
+    if not pids:
+        return {}
+    output = subprocess.run(['ps', '-o', 'pid=,time=', '-p', ','.join(str(pid) for pid in pids)],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    seconds = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[0].isdigit():
+            with contextlib.suppress(ValueError):
+                seconds[int(fields[0])] = parse_cpu_time(fields[1])
+    return seconds
+####################################################################################
+
+
+####################################################################################
+# ffmpeg processes started by this process or its children
+def child_ffmpeg_pids(root_pid=None):
+    root_pid = root_pid or os.getpid()
+    output = subprocess.run(['ps', '-axo', 'pid=,ppid=,comm='], check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    parents, names = {}, {}
+    for line in output.splitlines():
+        fields = line.split(None, 2)
+        if len(fields) == 3 and fields[0].isdigit() and fields[1].isdigit():
+            parents[int(fields[0])] = int(fields[1])
+            names[int(fields[0])] = os.path.basename(fields[2].strip())
+
+    def descends(pid):
+        seen = set()
+        while pid in parents and pid not in seen:
+            seen.add(pid)
+            pid = parents[pid]
+            if pid == root_pid:
+                return True
+        return False
+    return sorted(pid for pid, name in names.items() if name == 'ffmpeg' and descends(pid))
+####################################################################################
+
+
+####################################################################################
+# Keeps a batch's encodes out of the way of whoever is using the machine.
+# Every GOVERNOR_POLL_SECONDS it samples load, memory and user idle time and
+# picks how many encodes may run:
+#   idle                      up to max_jobs encodes, at NICE_IDLE
+#   in use, or overloaded     one encode, at NICE_ACTIVE; the rest are paused
+#   in use and overloaded,
+#   or short of memory        every ffmpeg paused (SIGSTOP) until it clears
+# Load only counts as overload when it comes from outside the batch: the
+# batch's own ffmpeg CPU use, averaged over the same minute, is taken off.
+# Encodes are held back newest first, by the order they took their slot().
+# All of an encode's ffmpegs (segments, CRF search) go with it; ffmpegs outside
+# any slot, such as the verifier's decoders, are paused whenever the batch is
+# held back. New encodes wait in slot() while the batch is at its allowance,
+# and paused ffmpegs are resumed (SIGCONT) as soon as the allowance grows again.
+class Governor:
+    def __init__(self, log, max_jobs, poll_seconds=GOVERNOR_POLL_SECONDS):
+        self.log = log
+        self.max_jobs = max(1, max_jobs)
+        self.poll_seconds = poll_seconds
+        self.allowed = self.max_jobs
+        self.nice = NICE_IDLE
+        self.reason = 'idle'
+        self.running = 0
+        self.slots = []
+        self.next_slot = 0
+        self.stopped = set()
+        self.niced = {}
+        self.cpu_seconds = {}
+        self.batch_load = 0.0
+        self.sampled = None
+        self.condition = threading.Condition()
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='encode-governor', daemon=True)
+
+    # Cores' worth of CPU the batch's ffmpegs used since the last sample, per
+    # core, decayed the way the kernel's 1-minute load average is
+    def batch_load_per_core(self, pids):
+        now = time.monotonic()
+        cpu_seconds = process_cpu_seconds(pids)
+        used = sum(max(0.0, seconds - self.cpu_seconds.get(pid, 0.0)) for pid, seconds in cpu_seconds.items())
+        if self.sampled is not None and now > self.sampled:
+            decay = math.exp(-(now - self.sampled) / LOAD_AVERAGE_SECONDS)
+            current = used / (now - self.sampled) / (os.cpu_count() or 1)
+            self.batch_load = self.batch_load * decay + current * (1 - decay)
+        self.cpu_seconds, self.sampled = cpu_seconds, now
+        return self.batch_load
+
+    def sample(self, pids=()):
+        return {
+            'load_per_core': load_per_core(),
+            'batch_load_per_core': self.batch_load_per_core(pids),
+            'memory_available': memory_available_fraction(),
+            'user_idle': user_idle_seconds(),
+        }
+
+    # (ffmpeg processes allowed, niceness, reason) for a sample
+    def decide(self, sample):
+        memory = sample['memory_available']
+        if memory is not None and memory < MEMORY_PAUSE_FRACTION:
+            return 0, NICE_ACTIVE, f'memory pressure ({memory:.0%} available)'
+        user_active = sample['user_idle'] is not None and sample['user_idle'] < USER_IDLE_SECONDS
+        outside_load = max(0.0, sample['load_per_core'] - sample.get('batch_load_per_core', 0.0))
+        overloaded = outside_load > LOAD_BUSY_PER_CORE
+        load = f'load {outside_load:.2f}/core from outside the batch'
+        if user_active and overloaded:
+            return 0, NICE_ACTIVE, f'machine in use, {load}'
+        if user_active:
+            return 1, NICE_ACTIVE, 'machine in use'
+        if overloaded:
+            return 1, NICE_ACTIVE, load
+        return self.max_jobs, NICE_IDLE, 'idle'
+
+    def apply(self, pids):
+        for pid in pids:
+            if self.niced.get(pid, -1) < self.nice:
+                with contextlib.suppress(OSError):
+                    os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+                    self.niced[pid] = self.nice
+
+        # Idle, nothing is held back. Otherwise the encodes that took their slot
+        # first keep running, so the ones furthest along finish first. ffmpegs
+        # outside any slot (verification decodes) run on whatever allowance those
+        # slots leave spare, and only stop when there is none.
+        if self.allowed >= self.max_jobs:
+            keep = set(pids)
+        else:
+            with self.condition:
+                running_slots = set(self.slots[:self.allowed])
+            spare = self.allowed - len(running_slots)
+            keep = {pid for pid in pids
+                    if PROCESS_SLOTS.get(pid) in running_slots or (spare > 0 and PROCESS_SLOTS.get(pid) is None)}
+        pause = [pid for pid in pids if pid not in keep]
+        for pid in pause:
+            if pid not in self.stopped:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGSTOP)
+                    self.stopped.add(pid)
+        for pid in keep:
+            if pid in self.stopped:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGCONT)
+                self.stopped.discard(pid)
+        self.stopped &= set(pids)
+        self.niced = {pid: nice for pid, nice in self.niced.items() if pid in pids}
+
+    def _run(self):
+        while not self.finished.is_set():
+            try:
+                pids = child_ffmpeg_pids()
+                allowed, nice, reason = self.decide(self.sample(pids))
+                with self.condition:
+                    if (allowed, reason) != (self.allowed, self.reason):
+                        self.log('info', f'Governor: {reason}. Allowing {allowed} of {self.max_jobs} encodes, nice {nice}')
+                    self.allowed, self.nice, self.reason = allowed, nice, reason
+                    self.condition.notify_all()
+                self.apply(pids)
+            except Exception as e:
+                self.log('warning', f'{INDENT}Governor sample failed ({str(e)})')
+            self.finished.wait(self.poll_seconds)
+
+    # Hold one of the batch's encode slots while the allowance has room. The
+    # ffmpegs started inside it are tied to it (see common.slot_process).
+    @contextlib.contextmanager
+    def slot(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.running < self.allowed)
+            self.running += 1
+            slot = self.next_slot
+            self.next_slot += 1
+            self.slots.append(slot)
+        token = ENCODE_SLOT.set(slot)
+        try:
+            yield
+        finally:
+            ENCODE_SLOT.reset(token)
+            with self.condition:
+                self.running -= 1
+                self.slots.remove(slot)
+                self.condition.notify_all()
+
+    def start(self):
+        self.log('info', f'Governor watching load, memory and user activity every {self.poll_seconds}s')
+        self.thread.start()
+
+    # Stop governing and resume anything still paused
+    def stop(self):
+        self.finished.set()
+        self.thread.join()
+        for pid in self.stopped:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGCONT)
+        self.stopped.clear()
+####################################################################################
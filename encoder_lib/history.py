@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import platform
+import statistics
+import threading
+import datetime as dt
+from contextlib import closing
+import humanize as hm
+from encoder_lib.common import STATE_DIR
+from encoder_lib.probe import probe_cached, summarize
+from encoder_lib.schedule import cost_model, estimate_cost, estimate_makespan
+
+####################################################################################
+# Run history parameters
+####################################################################################
+# One row per finished job: what the source was, what the encode took and what
+# it saved. Read back by the forecaster and by Encoder_History.py.
+RUN_HISTORY_PATH = os.path.join(STATE_DIR, 'run_history.sqlite')
+RUN_HISTORY_LOCK = threading.Lock()
+RUN_FIELDS = ('finished', 'host', 'profile', 'name', 'result', 'mode', 'codec', 'width', 'height', 'bit_rate',
+              'duration', 'source_size', 'output_size', 'size_ratio', 'encode_seconds')
+
+# Size ratios are taken from the newest RATIO_HISTORY_LIMIT plain encodes that
+# match a source as closely as possible, needing at least MIN_RATIO_HISTORY
+RATIO_HISTORY_LIMIT = 200
+MIN_RATIO_HISTORY = 3
+
+# Report groupings for Encoder_History.py
+REPORT_GROUPS = ('profile', 'codec', 'resolution', 'host', 'result', 'mode')
+####################################################################################
+
+
+####################################################################################
+def _history_connection():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    connection = sqlite3.connect(RUN_HISTORY_PATH, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS runs ('
+        'finished TEXT, host TEXT, profile TEXT, name TEXT, result TEXT, mode TEXT, '
+        'codec TEXT, width INTEGER, height INTEGER, bit_rate INTEGER, duration REAL, '
+        'source_size INTEGER, output_size INTEGER, size_ratio REAL, encode_seconds REAL)'
+    )
+    return connection
+####################################################################################
+
+
+####################################################################################
+# The usual name for a source's height, so a 1916x1036 crop counts as 1080p
+def resolution_class(height):
+    if not height:
+        return 'unknown'
+    for name, lowest in (('2160p', 1600), ('1440p', 1200), ('1080p', 900), ('720p', 600), ('576p', 500)):
+        if height >= lowest:
+            return name
+    return 'SD'
+####################################################################################
+
+
+####################################################################################
+# Add a finished job. mode is how the output was made (encode, segments, remux,
+# renditions, or cache for a copy of an earlier output). Only plain encodes and segmented ones feed the forecaster.
+def record_run(profile, target_file, summary, result, mode, source_size, output_size, encode_seconds):
+    size_ratio = round(output_size / source_size, 4) if output_size and source_size else None
+    row = {
+        'finished': dt.datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'profile': profile,
+        'name': os.path.basename(target_file),
+        'result': result,
+        'mode': mode,
+        'codec': summary.get('codec'),
+        'width': summary.get('width'),
+        'height': summary.get('height'),
+        'bit_rate': summary.get('bit_rate'),
+        'duration': summary.get('duration'),
+        'source_size': source_size,
+        'output_size': output_size,
+        'size_ratio': size_ratio,
+        'encode_seconds': round(encode_seconds, 3) if encode_seconds is not None else None,
+    }
+    with RUN_HISTORY_LOCK, closing(_history_connection()) as connection, connection:
+        connection.execute(
+            f'INSERT INTO runs ({", ".join(RUN_FIELDS)}) VALUES ({", ".join("?" * len(RUN_FIELDS))})',
+            [row[field] for field in RUN_FIELDS]
+        )
+####################################################################################
+
+
+####################################################################################
+# Finished jobs, newest first, optionally narrowed to a profile and a start date
+def run_history(profile=None, since=None):
+    query, arguments = 'SELECT * FROM runs WHERE 1 = 1', []
+    if profile:
+        query, arguments = query + ' AND profile = ?', arguments + [profile]
+    if since:
+        query, arguments = query + ' AND finished >= ?', arguments + [since.isoformat(timespec='seconds')]
+    with RUN_HISTORY_LOCK, closing(_history_connection()) as connection:
+        return [dict(row) for row in connection.execute(query + ' ORDER BY rowid DESC', arguments)]
+####################################################################################
+
+
+####################################################################################
+# Median output/source size ratio of past encodes like this source: the same
+# codec and resolution class, then the same codec, then anything on the profile.
+# Returns (ratio, encodes it is based on), or (None, 0) with no usable history.
+def expected_ratio(rows, summary):
+    codec, resolution = summary.get('codec'), resolution_class(summary.get('height'))
+    matchers = (
+        lambda row: row['codec'] == codec and resolution_class(row['height']) == resolution,
+        lambda row: row['codec'] == codec,
+        lambda row: True,
+    )
+    for matches in matchers:
+        ratios = [row['size_ratio'] for row in rows if matches(row)][:RATIO_HISTORY_LIMIT]
+        if len(ratios) >= MIN_RATIO_HISTORY:
+            return statistics.median(ratios), len(ratios)
+    return None, 0
+####################################################################################
+
+
+####################################################################################
+# Forecast a batch before it starts: wall time across the batch's jobs (from
+# the scheduler's cost model) and the disk space it should give back (from past
+# size ratios). Targets that can't be probed are left out of the space estimate
+# and costed at the average of the rest.
+def forecast_batch(targets, profile, workers=1, segments=1):
+    model = cost_model(profile, workers, segments)
+    rows = [row for row in run_history(profile)
+            if row['result'] == 'encoded' and row['mode'] in ('encode', 'segments') and row['size_ratio']]
+    costs, source_bytes, saved_bytes, estimated = [], 0, 0, 0
+    for target in targets:
+        try:
+            summary = summarize(probe_cached(target))
+        except Exception:
+            costs.append(None)
+            continue
+        costs.append(estimate_cost(model, summary))
+        ratio, _ = expected_ratio(rows, summary)
+        if ratio is not None:
+            size = os.path.getsize(target)
+            source_bytes += size
+            saved_bytes += size * (1 - ratio)
+            estimated += 1
+
+    known = [cost for cost in costs if cost is not None]
+    fallback = sum(known) / len(known) if known else 0.0
+    costs = [fallback if cost is None else cost for cost in costs]
+    seconds = estimate_makespan(costs, workers)
+    return {
+        'targets': len(targets),
+        'seconds': seconds,
+        'finish': dt.datetime.now() + dt.timedelta(seconds=seconds),
+        'source_bytes': source_bytes,
+        'saved_bytes': int(saved_bytes),
+        'estimated_targets': estimated,
+        'history': len(rows),
+    }
+####################################################################################
+
+
+####################################################################################
+# One line for the log, or a brief one for the notification
+def describe_forecast(forecast, brief=False):
+    eta = hm.precisedelta(dt.timedelta(seconds=int(forecast['seconds'])))
+    saved = hm.naturalsize(forecast['saved_bytes']) if forecast['estimated_targets'] else 'unknown'
+    if brief:
+        return f'{hm.naturaldelta(dt.timedelta(seconds=forecast["seconds"]))}, {saved} saved'
+    if not forecast['estimated_targets']:
+        return f'ETA {eta} (around {forecast["finish"]:%H:%M}). Savings unknown until {MIN_RATIO_HISTORY} files have been encoded'
+    percent = round(100 * forecast['saved_bytes'] / forecast['source_bytes'], 1) if forecast['source_bytes'] else 0
+    return (f'ETA {eta} (around {forecast["finish"]:%H:%M}). Expected savings {saved} ({percent}%) '
+            f'for {forecast["estimated_targets"]} of {forecast["targets"]} files')
+####################################################################################
+
+
+####################################################################################
+# Summarize runs grouped by one of REPORT_GROUPS: counts, time and sizes
+def history_report(rows, group='profile'):
+    def key(row):
+        return resolution_class(row['height']) if group == 'resolution' else (row[group] or 'unknown')
+
+    report = {}
+    for row in rows:
+        report.setdefault(key(row), []).append(row)
+
+    summaries = []
+    for name, group_rows in sorted(report.items()):
+        encoded = [row for row in group_rows if row['result'] == 'encoded' and row['output_size']]
+        source_bytes = sum(row['source_size'] or 0 for row in encoded)
+        output_bytes = sum(row['output_size'] for row in encoded)
+        media_seconds = sum(row['duration'] or 0 for row in encoded)
+        encode_seconds = sum(row['encode_seconds'] or 0 for row in encoded)
+        ratios = [row['size_ratio'] for row in encoded if row['size_ratio']]
+        summaries.append({
+            group: name,
+            'runs': len(group_rows),
+            'encoded': len(encoded),
+            'failed': len(group_rows) - len(encoded),
+            'encode_seconds': round(encode_seconds, 1),
+            'average_seconds': round(encode_seconds / len(encoded), 1) if encoded else None,
+            'speed': round(media_seconds / encode_seconds, 3) if encode_seconds else None,
+            'source_bytes': source_bytes,
+            'saved_bytes': source_bytes - output_bytes,
+            'median_ratio': statistics.median(ratios) if ratios else None,
+        })
+    return summaries
+####################################################################################
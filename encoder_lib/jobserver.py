@@ -0,0 +1,259 @@
+import hmac
+import json
+import time
+import uuid
+import ipaddress
+import threading
+import datetime as dt
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from encoder_lib.cli import parse_submission
+from encoder_lib.client import JOB_SERVER_PORT
+from encoder_lib.common import INDENT
+from encoder_lib.metrics import METRICS
+from encoder_lib.schedule import order_targets
+
+####################################################################################
+# Job server parameters
+####################################################################################
+# A worker holds its job for LEASE_SECONDS after each heartbeat. A worker that
+# stops heartbeating (crashed, powered off, unplugged) loses the job, which goes
+# back to the front of the queue for the next worker that asks. Workers are told
+# to heartbeat a few times per lease.
+LEASE_SECONDS = 90
+HEARTBEATS_PER_LEASE = 4
+REAP_SECONDS = 5
+
+# A job that has lost its worker this many times is marked failed instead
+MAX_ATTEMPTS = 3
+
+# Finished jobs kept for /status
+FINISHED_JOBS_KEPT = 200
+####################################################################################
+
+
+####################################################################################
+# Hands out single-file encode jobs to worker agents on other hosts. Sources and
+# outputs are on storage every host mounts at the same path, so a job is just a
+# profile, its encoder options and one target path. HTTP with JSON bodies:
+#   POST /submit     {"profile": "1080p", "argv": [...], "cwd": "..."}
+#   POST /claim      {"worker": "host-1"}            -> {"job": {...}} or {"job": null}
+#   POST /heartbeat  {"worker": ..., "job": id, "telemetry": {...}}
+#   POST /complete   {"worker": ..., "job": id, "result": {...}}
+#   GET  /status
+#   GET  /metrics    Prometheus text: the queue, plus this process's encoder metrics
+# Replies carry "ok"; a worker whose heartbeat gets ok=false has lost its job.
+# With a token (see client.job_server_token), every request must carry it as
+# "Authorization: Bearer <token>" or is turned away with a 401.
+class JobServer:
+    def __init__(self, log, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.log = log
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.jobs = {}
+        self.queue = []
+        self.finished = []
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def submit(self, profile, argv, cwd=None):
+        options = parse_submission(profile, argv, cwd)
+        targets = order_targets(options.targets, profile, options.order, options.priority, self.log,
+                                workers=max(1, len(self.workers)), jobs=1, segments=max(1, options.segments))
+        submitted = dt.datetime.now().isoformat(timespec='seconds')
+        with self.lock:
+            for target in targets:
+                job_id = uuid.uuid4().hex[:12]
+                self.jobs[job_id] = {
+                    'id': job_id, 'profile': profile, 'argv': list(argv), 'cwd': cwd, 'target': target,
+                    'state': 'queued', 'worker': None, 'attempts': 0, 'submitted': submitted,
+                }
+                self.queue.append(job_id)
+            queued = len(self.queue)
+        self.log('info', f'Queued {len(targets)} {profile} jobs ({queued} waiting)')
+        return len(targets)
+
+    def _seen(self, worker, **fields):
+        self.workers.setdefault(worker, {}).update(last_seen=time.time(), **fields)
+
+    def claim(self, worker):
+        self.reap()
+        with self.lock:
+            self._seen(worker)
+            if not self.queue:
+                return None
+            job = self.jobs[self.queue.pop(0)]
+            job.update(state='running', worker=worker, attempts=job['attempts'] + 1,
+                       lease_expires=time.time() + self.lease_seconds, telemetry={})
+            self._seen(worker, job=job['id'])
+        self.log('info', f'{job["target"]} ({job["profile"]}) -> {worker}, attempt {job["attempts"]}')
+        return {**job, 'heartbeat_seconds': self.lease_seconds / HEARTBEATS_PER_LEASE}
+
+    def heartbeat(self, worker, job_id, telemetry=None):
+        with self.lock:
+            self._seen(worker, telemetry=telemetry or {})
+            job = self.jobs.get(job_id)
+            if not job or job['state'] != 'running' or job['worker'] != worker:
+                return False
+            job['lease_expires'] = time.time() + self.lease_seconds
+            job['telemetry'] = telemetry or {}
+            return True
+
+    def complete(self, worker, job_id, result):
+        with self.lock:
+            self._seen(worker, job=None)
+            job = self.jobs.get(job_id)
+            if not job or job['state'] != 'running' or job['worker'] != worker:
+                # Reassigned after this worker was given up for dead. The new owner reports.
+                return False
+            job.update(state='done' if result.get('ok') else 'failed', result=result)
+            self._finish(job)
+        self.log('success' if result.get('ok') else 'failure',
+                 f'{job["target"]} ({job["profile"]}) {job["state"]} on {worker}: {result.get("state") or result.get("error")}')
+        return True
+
+    def _finish(self, job):
+        METRICS.inc('encoder_server_jobs_finished_total', profile=job['profile'], state=job['state'])
+        job['finished'] = dt.datetime.now().isoformat(timespec='seconds')
+        self.finished.append(job['id'])
+        while len(self.finished) > FINISHED_JOBS_KEPT:
+            self.jobs.pop(self.finished.pop(0), None)
+
+    # Requeue the jobs of workers whose lease ran out
+    def reap(self):
+        now = time.time()
+        with self.lock:
+            expired = [job for job in self.jobs.values() if job['state'] == 'running' and job['lease_expires'] < now]
+            for job in expired:
+                lost_worker = job['worker']
+                self.workers.get(lost_worker, {}).update(job=None)
+                if job['attempts'] >= self.max_attempts:
+                    job.update(state='failed', result={'ok': False, 'error': f'lost {job["attempts"]} workers'})
+                    self._finish(job)
+                    self.log('failure', f'{job["target"]} ({job["profile"]}) failed: lost {job["attempts"]} workers')
+                else:
+                    job.update(state='queued', worker=None)
+                    self.queue.insert(0, job['id'])
+                    self.log('warning', f'{INDENT}{lost_worker} stopped responding. Requeued {job["target"]} ({job["profile"]})')
+
+    def status(self):
+        now = time.time()
+        with self.lock:
+            return {
+                'queued': len(self.queue),
+                'running': [dict(job) for job in self.jobs.values() if job['state'] == 'running'],
+                'finished': [dict(self.jobs[job_id]) for job_id in self.finished],
+                'workers': {
+                    name: {**info, 'seconds_since_seen': round(now - info['last_seen'], 1)}
+                    for name, info in self.workers.items()
+                },
+            }
+
+    # Queue and worker gauges as of now, with everything else in the registry
+    def metrics(self):
+        now = time.time()
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                if job['state'] in ('queued', 'running'):
+                    key = (job['profile'], job['state'])
+                    counts[key] = counts.get(key, 0) + 1
+            live = sum(1 for info in self.workers.values() if now - info['last_seen'] < self.lease_seconds)
+            profiles = {job['profile'] for job in self.jobs.values()}
+        for profile in profiles:
+            for state in ('queued', 'running'):
+                METRICS.set('encoder_server_jobs', counts.get((profile, state), 0), profile=profile, state=state)
+        METRICS.set('encoder_server_workers', live)
+        return METRICS.render()
+
+    def handle(self, path, request):
+        if path == '/submit':
+            return {'ok': True, 'queued': self.submit(request.get('profile'), request.get('argv', []), request.get('cwd'))}
+        if path == '/claim':
+            return {'ok': True, 'job': self.claim(request['worker'])}
+        if path == '/heartbeat':
+            return {'ok': self.heartbeat(request['worker'], request['job'], request.get('telemetry'))}
+        if path == '/complete':
+            return {'ok': self.complete(request['worker'], request['job'], request.get('result', {}))}
+        if path == '/status':
+            return {'ok': True, **self.status()}
+        raise ValueError(f'Unknown request: {path}')
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(REAP_SECONDS)
+            self.reap()
+
+    # Listens on loopback unless told otherwise. Anyone who can reach the server can
+    # have a worker replace any file, so listening beyond this host needs a token.
+    def serve(self, host='127.0.0.1', port=JOB_SERVER_PORT, token=None):
+        if not token and not is_loopback(host):
+            raise ValueError(f'Refusing to listen on {host} without a job server token')
+        threading.Thread(target=self._reap_forever, name='job-server-reaper', daemon=True).start()
+        server = self
+        expected = f'Bearer {token}'.encode() if token else None
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def _authorized(self):
+                if expected is None or hmac.compare_digest(self.headers.get('Authorization', '').encode(), expected):
+                    return True
+                body = json.dumps({'ok': False, 'error': 'unauthorized'}).encode()
+                self.send_response(401)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return False
+
+            def _reply(self, request):
+                try:
+                    reply = server.handle(self.path, request)
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                body = json.dumps(reply).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if self.path != '/metrics':
+                    self._reply({})
+                    return
+                body = server.metrics().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if not self._authorized():
+                    self.rfile.read(length)
+                    return
+                try:
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    request = {}
+                self._reply(request)
+
+            # Requests are logged by the server itself, not on stderr
+            def log_message(self, format, *args):
+                pass
+
+        with ThreadingHTTPServer((host, port), RequestHandler) as http_server:
+            self.log('info', f'Job server listening on {host}:{port}{" (token required)" if token else ""}')
+            http_server.serve_forever()
+####################################################################################
+
+
+####################################################################################
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+####################################################################################
@@ -0,0 +1,194 @@
+import os
+import shutil
+import sqlite3
+import threading
+import datetime as dt
+from contextlib import closing
+from encoder_lib.archive import archive_source
+from encoder_lib.common import INDENT, STATE_DIR
+from encoder_lib.metrics import METRICS
+from encoder_lib.segments import segment_work_dir
+
+####################################################################################
+# Ledger parameters
+####################################################################################
+# One row per (target, profile), updated as the target moves through encode().
+# A run that dies part way leaves the row in its last state, and the next run
+# picks the job up from there.
+LEDGER_PATH = os.path.join(STATE_DIR, 'ledger.sqlite')
+LEDGER_LOCK = threading.Lock()
+JOB_STATES = ('queued', 'encoding', 'encoded', 'archived', 'renamed', 'done', 'failed', 'not_worth_it')
+LEDGER_FIELDS = ('temp_file', 'archive_dir', 'before_size', 'after_size', 'error')
+
+# States a restart can finish without encoding again
+RECOVERABLE_STATES = ('encoded', 'archived', 'renamed')
+
+# States a job ends in
+FINISHED_STATES = ('done', 'failed', 'not_worth_it')
+####################################################################################
+
+
+####################################################################################
+def _ledger_connection():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    connection = sqlite3.connect(LEDGER_PATH, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        'path TEXT, profile TEXT, state TEXT, '
+        'temp_file TEXT, archive_dir TEXT, before_size INTEGER, after_size INTEGER, error TEXT, '
+        'updated TEXT, PRIMARY KEY (path, profile))'
+    )
+    return connection
+####################################################################################
+
+
+####################################################################################
+# Record a state change. Moving a job back to "queued" clears what the last attempt left.
+def ledger_update(target_file, profile, state, **fields):
+    if state not in JOB_STATES:
+        raise ValueError(f'Unknown job state: {state}')
+    unknown_fields = set(fields) - set(LEDGER_FIELDS)
+    if unknown_fields:
+        raise ValueError(f'Unknown ledger fields: {", ".join(sorted(unknown_fields))}')
+
+    if state == 'queued':
+        fields = {**dict.fromkeys(LEDGER_FIELDS), **fields}
+    key = (os.path.abspath(target_file), profile)
+    updated = dt.datetime.now().isoformat(timespec='seconds')
+
+    with LEDGER_LOCK, closing(_ledger_connection()) as connection, connection:
+        connection.execute(
+            'INSERT INTO jobs (path, profile, state, updated) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (path, profile) DO UPDATE SET state = excluded.state, updated = excluded.updated',
+            (*key, state, updated)
+        )
+        for name, value in fields.items():
+            connection.execute(f'UPDATE jobs SET {name} = ? WHERE path = ? AND profile = ?', (value, *key))
+    METRICS.job_state(*key, state, finished=state in FINISHED_STATES)
+####################################################################################
+
+
+####################################################################################
+def ledger_record(target_file, profile):
+    with LEDGER_LOCK, closing(_ledger_connection()) as connection:
+        row = connection.execute(
+            'SELECT * FROM jobs WHERE path = ? AND profile = ?', (os.path.abspath(target_file), profile)
+        ).fetchone()
+    return dict(row) if row else None
+####################################################################################
+
+
+####################################################################################
+# Targets a previous run of this profile started but never finished
+def ledger_unfinished(profile):
+    with LEDGER_LOCK, closing(_ledger_connection()) as connection:
+        rows = connection.execute(
+            "SELECT path FROM jobs WHERE profile = ? AND state NOT IN ('done', 'failed', 'not_worth_it') ORDER BY updated",
+            (profile,)
+        ).fetchall()
+    return [row['path'] for row in rows]
+####################################################################################
+
+
+####################################################################################
+# Finish a job that was interrupted after ffmpeg completed: archive the source
+# and/or rename the temp file into place. A crash between a file move and its
+# ledger update is detected from what's on disk. Returns an encode() style
+# result tuple, or None when the job has to be encoded again.
+def recover_job(target_file, record, profile, log):
+    name = os.path.basename(target_file)
+    state = record['state']
+    temp_file = record['temp_file']
+    archive_dir = record['archive_dir']
+    before_size_raw = record['before_size'] or 0
+
+    if state == 'encoded' and not os.path.exists(temp_file or ''):
+        return None
+    # Nothing is archived on the strength of a temp file that isn't the whole output
+    if state == 'encoded' and os.path.exists(target_file) and os.path.getsize(temp_file) != record['after_size']:
+        log('warning', f'{INDENT}"{name}" has an incomplete encoded file. Encoding it again')
+        return None
+    if state == 'encoded' and not os.path.exists(target_file):
+        state = 'archived'
+    if state == 'archived' and not os.path.exists(temp_file or '') and os.path.exists(target_file):
+        state = 'renamed'
+
+    log('info', f'{INDENT}Resuming "{name}" from state "{state}"')
+    try:
+        if state == 'encoded':
+            archive_source(target_file, archive_dir, log)
+            ledger_update(target_file, profile, 'archived')
+            log('success', f'{INDENT}File Archived successfully')
+            state = 'archived'
+        if state == 'archived':
+            shutil.move(temp_file, target_file)
+            ledger_update(target_file, profile, 'renamed')
+            log('success', f'{INDENT}File Renamed successfully')
+    except Exception as e:
+        log('failure', f'{INDENT}Failed to resume "{name}". Please perform manually')
+        log('failure', f'{INDENT}Response:\t {str(e)}')
+        ledger_update(target_file, profile, 'failed', error=str(e))
+        return 0, name, before_size_raw, before_size_raw
+
+    after_size_raw = os.path.getsize(target_file)
+    ledger_update(target_file, profile, 'done', after_size=after_size_raw)
+    return 1, name, before_size_raw, after_size_raw
+####################################################################################
+
+
+####################################################################################
+# Sort a batch against the ledger before anything is encoded:
+#   done                       skipped, unless the file has changed since or force is set
+#   not_worth_it               skipped the same way; an earlier encode was aborted as too big
+#   encoded/archived/renamed   finished off without re-encoding
+#   encoding                   orphaned temp output removed, then encoded again
+#   anything else              encoded
+# Returns (targets to encode, recovered results by target, skipped (name, reason) pairs).
+def resume_plan(targets, profile, log, force=False):
+    encode_list, recovered_results, skipped_list = [], {}, []
+    for target_file in targets:
+        name = os.path.basename(target_file)
+        record = ledger_record(target_file, profile)
+        state = record['state'] if record else None
+
+        if state == 'done' and not force and os.path.exists(target_file) \
+                and os.path.getsize(target_file) == record['after_size']:
+            log('info', f'{INDENT}Skipping "{name}":\t already encoded (ledger)')
+            skipped_list.append((name, 'already encoded'))
+            continue
+
+        if state == 'not_worth_it' and not force and os.path.exists(target_file) \
+                and os.path.getsize(target_file) == record['before_size']:
+            log('info', f'{INDENT}Skipping "{name}":\t not worth encoding (ledger)')
+            skipped_list.append((name, 'not worth encoding'))
+            continue
+
+        if state in RECOVERABLE_STATES:
+            result = recover_job(target_file, record, profile, log)
+            if result:
+                recovered_results[target_file] = result
+                continue
+
+        # Partial output from an interrupted encode can't be trusted
+        temp_file = record['temp_file'] if record else None
+        if temp_file and state in ('encoding', 'encoded') and os.path.exists(temp_file):
+            log('info', f'{INDENT}Removing partial output from an interrupted run:\t {temp_file}')
+            os.remove(temp_file)
+        if temp_file:
+            shutil.rmtree(segment_work_dir(temp_file), ignore_errors=True)
+            # A scratch write-back cut short
+            if os.path.exists(f'{temp_file}.partial'):
+                os.remove(f'{temp_file}.partial')
+
+        encode_list.append(target_file)
+    return encode_list, recovered_results, skipped_list
+####################################################################################
+
+
+####################################################################################
+# Mark the final batch as queued, once pre-flight has had its say
+def ledger_queue(targets, profile):
+    for target_file in targets:
+        ledger_update(target_file, profile, 'queued')
+####################################################################################
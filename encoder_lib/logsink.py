@@ -0,0 +1,86 @@
+import json
+import time
+import fcntl
+import queue
+import atexit
+import threading
+import datetime as dt
+from encoder_lib.metrics import record_event
+
+####################################################################################
+# Log sink parameters
+####################################################################################
+# Lines are handed to a writer thread and written out in batches at most this
+# often, instead of opening the log file for every line
+FLUSH_SECONDS = 1.0
+####################################################################################
+
+
+####################################################################################
+# One long-lived writer per script. logger() hands it finished lines, so
+# concurrent encodes never contend on the file. Each batch is appended under an
+# exclusive flock, so two scripts writing the same day's log don't interleave
+# mid-line. Structured events go to a JSONL file next to the human-readable log.
+class LogSink:
+    def __init__(self, log_path, jsonl_path=None, flush_seconds=FLUSH_SECONDS):
+        self.log_path = log_path
+        self.jsonl_path = jsonl_path
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue()
+        self.pipes = {}
+        self.thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Queue an already formatted line (or lines) for the human-readable log
+    def write(self, text):
+        self.queue.put((self.log_path, text))
+
+    # Queue a structured record for the JSONL stream. Every event also updates the metrics.
+    def event(self, event, **fields):
+        record_event(event, fields)
+        if not self.jsonl_path:
+            return
+        record = {'ts': dt.datetime.now().isoformat(timespec='milliseconds'), 'event': event, **fields}
+        self.queue.put((self.jsonl_path, json.dumps(record, default=str) + '\n'))
+
+    # Write out everything queued so far and stop the writer thread
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        pending = {}
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = ()
+
+            if item:
+                path, text = item
+                pending.setdefault(path, []).append(text)
+            if item is None or time.monotonic() - last_flush >= self.flush_seconds:
+                self._flush(pending)
+                pending = {}
+                last_flush = time.monotonic()
+            if item is None:
+                break
+
+        for pipe in self.pipes.values():
+            pipe.close()
+
+    def _flush(self, pending):
+        for path, chunks in pending.items():
+            pipe = self.pipes.get(path)
+            if pipe is None:
+                pipe = self.pipes[path] = open(path, 'a')
+            fcntl.flock(pipe, fcntl.LOCK_EX)
+            try:
+                pipe.write(''.join(chunks))
+                pipe.flush()
+            finally:
+                fcntl.flock(pipe, fcntl.LOCK_UN)
+####################################################################################
@@ -0,0 +1,167 @@
+import os
+import sys
+import atexit
+import platform
+import threading
+from encoder_lib.common import STATE_DIR
+
+####################################################################################
+# Metrics parameters
+####################################################################################
+# Each process keeps its counters in memory and writes them out in Prometheus
+# text format (node_exporter's textfile collector reads the directory) as
+# <script name>.prom, at most every METRICS_WRITE_SECONDS and once on exit.
+# The job server also serves them, with its queue, at GET /metrics.
+METRICS_DIR = os.environ.get('ENCODER_METRICS_DIR', os.path.join(STATE_DIR, 'metrics'))
+METRICS_WRITE_SECONDS = 15
+
+# (type, help) for every metric. All of them carry a host label, and most a profile label.
+METRIC_DEFINITIONS = {
+    'encoder_files_total': ('counter', 'Files finished, by result (encoded, failed, skipped, ...)'),
+    'encoder_bytes_in_total': ('counter', 'Source bytes of encoded files'),
+    'encoder_bytes_out_total': ('counter', 'Output bytes of encoded files'),
+    'encoder_bytes_reclaimed_total': ('counter', 'Source bytes minus output bytes of encoded files that shrank'),
+    'encoder_output_seconds_total': ('counter', 'Seconds of media encoded'),
+    'encoder_cpu_seconds_total': ('counter', 'ffmpeg CPU seconds (user + system) spent encoding'),
+    'encoder_fps': ('gauge', 'Average fps of the last file encoded'),
+    'encoder_speed': ('gauge', 'Average speed (media seconds per second) of the last file encoded'),
+    'encoder_cpu_seconds_per_output_minute': ('gauge', 'CPU seconds per minute of output for the last file encoded'),
+    'encoder_jobs': ('gauge', 'Unfinished jobs in this process by ledger state (queued, encoding, encoded, ...)'),
+    'encoder_stage_seconds_total': ('counter', 'Seconds spent in each stage of encode() (prepare, encode, verify, finish)'),
+    'encoder_stage_runs_total': ('counter', 'Times each stage of encode() ran'),
+    'encoder_batches_total': ('counter', 'Batches run'),
+    'encoder_last_batch_seconds': ('gauge', 'Wall time of the last batch'),
+    'encoder_server_jobs': ('gauge', 'Job server jobs waiting or running'),
+    'encoder_server_jobs_finished_total': ('counter', 'Job server jobs finished, by state (done, failed)'),
+    'encoder_server_workers': ('gauge', 'Workers seen by the job server within a lease'),
+}
+####################################################################################
+
+
+####################################################################################
+def _label_text(labels):
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in sorted(labels))
+    return '{' + ','.join(escaped) + '}'
+####################################################################################
+
+
+####################################################################################
+# A process-wide set of labelled counters and gauges
+class Metrics:
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        self.job_states = {}
+        self.dirty = threading.Event()
+        self.writer = None
+
+    def _key(self, name, labels):
+        if name not in METRIC_DEFINITIONS:
+            raise ValueError(f'Unknown metric: {name}')
+        return name, tuple(sorted({'host': platform.node(), **labels}.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self._changed()
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = value
+        self._changed()
+
+    # Move a job between ledger states, keeping the encoder_jobs gauges in step.
+    # Finished jobs are dropped, so a resident daemon or worker doesn't collect
+    # them forever; they are counted in encoder_files_total instead.
+    def job_state(self, path, profile, state, finished=False):
+        with self.lock:
+            previous = self.job_states.pop((path, profile), None)
+            if not finished:
+                self.job_states[(path, profile)] = state
+        if previous:
+            self.inc('encoder_jobs', -1, profile=profile, state=previous)
+        if not finished:
+            self.inc('encoder_jobs', 1, profile=profile, state=state)
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        lines = []
+        for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+            samples = [(labels, value) for (metric, labels), value in values if metric == name]
+            if not samples:
+                continue
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+            lines += [f'{name}{_label_text(labels)} {round(value, 6)}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.{os.getpid()}.partial'
+        with open(partial, 'w') as pipe:
+            pipe.write(self.render())
+        os.replace(partial, path)
+
+    # Start the textfile writer on the first change
+    def _changed(self):
+        self.dirty.set()
+        with self.lock:
+            if self.writer:
+                return
+            path = os.path.join(METRICS_DIR, f'{os.path.splitext(os.path.basename(sys.argv[0] or "encoder"))[0]}.prom')
+            self.writer = threading.Thread(target=self._write_loop, args=(path,), name='metrics-writer', daemon=True)
+        self.writer.start()
+        atexit.register(self.write, path)
+
+    def _write_loop(self, path):
+        while True:
+            self.dirty.wait()
+            self.dirty.clear()
+            try:
+                self.write(path)
+            except OSError:
+                pass
+            threading.Event().wait(METRICS_WRITE_SECONDS)
+####################################################################################
+
+
+METRICS = Metrics()
+
+
+####################################################################################
+# Update the metrics from a structured log event (see LogSink.event)
+def record_event(event, fields):
+    profile = fields.get('profile', 'unknown')
+    if event == 'skip':
+        METRICS.inc('encoder_files_total', profile=profile, result='skipped')
+    elif event == 'batch':
+        METRICS.inc('encoder_batches_total', profile=profile)
+        if fields.get('seconds') is not None:
+            METRICS.set('encoder_last_batch_seconds', fields['seconds'], profile=profile)
+    elif event == 'file':
+        METRICS.inc('encoder_files_total', profile=profile, result=fields.get('result', 'unknown'))
+        for stage, seconds in (fields.get('stages') or {}).items():
+            METRICS.inc('encoder_stage_seconds_total', seconds, profile=profile, stage=stage)
+            METRICS.inc('encoder_stage_runs_total', profile=profile, stage=stage)
+        if fields.get('result') not in ('encoded', 'recovered'):
+            return
+
+        before_size, after_size = fields.get('before_size') or 0, fields.get('after_size') or 0
+        METRICS.inc('encoder_bytes_in_total', before_size, profile=profile)
+        METRICS.inc('encoder_bytes_out_total', after_size, profile=profile)
+        # A counter can't go down: an output larger than its source reclaims nothing
+        METRICS.inc('encoder_bytes_reclaimed_total', max(0, before_size - after_size), profile=profile)
+        if fields.get('out_time'):
+            METRICS.inc('encoder_output_seconds_total', fields['out_time'], profile=profile)
+        if fields.get('cpu_time'):
+            METRICS.inc('encoder_cpu_seconds_total', fields['cpu_time'], profile=profile)
+        if fields.get('avg_fps') is not None:
+            METRICS.set('encoder_fps', fields['avg_fps'], profile=profile)
+            METRICS.set('encoder_speed', fields.get('avg_speed') or 0, profile=profile)
+        if fields.get('cpu_time') and fields.get('out_time'):
+            METRICS.set('encoder_cpu_seconds_per_output_minute',
+                        round(fields['cpu_time'] * 60 / fields['out_time'], 3), profile=profile)
+####################################################################################
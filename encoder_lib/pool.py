@@ -0,0 +1,66 @@
+import os
+import concurrent.futures as cf
+
+
+####################################################################################
+# Cores one libx265 process keeps busy before adding more stops paying off.
+# Smaller frames parallelise worse inside x265, so the 720p profile gets less.
+CORES_PER_JOB = {
+    '1080p': 8,
+    '720p': 4,
+    'reencode': 8,
+}
+####################################################################################
+
+
+####################################################################################
+def cpu_count():
+    return os.cpu_count() or 1
+####################################################################################
+
+
+####################################################################################
+# Turn the --jobs value into a worker count, never more than there are targets
+def resolve_jobs(requested, profile, target_count):
+    if str(requested).lower() == 'auto':
+        jobs = cpu_count() // CORES_PER_JOB.get(profile, 8)
+    else:
+        jobs = int(requested)
+    return max(1, min(jobs, target_count))
+####################################################################################
+
+
+####################################################################################
+# Split the machine between the running encoders. x265 sizes its thread pool
+# and frame threads from the full core count otherwise, so N concurrent
+# encodes would oversubscribe the box N times over.
+def x265_pool_params(jobs):
+    cores = max(1, cpu_count() // max(1, jobs))
+
+    # Same frame-thread ladder x265 uses when left to auto-detect
+    if cores >= 32:
+        frame_threads = 6
+    elif cores >= 16:
+        frame_threads = 5
+    elif cores >= 8:
+        frame_threads = 3
+    elif cores >= 4:
+        frame_threads = 2
+    else:
+        frame_threads = 1
+    return f'pools={cores}:frame-threads={frame_threads}'
+####################################################################################
+
+
+####################################################################################
+# Run worker(index, target) for every target on a pool of threads. Each worker
+# spends its time waiting on an ffmpeg child, so threads are enough. Results
+# come back in target order so the caller's totals read the same as a serial run.
+def run_pool(worker, targets, jobs):
+    if jobs <= 1:
+        return [worker(index, target) for index, target in enumerate(targets, 1)]
+
+    with cf.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(worker, index, target) for index, target in enumerate(targets, 1)]
+        return [future.result() for future in futures]
+####################################################################################
@@ -0,0 +1,100 @@
+import os
+import time
+import tempfile
+import humanize as hm
+from encoder_lib.common import FF_BIN, INDENT, run_ffmpeg
+from encoder_lib.filters import plan_video_filters
+from encoder_lib.probe import probe_cached, probe_duration, summarize
+from encoder_lib.segments import split_tag_switches
+from encoder_lib.streams import needs_remux
+
+####################################################################################
+# Predictor parameters
+####################################################################################
+# Short clips spread evenly through the file, encoded with the real profile switches
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 10
+####################################################################################
+
+
+####################################################################################
+# Start times for the sample clips, away from the very start and end of the file
+def sample_starts(duration):
+    return [max(0.0, duration * i / (SAMPLE_COUNT + 1) - SAMPLE_SECONDS / 2) for i in range(1, SAMPLE_COUNT + 1)]
+####################################################################################
+
+
+####################################################################################
+# Encode the sample clips and extrapolate the full encode. The profile's video
+# switches are planned for the source first, as encode() does. Returns a dict
+# with the predicted size ratio, size and encode time, or None when the file is
+# too short for sampling to tell us anything a full encode wouldn't, or will
+# only be remuxed.
+def predict_encode(target_file, video_switches, audio_switches, allow_10_bit=True):
+    probe_data = probe_cached(target_file)
+    duration = probe_duration(probe_data)
+    if not duration or duration < SAMPLE_COUNT * SAMPLE_SECONDS * 2:
+        return None
+
+    summary = summarize(probe_data)
+    video_switches, _ = plan_video_filters(video_switches, summary, allow_10_bit)
+    if '-vf' not in video_switches and needs_remux(summary, os.path.splitext(target_file)[1]):
+        return None
+
+    source_size = os.path.getsize(target_file)
+    sample_switches, _ = split_tag_switches(video_switches)
+    sample_bytes = 0
+    sample_seconds = 0.0
+    with tempfile.TemporaryDirectory(prefix='encode_predict_') as work_dir:
+        for index, start in enumerate(sample_starts(duration)):
+            sample_file = os.path.join(work_dir, f'sample_{index}.mkv')
+            started = time.monotonic()
+            run_ffmpeg([
+                FF_BIN, '-hide_banner',
+                '-ss', f'{start:.3f}', '-t', str(SAMPLE_SECONDS), '-i', target_file,
+                '-map', '0:v:0', '-map', '0:a:0?',
+                *sample_switches, *audio_switches,
+                sample_file
+            ])
+            sample_seconds += time.monotonic() - started
+            sample_bytes += os.path.getsize(sample_file)
+
+    # Source bytes covered by the samples, assuming a roughly even bitrate
+    sampled_media = SAMPLE_COUNT * SAMPLE_SECONDS
+    ratio = sample_bytes / (source_size * sampled_media / duration)
+    return {
+        'ratio': ratio,
+        'predicted_size': int(source_size * ratio),
+        'predicted_seconds': sample_seconds * duration / sampled_media,
+    }
+####################################################################################
+
+
+####################################################################################
+# Drop targets whose predicted saving is below min_savings (percent). Returns
+# the targets to encode and (name, reason) pairs for the ones skipped.
+def prediction_filter(targets, min_savings, video_switches, audio_switches, log, allow_10_bit=True):
+    encode_list, skipped_list = [], []
+    for target_file in targets:
+        name = os.path.basename(target_file)
+        try:
+            prediction = predict_encode(target_file, video_switches, audio_switches, allow_10_bit)
+        except Exception as e:
+            log('warning', f'{INDENT}Size prediction failed for "{name}" ({str(e)}). Encoding anyway')
+            prediction = None
+
+        if prediction is None:
+            encode_list.append(target_file)
+            continue
+
+        savings = round((1 - prediction['ratio']) * 100, 2)
+        log('info', f'{INDENT}Predicted "{name}":\t {hm.naturalsize(prediction["predicted_size"])} '
+                    f'({savings}% saved) in about {hm.precisedelta(prediction["predicted_seconds"])}')
+        if savings < min_savings:
+            reason = f'predicted saving {savings}% is below {min_savings}%'
+            log('warning', f'{INDENT}Skipping "{name}":\t {reason}')
+            skipped_list.append((name, reason))
+        else:
+            encode_list.append(target_file)
+    return encode_list, skipped_list
+####################################################################################
@@ -0,0 +1,62 @@
+import os
+from encoder_lib.common import INDENT
+from encoder_lib.probe import probe_cached, summarize
+from encoder_lib.streams import needs_remux
+
+####################################################################################
+# Pre-flight parameters
+####################################################################################
+# Per profile: the output height (None keeps the source height) and the video
+# bitrate at or below which an encode isn't expected to save anything useful
+PROFILE_TARGETS = {
+    '1080p': {'height': 1080, 'min_bit_rate': 2500000},
+    '720p': {'height': 720, 'min_bit_rate': 1200000},
+    'reencode': {'height': None, 'min_bit_rate': 1500000},
+}
+####################################################################################
+
+
+####################################################################################
+# Why a probed source shouldn't be encoded with this profile, or None if it should
+def skip_reason(summary, profile):
+    target = PROFILE_TARGETS.get(profile, PROFILE_TARGETS['reencode'])
+    target_height = target['height']
+    height = summary['height']
+
+    if not summary['codec']:
+        return 'no video stream'
+    if summary['codec'] == 'hevc' and (target_height is None or (height and height <= target_height)):
+        # Still worth a quick remux when only the hvc1 tag is missing
+        if needs_remux(summary, summary['container_ext']):
+            return None
+        return 'already HEVC' if target_height is None else f'already HEVC at or below {target_height}p'
+    if target_height and height and height < target_height:
+        return f'already below {target_height}p ({height}p)'
+    if summary['bit_rate'] and summary['bit_rate'] <= target['min_bit_rate']:
+        return f'bitrate already at or below target ({summary["bit_rate"] // 1000} kb/s)'
+    return None
+####################################################################################
+
+
+####################################################################################
+# Probe every target (through the cache) and split them into the ones to
+# encode and (name, reason) pairs for the ones to skip
+def preflight(targets, profile, log, force=False):
+    encode_list, skipped_list = [], []
+    for target_file in targets:
+        name = os.path.basename(target_file)
+        try:
+            summary = summarize(probe_cached(target_file))
+            reason = None if force else skip_reason(summary, profile)
+        except FileNotFoundError:
+            reason = 'file not found'
+        except Exception as e:
+            reason = f'could not be probed ({e.__class__.__name__})'
+
+        if reason:
+            log('warning', f'{INDENT}Skipping "{name}":\t {reason}')
+            skipped_list.append((name, reason))
+        else:
+            encode_list.append(target_file)
+    return encode_list, skipped_list
+####################################################################################
@@ -0,0 +1,123 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import closing
+from encoder_lib.common import FF_PROBE_BIN, STATE_DIR, run_ffmpeg
+
+####################################################################################
+# Probe cache parameters
+####################################################################################
+# ffprobe results keyed by (path, size, mtime). A file that is replaced or
+# touched gets probed again; everything else is answered from disk.
+PROBE_CACHE_PATH = os.path.join(STATE_DIR, 'probe_cache.sqlite')
+PROBE_CACHE_LOCK = threading.Lock()
+####################################################################################
+
+
+####################################################################################
+# Read container and stream details with ffprobe
+def ffprobe(target_file):
+    command = [
+        FF_PROBE_BIN, '-v', 'error',
+        '-print_format', 'json',
+        '-show_format', '-show_streams',
+        target_file
+    ]
+    return json.loads(run_ffmpeg(command).stdout)
+####################################################################################
+
+
+####################################################################################
+def _probe_cache_connection():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    connection = sqlite3.connect(PROBE_CACHE_PATH, timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS probes ('
+        'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)'
+    )
+    return connection
+####################################################################################
+
+
+####################################################################################
+# ffprobe through the on-disk cache
+def probe_cached(target_file):
+    path = os.path.abspath(target_file)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+
+    with PROBE_CACHE_LOCK, closing(_probe_cache_connection()) as connection:
+        row = connection.execute(
+            'SELECT data FROM probes WHERE path = ? AND size = ? AND mtime_ns = ?', key
+        ).fetchone()
+    if row:
+        return json.loads(row[0])
+
+    probe_data = ffprobe(path)
+    with PROBE_CACHE_LOCK, closing(_probe_cache_connection()) as connection, connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO probes (path, size, mtime_ns, data) VALUES (?, ?, ?, ?)',
+            (*key, json.dumps(probe_data))
+        )
+    return probe_data
+####################################################################################
+
+
+####################################################################################
+# Duration in seconds, or None when the container doesn't report one
+def probe_duration(probe_data):
+    try:
+        return float(probe_data['format']['duration'])
+    except (KeyError, TypeError, ValueError):
+        return None
+####################################################################################
+
+
+####################################################################################
+def streams_of_type(probe_data, codec_type):
+    return [s for s in probe_data.get('streams', []) if s.get('codec_type') == codec_type]
+####################################################################################
+
+
+####################################################################################
+# ffprobe reports frame rates as fractions ("24000/1001")
+def parse_frame_rate(value):
+    numerator, _, denominator = str(value or '').partition('/')
+    try:
+        rate = float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+####################################################################################
+
+
+####################################################################################
+# The handful of fields the pre-flight checks care about, from the first video stream
+def summarize(probe_data):
+    video_streams = streams_of_type(probe_data, 'video')
+    video = video_streams[0] if video_streams else {}
+    bit_rate = video.get('bit_rate') or probe_data.get('format', {}).get('bit_rate')
+    return {
+        'codec': video.get('codec_name'),
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'pix_fmt': video.get('pix_fmt'),
+        'frame_rate': parse_frame_rate(video.get('avg_frame_rate')) or parse_frame_rate(video.get('r_frame_rate')),
+        'codec_tag': video.get('codec_tag_string'),
+        'container_ext': os.path.splitext(probe_data.get('format', {}).get('filename', ''))[1].lower(),
+        'bit_rate': int(bit_rate) if str(bit_rate).isdigit() else None,
+        'duration': probe_duration(probe_data),
+    }
+####################################################################################
+
+
+####################################################################################
+# Duration straight from a file. Progress reporting only needs it for the ETA,
+# so a failed probe just means no ETA.
+def source_duration(target_file):
+    try:
+        return probe_duration(probe_cached(target_file))
+    except Exception:
+        return None
+####################################################################################
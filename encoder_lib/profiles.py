@@ -0,0 +1,36 @@
+import os
+import datetime as dt
+import importlib.util
+
+####################################################################################
+# Profile parameters
+####################################################################################
+# The encoder scripts live next to encoder_lib. "Re-encode_as_HEVC.py" isn't a
+# valid module name, so they're loaded by path rather than imported.
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_SCRIPTS = {
+    '1080p': 'Encode_as_1080p_HEVC.py',
+    '720p': 'Encode_as_720p_HEVC.py',
+    'reencode': 'Re-encode_as_HEVC.py',
+}
+####################################################################################
+
+_loaded = {}
+
+
+####################################################################################
+# Load (once per day, so each day's batches log to that day's logfile) the
+# encoder script for a profile. The module's run_batch(options) runs one batch.
+def load_profile(profile):
+    if profile not in PROFILE_SCRIPTS:
+        raise ValueError(f'Unknown profile: {profile}')
+
+    key = (profile, dt.date.today())
+    if key not in _loaded:
+        script_path = os.path.join(SCRIPTS_DIR, PROFILE_SCRIPTS[profile])
+        spec = importlib.util.spec_from_file_location(f'encoder_profile_{profile}', script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded[key] = module
+    return _loaded[key]
+####################################################################################
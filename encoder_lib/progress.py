@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+import subprocess
+import datetime as dt
+from collections import deque
+import humanize as hm
+from encoder_lib.common import INDENT, slot_process
+
+####################################################################################
+# Progress parameters
+####################################################################################
+# How often a rate sample is written to the log while ffmpeg runs
+PROGRESS_LOG_SECONDS = 60
+
+# Lines of ffmpeg's stderr kept for the failure message
+STDERR_TAIL_LINES = 20
+
+# The size projection is too noisy to act on before this much has been encoded
+MIN_PROJECTION_SECONDS = 60
+MIN_PROJECTION_FRACTION = 0.05
+####################################################################################
+
+
+####################################################################################
+# Raised when a watchdog stops an encode that isn't worth finishing
+class EncodeAborted(Exception):
+    pass
+####################################################################################
+
+
+####################################################################################
+# Raised when the job server gives a worker's file to another worker mid-encode
+class EncodeCancelled(Exception):
+    pass
+####################################################################################
+
+
+####################################################################################
+def _to_float(value):
+    try:
+        return float(str(value).rstrip('x'))
+    except (TypeError, ValueError):
+        return None
+####################################################################################
+
+
+####################################################################################
+# Convert one "-progress" block (key=value lines up to "progress=...") to numbers.
+# ffmpeg reports "N/A" for anything it can't measure yet.
+def parse_progress_block(block):
+    out_time_us = _to_float(block.get('out_time_us', block.get('out_time_ms')))
+    return {
+        'frame': int(_to_float(block.get('frame')) or 0),
+        'fps': _to_float(block.get('fps')),
+        'speed': _to_float(block.get('speed')),
+        'out_time': out_time_us / 1000000 if out_time_us and out_time_us > 0 else 0.0,
+        'total_size': int(_to_float(block.get('total_size')) or 0),
+    }
+####################################################################################
+
+
+####################################################################################
+def format_eta(seconds):
+    if seconds is None:
+        return 'unknown'
+    return str(dt.timedelta(seconds=int(seconds)))
+####################################################################################
+
+
+####################################################################################
+# Estimated wall-clock seconds left, from how much media has been encoded so far
+def estimate_eta(elapsed, out_time, duration):
+    if not duration or out_time <= 0:
+        return None
+    return max(0.0, elapsed * (duration - out_time) / out_time)
+####################################################################################
+
+
+####################################################################################
+# Watchdog for run_with_progress(): stop the encode once the output is projected
+# to end up bigger than max_ratio times the source. Returns the reason to stop, or None.
+def size_watchdog(source_size, duration, max_ratio):
+    limit = source_size * max_ratio
+    min_out_time = max(MIN_PROJECTION_SECONDS, duration * MIN_PROJECTION_FRACTION)
+
+    def check(sample):
+        if sample['out_time'] < min_out_time or not sample['total_size']:
+            return None
+        projected = sample['total_size'] * duration / sample['out_time']
+        if projected > limit:
+            return 'projected output {} exceeds {:.0%} of the source ({})'.format(
+                hm.naturalsize(projected), max_ratio, hm.naturalsize(source_size))
+        return None
+    return check
+####################################################################################
+
+
+####################################################################################
+# Run an ffmpeg command while reading its "-progress" stream as it arrives.
+# A rate sample (frame, fps, speed, size, ETA) is logged every
+# PROGRESS_LOG_SECONDS, then the average fps and speed once ffmpeg exits.
+# stderr is drained on a separate thread so a chatty encode can't fill the pipe.
+# watchdog(sample) is called on every progress block; returning a reason kills
+# ffmpeg and raises EncodeAborted.
+# Returns the final stats. Raises CalledProcessError like subprocess.run(check=True).
+def run_with_progress(command, log, duration=None, watchdog=None):
+    command = [command[0], '-progress', 'pipe:1', '-nostats', *command[1:]]
+    start = time.monotonic()
+    process = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, bufsize=1)
+
+    with slot_process(process.pid):
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        drain = threading.Thread(target=stderr_tail.extend, args=(process.stderr,), daemon=True)
+        drain.start()
+
+        block = {}
+        sample = parse_progress_block(block)
+        last_logged = start
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key != 'progress':
+                block[key] = value
+                continue
+
+            sample = parse_progress_block(block)
+            block = {}
+            abort_reason = watchdog(sample) if watchdog else None
+            if abort_reason:
+                process.kill()
+                process.wait()
+                drain.join()
+                raise EncodeAborted(abort_reason)
+
+            now = time.monotonic()
+            if value == 'continue' and now - last_logged >= PROGRESS_LOG_SECONDS:
+                last_logged = now
+                elapsed = now - start
+                percent = f'{100 * sample["out_time"] / duration:.1f}%' if duration else 'n/a'
+                log('info', '{}Progress: {:>6}   frame {:>7}   {:>6} fps   {:>6}x   {:>10}   ETA {}'.format(
+                    INDENT, percent, sample['frame'], sample['fps'] or 0, sample['speed'] or 0,
+                    hm.naturalsize(sample['total_size']),
+                    format_eta(estimate_eta(elapsed, sample['out_time'], duration))
+                ))
+
+        # wait4 for the CPU time ffmpeg used, as benchmark.measure does
+        _, status, usage = os.wait4(process.pid, 0)
+        return_code = process.returncode = os.waitstatus_to_exitcode(status)
+        drain.join()
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, command, stderr=''.join(stderr_tail))
+
+        elapsed = time.monotonic() - start
+        stats = {
+            'frames': sample['frame'],
+            'out_time': sample['out_time'],
+            'total_size': sample['total_size'],
+            'wall_time': round(elapsed, 3),
+            'cpu_time': round(usage.ru_utime + usage.ru_stime, 3),
+            'avg_fps': round(sample['frame'] / elapsed, 2) if elapsed else 0.0,
+            'avg_speed': round(sample['out_time'] / elapsed, 3) if elapsed else 0.0,
+        }
+        log('info', f'{INDENT}Average rate:\t {stats["avg_fps"]} fps\t Speed:\t {stats["avg_speed"]}x')
+        return stats
+####################################################################################
@@ -0,0 +1,256 @@
+import os
+import re
+import math
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import datetime as dt
+from contextlib import closing
+from encoder_lib.cache import content_fingerprint, settings_key
+from encoder_lib.common import FF_BIN, FF_PROBE_BIN, INDENT, STATE_DIR, run_ffmpeg
+from encoder_lib.complexity import analyze_complexity, with_rate_control
+from encoder_lib.history import resolution_class
+from encoder_lib.probe import probe_cached, probe_duration, summarize
+from encoder_lib.segments import split_tag_switches
+
+####################################################################################
+# Quality search parameters
+####################################################################################
+# Targets are given as METRIC=SCORE: VMAF (0-100, libvmaf) or SSIM (0-1)
+QUALITY_METRICS = ('vmaf', 'ssim')
+
+# The search tries CRFs in this range, highest quality first at the low end.
+# A binary search needs at most ceil(log2(range)) probes; each probe encodes
+# SEARCH_WINDOW_COUNT windows with the real switches and scores them against
+# the source. The worst window decides.
+CRF_SEARCH_RANGE = (18, 32)
+SEARCH_WINDOW_COUNT = 3
+SEARCH_WINDOW_SECONDS = 4
+
+# A search whose probes run past this stops with the best CRF found so far.
+# The first probe always runs.
+SEARCH_BUDGET_SECONDS = 900
+
+# Results are kept per content (the fingerprint from encoder_lib.cache) and per
+# kind of content: the same settings, source resolution class and complexity
+# class, and close bits-per-pixel and cut rate from the complexity scan
+SEARCH_CACHE_PATH = os.path.join(STATE_DIR, 'crf_search.sqlite')
+SEARCH_CACHE_LOCK = threading.Lock()
+SIMILAR_BPP_STEP = 0.02
+SIMILAR_CUTS_STEP = 6
+####################################################################################
+
+
+####################################################################################
+# argparse type for --target-quality: "vmaf=93" -> ('vmaf', 93.0)
+def parse_quality_target(value):
+    metric, _, score = value.partition('=')
+    metric = metric.strip().lower()
+    try:
+        score = float(score)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected METRIC=SCORE, got "{value}"')
+    if metric not in QUALITY_METRICS:
+        raise argparse.ArgumentTypeError(f'unknown metric "{metric}". Expected one of: {", ".join(QUALITY_METRICS)}')
+    if not 0 < score <= (100 if metric == 'vmaf' else 1):
+        raise argparse.ArgumentTypeError(f'{metric} target {score} is out of range')
+    return metric, score
+####################################################################################
+
+
+####################################################################################
+def _search_connection():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    connection = sqlite3.connect(SEARCH_CACHE_PATH, timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS searches (key TEXT PRIMARY KEY, crf TEXT, score REAL, searched TEXT)'
+    )
+    return connection
+####################################################################################
+
+
+####################################################################################
+def _cached_search(key):
+    with SEARCH_CACHE_LOCK, closing(_search_connection()) as connection:
+        return connection.execute('SELECT crf, score FROM searches WHERE key = ?', (key,)).fetchone()
+####################################################################################
+
+
+####################################################################################
+def _store_search(keys, crf, score):
+    searched = dt.datetime.now().isoformat(timespec='seconds')
+    with SEARCH_CACHE_LOCK, closing(_search_connection()) as connection, connection:
+        for key in keys:
+            connection.execute('INSERT OR REPLACE INTO searches (key, crf, score, searched) VALUES (?, ?, ?, ?)',
+                               (key, crf, score, searched))
+####################################################################################
+
+
+####################################################################################
+def ffmpeg_has_filter(name):
+    output = subprocess.run([FF_BIN, '-hide_banner', '-filters'], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True).stdout
+    return re.search(rf'^\s*\S+\s+{re.escape(name)}\s', output, re.MULTILINE) is not None
+####################################################################################
+
+
+####################################################################################
+def search_windows(duration):
+    if duration <= SEARCH_WINDOW_COUNT * SEARCH_WINDOW_SECONDS:
+        return [0.0]
+    return [duration * (i + 0.5) / SEARCH_WINDOW_COUNT - SEARCH_WINDOW_SECONDS / 2 for i in range(SEARCH_WINDOW_COUNT)]
+####################################################################################
+
+
+####################################################################################
+def current_preset(switches):
+    return switches[switches.index('-preset') + 1] if '-preset' in switches else 'medium'
+####################################################################################
+
+
+####################################################################################
+# Threads the encode may use: the x265 pool it was given (see
+# pool.x265_pool_params), or else every core
+def pool_threads(x265_switches):
+    params = x265_switches[x265_switches.index('-x265-params') + 1] if '-x265-params' in x265_switches else ''
+    match = re.search(r'(?:^|:)pools=(\d+)', params)
+    return int(match.group(1)) if match else os.cpu_count() or 1
+####################################################################################
+
+
+####################################################################################
+# Score one encoded window against the same window of the source (see
+# reference_window), scaled to the encode's size so only the encoder's loss is
+# measured. threads caps the scoring filters to the encode's share of the cores.
+def window_score(sample_file, reference_file, metric, threads=None):
+    threads = threads or os.cpu_count() or 1
+    size = subprocess.run([
+        FF_PROBE_BIN, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height', '-of', 'csv=p=0', sample_file
+    ], check=True, stdout=subprocess.PIPE, text=True).stdout.strip().split(',')
+    width, height = int(size[0]), int(size[1])
+
+    compare = 'ssim' if metric == 'ssim' else f'libvmaf=n_threads={threads}'
+    result = run_ffmpeg([
+        FF_BIN, '-hide_banner', '-nostats', '-filter_threads', str(threads),
+        '-i', sample_file, '-i', reference_file,
+        '-lavfi', f'[0:v]setpts=PTS-STARTPTS,format=yuv420p[distorted];'
+                  f'[1:v]setpts=PTS-STARTPTS,scale={width}:{height}:flags=bicubic,format=yuv420p[reference];'
+                  f'[distorted][reference]{compare}',
+        '-f', 'null', '-'
+    ])
+    log_text = result.stderr.decode(errors='replace')
+    match = re.search(r'All:([\d.]+)' if metric == 'ssim' else r'VMAF score: ([\d.]+)', log_text)
+    if not match:
+        raise ValueError(f'ffmpeg reported no {metric} score')
+    return float(match.group(1))
+####################################################################################
+
+
+####################################################################################
+# A lossless copy of one window of the source, cut with the same seek as the
+# sample encodes so the frames line up. Seeking the source inside the scoring
+# graph instead can leave the two a frame apart. Made once and kept for every probe.
+def reference_window(input_file, start, work_dir, index):
+    reference_file = os.path.join(work_dir, f'reference_{index}.mkv')
+    if not os.path.exists(reference_file):
+        run_ffmpeg([
+            FF_BIN, '-hide_banner', '-nostats', '-y',
+            '-ss', f'{start:.3f}', '-t', str(SEARCH_WINDOW_SECONDS), '-i', input_file,
+            '-map', '0:v:0', '-an', '-sn', '-c:v', 'ffv1',
+            reference_file
+        ])
+    return reference_file
+####################################################################################
+
+
+####################################################################################
+# Encode each window at one CRF and return the worst window's score.
+# x265_switches is the encode's share of the cores (see pool.x265_pool_params),
+# used for the sample encodes and their scoring alike.
+def probe_crf(input_file, video_switches, crf, starts, metric, work_dir, x265_switches=()):
+    sample_switches, _ = split_tag_switches(video_switches)
+    scores = []
+    for index, start in enumerate(starts):
+        reference_file = reference_window(input_file, start, work_dir, index)
+        sample_file = os.path.join(work_dir, f'crf{crf}_{index}.mkv')
+        run_ffmpeg([
+            FF_BIN, '-hide_banner', '-nostats', '-y',
+            '-ss', f'{start:.3f}', '-t', str(SEARCH_WINDOW_SECONDS), '-i', input_file,
+            '-map', '0:v:0', '-an', '-sn', *x265_switches,
+            *with_rate_control(sample_switches, str(crf), current_preset(sample_switches)),
+            sample_file
+        ])
+        scores.append(window_score(sample_file, reference_file, metric, pool_threads(x265_switches)))
+    return min(scores)
+####################################################################################
+
+
+####################################################################################
+# Find the highest CRF whose sampled quality still meets target (metric, score)
+# for these video switches. complexity is an analyze_complexity() result when
+# the caller already has one; otherwise the scan is run here for the cache key.
+# x265_switches is passed on to the sample encodes and left out of the cache key.
+# Returns the crf/preset to use plus what the search found and cost, in the
+# shape of an analyze_complexity() result, or None when the source can't be
+# searched (no duration, or no libvmaf for a VMAF target).
+def search_crf(input_file, video_switches, target, profile, log, complexity=None, x265_switches=()):
+    metric, goal = target
+    started = time.monotonic()
+    probe_data = probe_cached(input_file)
+    summary, duration = summarize(probe_data), probe_duration(probe_data)
+    if not duration or '-crf' not in video_switches:
+        return None
+    if metric == 'vmaf' and not ffmpeg_has_filter('libvmaf'):
+        log('warning', f'{INDENT}ffmpeg was built without libvmaf. Skipping the CRF search')
+        return None
+
+    preset = current_preset(video_switches)
+    settings = settings_key(profile, [*with_rate_control(video_switches, '*', preset), metric, goal])
+    complexity = complexity or analyze_complexity(input_file) or {}
+    content_key = f'content:{settings}:{content_fingerprint(input_file)}'
+    similar_key = None
+    if complexity:
+        similar_key = (f'similar:{settings}:{resolution_class(summary.get("height"))}:{complexity["complexity"]}:'
+                       f'{int(complexity["bpp"] / SIMILAR_BPP_STEP)}:{int(complexity["cuts_per_minute"] // SIMILAR_CUTS_STEP)}')
+    result = {'quality_metric': metric, 'quality_target': goal, 'preset': preset}
+
+    for key, source in ((content_key, 'content'), (similar_key, 'similar')):
+        cached = _cached_search(key) if key else None
+        if cached:
+            return {**result, 'crf': cached[0], 'quality_score': cached[1], 'search_cached': source,
+                    'search_encodes': 0, 'search_seconds': round(time.monotonic() - started, 1)}
+
+    starts = search_windows(duration)
+    low, high = CRF_SEARCH_RANGE
+    best, last_score, probes = None, None, 0
+    search_started = time.monotonic()
+    with tempfile.TemporaryDirectory(prefix='encode_crf_search_') as work_dir:
+        while low <= high and (not probes or time.monotonic() - search_started < SEARCH_BUDGET_SECONDS):
+            crf = (low + high) // 2
+            last_score = probe_crf(input_file, video_switches, crf, starts, metric, work_dir, x265_switches)
+            probes += 1
+            log('info', f'{INDENT}CRF {crf}:\t {metric} {last_score:.4g}')
+            if last_score >= goal:
+                best, low = (crf, last_score), crf + 1
+            else:
+                high = crf - 1
+
+    finished = low > high
+    if best is None:
+        log('warning', f'{INDENT}No CRF down to {high + 1} reached {metric} {goal}. Using CRF {CRF_SEARCH_RANGE[0]}')
+        best = (CRF_SEARCH_RANGE[0], last_score)
+    if finished:
+        _store_search([key for key in (content_key, similar_key) if key], str(best[0]), best[1])
+    elif best[0] != CRF_SEARCH_RANGE[0]:
+        log('warning', f'{INDENT}CRF search ran out of time ({SEARCH_BUDGET_SECONDS}s). Using the best CRF found so far')
+
+    encodes = probes * len(starts)
+    return {**result, 'crf': str(best[0]), 'quality_score': best[1], 'search_cached': None,
+            'search_encodes': encodes, 'search_probes': probes,
+            'search_max_encodes': math.ceil(math.log2(CRF_SEARCH_RANGE[1] - CRF_SEARCH_RANGE[0] + 2)) * len(starts),
+            'search_seconds': round(time.monotonic() - started, 1)}
+####################################################################################
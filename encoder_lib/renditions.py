@@ -0,0 +1,79 @@
+import os
+import pathlib
+from encoder_lib.complexity import with_rate_control
+from encoder_lib.filters import plan_video_filters, take_switch
+from encoder_lib.profiles import load_profile
+from encoder_lib.streams import plan_streams
+
+####################################################################################
+# Rendition parameters
+####################################################################################
+# Extra renditions are written next to the source, named after their profile
+# ("Movie.720p.mkv"), while the profile being run replaces the source as usual
+RENDITION_NAME = '{stem}.{profile}{ext}'
+RENDITION_TEMP_NAME = '{stem}.{profile}.TEMP{ext}'
+####################################################################################
+
+
+####################################################################################
+# The (video switches, audio switches, allow 10-bit) a profile encodes with
+def profile_settings(profile):
+    module = load_profile(profile)
+    return (
+        [*getattr(module, 'VIDEO_FILTERS', []), *module.VIDEO_PARAMS],
+        module.AUDIO_PARAMS,
+        getattr(module, 'ALLOW_10_BIT', True),
+    )
+####################################################################################
+
+
+####################################################################################
+# (temp path, final path) of a profile's rendition of target_file
+def rendition_paths(target_file, profile):
+    p = pathlib.Path(target_file)
+    names = {'stem': p.stem, 'profile': profile, 'ext': p.suffix}
+    return (
+        os.path.join(p.parent, RENDITION_TEMP_NAME.format(**names)),
+        os.path.join(p.parent, RENDITION_NAME.format(**names)),
+    )
+####################################################################################
+
+
+####################################################################################
+# Plan one rendition of a probed source from a profile's settings (see
+# profile_settings), as plan_video_filters and plan_streams would for a single
+# encode. encode_choice is an analyze_complexity() result to apply, if any.
+def plan_rendition(settings, probe_data, summary, output_ext, encode_choice=None):
+    video_switches, audio_params, allow_10_bit = settings
+    planned, filter_graph = plan_video_filters(video_switches, summary, allow_10_bit)
+    video_filter, planned = take_switch(planned, '-vf')
+    if encode_choice:
+        planned = with_rate_control(planned, encode_choice['crf'], encode_choice['preset'])
+    stream_switches, stream_notes = plan_streams(probe_data, audio_params, output_ext)
+    return {
+        'filter': video_filter or 'null',
+        'video_switches': planned,
+        'stream_switches': stream_switches,
+        'filter_graph': filter_graph,
+        'stream_notes': stream_notes,
+    }
+####################################################################################
+
+
+####################################################################################
+# The ffmpeg switches (everything after the input) that decode the source once,
+# split its video in the filter graph and write one output per (plan, output file).
+# output_switches (x265 params, metadata) are repeated for every output.
+# The first output is the one ffmpeg's progress size refers to.
+def rendition_switches(outputs, output_switches):
+    branches = ''.join(f'[split{index}]' for index in range(len(outputs)))
+    graph = [f'[0:V:0]split={len(outputs)}{branches}']
+    switches = []
+    for index, (plan, output_file) in enumerate(outputs):
+        graph.append(f'[split{index}]{plan["filter"]}[out{index}]')
+        switches += [
+            '-map', f'[out{index}]', *plan['video_switches'], *plan['stream_switches'],
+            *output_switches, output_file
+        ]
+    return ['-filter_complex', ';'.join(graph), *switches]
+####################################################################################
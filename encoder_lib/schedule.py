@@ -0,0 +1,180 @@
+import os
+import heapq
+import sqlite3
+import fnmatch
+import threading
+import datetime as dt
+from contextlib import closing
+from encoder_lib.common import INDENT, STATE_DIR
+from encoder_lib.probe import probe_cached, summarize
+
+####################################################################################
+# Scheduler parameters
+####################################################################################
+#   given     the order the files were passed in (Finder's)
+#   longest   most expensive first, so parallel jobs finish close together
+#   shortest  cheapest first, so disk space comes back sooner
+SCHEDULE_ORDERS = ('given', 'longest', 'shortest')
+
+# Wall time of past encodes, per profile, against what each source asked for,
+# with the batch's --jobs and the segments the encode was split into. The newest
+# HISTORY_LIMIT comparable encodes of a profile are fitted on every batch.
+HISTORY_PATH = os.path.join(STATE_DIR, 'schedule_history.sqlite')
+HISTORY_LOCK = threading.Lock()
+HISTORY_LIMIT = 200
+MIN_HISTORY_FOR_FIT = 5
+
+# Megapixels per second assumed until a profile has history (x265 medium,
+# roughly 10 fps at 1080p)
+DEFAULT_MEGAPIXELS_PER_SECOND = 20.0
+DEFAULT_FRAME_RATE = 24.0
+####################################################################################
+
+
+####################################################################################
+def _history_connection():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    connection = sqlite3.connect(HISTORY_PATH, timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS encodes ('
+        'profile TEXT, megapixels REAL, megabits REAL, seconds REAL, recorded TEXT, jobs INTEGER, segments INTEGER)'
+    )
+    # Histories from before jobs and segments were recorded. Their rows are left out of the fit.
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(encodes)')}
+    for column in ('jobs', 'segments'):
+        if column not in columns:
+            connection.execute(f'ALTER TABLE encodes ADD COLUMN {column} INTEGER')
+    return connection
+####################################################################################
+
+
+####################################################################################
+# What a source costs to encode: megapixels to push through the encoder
+# (resolution x frame rate x duration) and megabits to decode. None when the
+# probe doesn't have enough to go on (see probe.summarize).
+def cost_features(summary):
+    width, height, duration = summary.get('width'), summary.get('height'), summary.get('duration')
+    if not width or not height or not duration:
+        return None
+    frame_rate = summary.get('frame_rate') or DEFAULT_FRAME_RATE
+    megapixels = width * height * frame_rate * duration / 1e6
+    megabits = (summary.get('bit_rate') or 0) * duration / 1e6
+    return megapixels, megabits
+####################################################################################
+
+
+####################################################################################
+# Add a finished encode to the history. seconds is the wall time of the ffmpeg
+# run, with jobs encodes running at once and the source split into segments
+# (1 when it wasn't).
+def record_cost(profile, summary, seconds, jobs=1, segments=1):
+    features = cost_features(summary)
+    if not features or seconds <= 0:
+        return
+    with HISTORY_LOCK, closing(_history_connection()) as connection, connection:
+        connection.execute(
+            'INSERT INTO encodes (profile, megapixels, megabits, seconds, recorded, jobs, segments) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (profile, *features, seconds, dt.datetime.now().isoformat(timespec='seconds'), jobs, segments)
+        )
+####################################################################################
+
+
+####################################################################################
+# Fit seconds = a * megapixels + b * megabits to a profile's history by least
+# squares, for an encode running alongside jobs - 1 others and split into
+# segments. Each of N encodes at once gets 1/N of the machine, so wall times are
+# scaled from the jobs they ran with to jobs. Splitting changes how well the
+# encode uses its share, so only encodes split the same way are used. Falls back
+# to a single rate (b = 0) when the fit is degenerate or gives a negative term,
+# and to the default rate when there's no comparable history yet.
+def cost_model(profile, jobs=1, segments=1):
+    with HISTORY_LOCK, closing(_history_connection()) as connection:
+        rows = connection.execute(
+            'SELECT megapixels, megabits, seconds * ? / jobs FROM encodes '
+            'WHERE profile = ? AND segments = ? AND jobs > 0 ORDER BY rowid DESC LIMIT ?',
+            (jobs, profile, segments, HISTORY_LIMIT)
+        ).fetchall()
+    if not rows:
+        return jobs / DEFAULT_MEGAPIXELS_PER_SECOND, 0.0
+
+    if len(rows) >= MIN_HISTORY_FOR_FIT:
+        xx = sum(p * p for p, _, _ in rows)
+        xy = sum(p * b for p, b, _ in rows)
+        yy = sum(b * b for _, b, _ in rows)
+        xs = sum(p * s for p, _, s in rows)
+        ys = sum(b * s for _, b, s in rows)
+        determinant = xx * yy - xy * xy
+        if determinant > 1e-9 * xx * yy:
+            a = (xs * yy - ys * xy) / determinant
+            b = (ys * xx - xs * xy) / determinant
+            if a > 0 and b >= 0:
+                return a, b
+
+    megapixels = sum(p for p, _, _ in rows)
+    return (sum(s for _, _, s in rows) / megapixels if megapixels else jobs / DEFAULT_MEGAPIXELS_PER_SECOND), 0.0
+####################################################################################
+
+
+####################################################################################
+def estimate_cost(model, summary):
+    features = cost_features(summary)
+    if not features:
+        return None
+    return model[0] * features[0] + model[1] * features[1]
+####################################################################################
+
+
+####################################################################################
+# Finish time of a batch when each job goes to whichever worker frees up first
+def estimate_makespan(costs, workers):
+    finish_times = [0.0] * max(1, workers)
+    for cost in costs:
+        heapq.heapreplace(finish_times, finish_times[0] + cost)
+    return max(finish_times)
+####################################################################################
+
+
+####################################################################################
+# Order a batch. Targets matching a --priority pattern (a glob on the path or
+# the file name) go first, in the order the patterns were given; the policy
+# orders targets within each group. Targets that can't be estimated are costed
+# at the average of the rest. workers run the batch side by side, each with
+# jobs encodes at once (default workers: one host running the whole batch),
+# split into segments. Returns the targets in run order.
+def order_targets(targets, profile, order='given', priorities=(), log=None, workers=1, jobs=None, segments=1):
+    priorities = list(priorities or [])
+    if order == 'given' and not priorities:
+        return list(targets)
+
+    def priority(target):
+        for rank, pattern in enumerate(priorities):
+            if fnmatch.fnmatch(target, pattern) or fnmatch.fnmatch(os.path.basename(target), pattern):
+                return rank
+        return len(priorities)
+
+    costs = {}
+    if order != 'given':
+        model = cost_model(profile, jobs or workers, segments)
+        for target in targets:
+            try:
+                costs[target] = estimate_cost(model, summarize(probe_cached(target)))
+            except Exception:
+                costs[target] = None
+        known = [cost for cost in costs.values() if cost is not None]
+        fallback = sum(known) / len(known) if known else 0.0
+        costs = {target: fallback if cost is None else cost for target, cost in costs.items()}
+
+    sign = {'longest': -1, 'shortest': 1}.get(order, 0)
+    ordered = sorted(targets, key=lambda target: (priority(target), sign * costs.get(target, 0.0)))
+
+    if log and costs:
+        estimated = [costs[target] for target in ordered]
+        log('info', f'Scheduled {len(ordered)} targets {order}-first. Estimated encode time: '
+                    f'{dt.timedelta(seconds=int(sum(estimated)))} in total, '
+                    f'{dt.timedelta(seconds=int(estimate_makespan(estimated, workers)))} across {workers} jobs')
+        for target in ordered:
+            log('info', f'{INDENT}{dt.timedelta(seconds=int(costs[target]))}\t {os.path.basename(target)}')
+    elif log:
+        log('info', f'Scheduled {len(ordered)} targets with {len(priorities)} priority patterns first')
+    return ordered
+####################################################################################
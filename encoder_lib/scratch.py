@@ -0,0 +1,148 @@
+import os
+import shutil
+import contextlib
+import tempfile
+import threading
+import concurrent.futures as cf
+import humanize as hm
+from encoder_lib.common import INDENT
+
+####################################################################################
+# Scratch parameters
+####################################################################################
+# Space held per staged target, as a multiple of its size: the input copy plus
+# room for an output that could, in the worst case, be as big as the input
+SCRATCH_RESERVE_FACTOR = 2
+####################################################################################
+
+
+####################################################################################
+# Stage targets on fast local storage so a slow source volume doesn't throttle ffmpeg.
+#   prefetch_all()  copies targets in, in batch order, on a background thread,
+#                   staying within budget_bytes (it waits for earlier targets to
+#                   be released before starting on later ones)
+#   acquire()       waits for a target's copy and returns it, or None if the
+#                   target wasn't staged (too big for the budget, or the copy failed)
+#   write_back()    copies an encoded output back to the source volume on a
+#                   background thread (under "<temp>.partial" until it is complete),
+#                   then runs the caller's finishing steps. When the copy or those
+#                   steps fail, the target goes in failures (absolute path -> reason)
+#                   and on_error(reason) is called, if given.
+#   close()         waits for outstanding write-backs and removes the scratch area
+class ScratchStager:
+    def __init__(self, scratch_dir, budget_bytes, log):
+        os.makedirs(scratch_dir, exist_ok=True)
+        self.work_dir = tempfile.mkdtemp(prefix='encode_scratch_', dir=scratch_dir)
+        self.budget_bytes = budget_bytes
+        self.log = log
+        self.used_bytes = 0
+        self.condition = threading.Condition()
+        self.entries = {}
+        self.copy_in = None
+        self.write_backs = cf.ThreadPoolExecutor(max_workers=1, thread_name_prefix='scratch-write-back')
+        self.pending = []
+        self.failures = {}
+
+    def prefetch_all(self, targets):
+        for index, target_file in enumerate(targets):
+            self.entries[target_file] = {
+                'ready': threading.Event(),
+                'dir': os.path.join(self.work_dir, f'{index:04d}'),
+                'input': None,
+                'reserved': 0,
+                'keep': False,
+            }
+        self.copy_in = threading.Thread(target=self._copy_in_loop, args=(list(targets),),
+                                        name='scratch-copy-in', daemon=True)
+        self.copy_in.start()
+
+    def _copy_in_loop(self, targets):
+        for target_file in targets:
+            entry = self.entries[target_file]
+            name = os.path.basename(target_file)
+            try:
+                reserve = os.path.getsize(target_file) * SCRATCH_RESERVE_FACTOR
+                if reserve > self.budget_bytes:
+                    self.log('info', f'{INDENT}"{name}" is too big for the scratch budget. Encoding in place')
+                    continue
+
+                with self.condition:
+                    self.condition.wait_for(lambda: self.used_bytes + reserve <= self.budget_bytes)
+                    self.used_bytes += reserve
+                    entry['reserved'] = reserve
+
+                os.makedirs(entry['dir'], exist_ok=True)
+                staged_input = os.path.join(entry['dir'], name)
+                shutil.copyfile(target_file, staged_input)
+                entry['input'] = staged_input
+                self.log('info', f'{INDENT}Staged "{name}" on scratch ({hm.naturalsize(reserve // SCRATCH_RESERVE_FACTOR)})')
+            except Exception as e:
+                self.log('warning', f'{INDENT}Could not stage "{name}" on scratch ({str(e)}). Encoding in place')
+                self._free(entry)
+            finally:
+                entry['ready'].set()
+
+    def acquire(self, target_file):
+        entry = self.entries.get(target_file)
+        if entry is None:
+            return None
+        entry['ready'].wait()
+        return entry['input']
+
+    # Where the scratch copy of target_file should be encoded to
+    def output_path(self, target_file, temp_file_name):
+        return os.path.join(self.entries[target_file]['dir'], temp_file_name)
+
+    # Drop a target's scratch files and hand its space back to the copy-in thread
+    def release(self, target_file):
+        entry = self.entries.get(target_file)
+        if entry:
+            self._free(entry)
+
+    def _free(self, entry):
+        shutil.rmtree(entry['dir'], ignore_errors=True)
+        with self.condition:
+            self.used_bytes -= entry['reserved']
+            entry['reserved'] = 0
+            self.condition.notify_all()
+
+    def write_back(self, target_file, scratch_output, temp_file, finish, on_error=None):
+        def failed(error):
+            self.failures[os.path.abspath(target_file)] = error
+            if on_error:
+                on_error(error)
+
+        def copy_out():
+            name = os.path.basename(target_file)
+            # Copied under a side name, so a crash mid-copy never leaves a truncated temp file
+            partial = f'{temp_file}.partial'
+            try:
+                shutil.copyfile(scratch_output, partial)
+                os.replace(partial, temp_file)
+            except Exception as e:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(partial)
+                # Keep the scratch copy: it is the only finished output
+                self.entries[target_file]['keep'] = True
+                self.log('failure', f'{INDENT}Could not copy "{name}" back from scratch. Encoded file left at "{scratch_output}"')
+                self.log('failure', f'{INDENT}Response:\t {str(e)}')
+                failed(f'copy back from scratch failed ({str(e)})')
+                return
+            self.release(target_file)
+            try:
+                finish()
+            except Exception as e:
+                self.log('failure', f'{INDENT}Could not finish "{name}" after copying it back. Please check it manually')
+                self.log('failure', f'{INDENT}Response:\t {str(e)}')
+                failed(f'file operations failed ({str(e)})')
+        self.pending.append(self.write_backs.submit(copy_out))
+
+    def close(self):
+        cf.wait(self.pending)
+        self.write_backs.shutdown(wait=True)
+        for entry in self.entries.values():
+            if not entry['keep']:
+                self._free(entry)
+        if not any(os.scandir(self.work_dir)):
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+####################################################################################
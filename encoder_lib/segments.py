@@ -0,0 +1,130 @@
+import os
+import glob
+import shutil
+import contextvars
+import concurrent.futures as cf
+from encoder_lib.common import FF_BIN, INDENT, run_ffmpeg
+from encoder_lib.probe import ffprobe, probe_duration
+
+####################################################################################
+# Segment parameters
+####################################################################################
+# Segments shorter than this cost more in x265 start-up and lookahead warm-up
+# than they gain from running in parallel
+MIN_SEGMENT_SECONDS = 120
+SEGMENT_EXT = '.mkv'
+####################################################################################
+
+
+####################################################################################
+# Scratch directory for one file's segments, next to its temp file
+def segment_work_dir(temp_file):
+    return f'{os.path.splitext(temp_file)[0]}.SEGMENTS'
+####################################################################################
+
+
+####################################################################################
+# Pull '-tag:v <tag>' out of a switch list. Matroska segments can't carry an
+# mp4 codec tag, so it is applied when the segments are joined instead.
+def split_tag_switches(switches):
+    kept, tags = [], []
+    i = 0
+    while i < len(switches):
+        if switches[i] in ('-tag:v', '-vtag') and i + 1 < len(switches):
+            tags.extend(switches[i:i + 2])
+            i += 2
+        else:
+            kept.append(switches[i])
+            i += 1
+    return kept, tags
+####################################################################################
+
+
+####################################################################################
+# Concat demuxer list entries. Single quotes are escaped the way the demuxer expects.
+def concat_list_line(path):
+    escaped = path.replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+####################################################################################
+
+
+####################################################################################
+# Split, encode and join one file.
+#   video_switches:  filters and video codec switches for the profile
+#   audio_switches:  audio codec switches, applied once when the segments are joined.
+#                    Any -map switches in them refer to the source as input 1.
+#   output_switches: metadata and other switches for the final file
+# Returns False, without touching anything, when the source is too short to be
+# worth splitting. ffmpeg failures raise CalledProcessError like a normal encode.
+# Once cancel (a threading.Event, see encoder_lib.worker) is set, the work dir
+# belongs to whichever worker now has the job, and is left alone.
+def segment_encode(target_file, temp_file, video_switches, audio_switches, output_switches,
+                   segments, x265_params, log, cancel=None):
+    duration = probe_duration(ffprobe(target_file))
+    if not duration:
+        log('warning', f'{INDENT}Source duration unknown. Encoding as a single file')
+        return False
+
+    segment_count = min(segments, int(duration // MIN_SEGMENT_SECONDS))
+    if segment_count < 2:
+        log('info', f'{INDENT}Source too short to split ({duration:.0f} sec). Encoding as a single file')
+        return False
+
+    # Start empty: ffmpeg won't overwrite parts an interrupted run left, and the
+    # glob below would pick up parts from a split with a different segment count
+    work_dir = segment_work_dir(temp_file)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    try:
+        # Cut the video at the keyframes nearest the even split points. Stream copy
+        # can only cut on keyframes, so each piece decodes on its own.
+        split_points = ','.join(f'{duration * i / segment_count:.3f}' for i in range(1, segment_count))
+        log('info', f'{INDENT}Splitting source into {segment_count} segments at:\t {split_points}')
+        run_ffmpeg([
+            FF_BIN, '-hide_banner', '-i', target_file,
+            '-map', '0:v:0', '-c', 'copy', '-an',
+            '-f', 'segment', '-segment_times', split_points, '-reset_timestamps', '1',
+            os.path.join(work_dir, f'source_%03d{SEGMENT_EXT}')
+        ])
+        source_parts = sorted(glob.glob(os.path.join(work_dir, f'source_*{SEGMENT_EXT}')))
+
+        # Encode every segment at once with the profile's video switches
+        segment_switches, tag_switches = split_tag_switches(video_switches)
+        x265_switches = ['-x265-params', x265_params] if x265_params else []
+
+        def encode_segment(source_part):
+            encoded_part = source_part.replace('source_', 'encoded_')
+            run_ffmpeg([
+                FF_BIN, '-hide_banner', '-i', source_part,
+                *x265_switches, *segment_switches, '-an',
+                encoded_part
+            ])
+            return encoded_part
+
+        log('info', f'{INDENT}Encoding {len(source_parts)} segments in parallel')
+        with cf.ThreadPoolExecutor(max_workers=len(source_parts)) as executor:
+            # Run in copies of this context so the segments count against this encode's governor slot
+            futures = [executor.submit(contextvars.copy_context().run, encode_segment, part) for part in source_parts]
+            encoded_parts = [future.result() for future in futures]
+
+        # Join the encoded video without re-encoding, taking audio straight from the source
+        concat_list = os.path.join(work_dir, 'concat.txt')
+        with open(concat_list, 'w') as list_pipe:
+            list_pipe.writelines(concat_list_line(part) for part in encoded_parts)
+
+        log('info', f'{INDENT}Joining encoded segments')
+        run_ffmpeg([
+            FF_BIN, '-hide_banner',
+            '-f', 'concat', '-safe', '0', '-i', concat_list,
+            '-i', target_file,
+            '-map', '0:v:0', *([] if '-map' in audio_switches else ['-map', '1:a:0?']),
+            '-c:v', 'copy', *tag_switches,
+            *audio_switches,
+            *output_switches,
+            temp_file
+        ])
+    finally:
+        if cancel is None or not cancel.is_set():
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return True
+####################################################################################
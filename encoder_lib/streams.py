@@ -0,0 +1,116 @@
+from encoder_lib.probe import streams_of_type
+
+####################################################################################
+# Stream planner parameters
+####################################################################################
+MP4_FAMILY = ('.mp4', '.m4v', '.mov')
+MATROSKA = ('.mkv',)
+
+# Audio codecs an MP4/MOV output can carry as they are
+MP4_AUDIO_CODECS = ('aac', 'ac3', 'eac3', 'mp3', 'alac', 'flac', 'opus')
+# Audio that has to be transcoded for a profile that otherwise copies it
+FALLBACK_AUDIO = ['aac', '192k']
+
+# MP4 only takes text subtitles, as mov_text. Bitmap subtitles are dropped there.
+TEXT_SUBTITLE_CODECS = ('mov_text', 'subrip', 'ass', 'ssa', 'webvtt', 'text')
+
+# Already HEVC with nothing to filter: copy the video and give it the tag
+# QuickTime and Finder previews need
+REMUX_VIDEO_SWITCHES = ['-c:v', 'copy', '-tag:v', 'hvc1']
+####################################################################################
+
+
+####################################################################################
+def parse_bit_rate(value):
+    value = str(value or '').lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    number = value.rstrip('km')
+    return int(float(number) * multiplier) if number.replace('.', '', 1).isdigit() else None
+####################################################################################
+
+
+####################################################################################
+def switch_value(switches, name):
+    return switches[switches.index(name) + 1] if name in switches else None
+####################################################################################
+
+
+####################################################################################
+# Replace the run of switches `old` inside `switches` with `new`
+def splice_switches(switches, old, new):
+    switches = list(switches)
+    for index in range(len(switches) - len(old) + 1):
+        if switches[index:index + len(old)] == list(old):
+            return switches[:index] + list(new) + switches[index + len(old):]
+    raise ValueError(f'Switches {old} not found')
+####################################################################################
+
+
+####################################################################################
+# Decide, per audio and subtitle stream of the source, whether to copy,
+# transcode or drop it, given the profile's audio switches and the output
+# container. Every audio track is kept; an audio track already in the profile's
+# codec at or below its bitrate is copied rather than encoded again.
+# input_index is the ffmpeg input the source is (1 when it is joined with
+# encoded segments). Returns (map and codec switches, description for the log).
+def plan_streams(probe_data, audio_params, output_ext, input_index=0):
+    output_ext = output_ext.lower()
+    profile_codec = switch_value(audio_params, '-c:a') or 'copy'
+    profile_rate = switch_value(audio_params, '-b:a')
+    switches, notes = [], []
+
+    audio_out = 0
+    for stream in streams_of_type(probe_data, 'audio'):
+        codec = stream.get('codec_name')
+        bit_rate = parse_bit_rate(stream.get('bit_rate'))
+        if profile_codec == 'copy':
+            target = None if output_ext not in MP4_FAMILY or codec in MP4_AUDIO_CODECS else FALLBACK_AUDIO
+        else:
+            target_rate = parse_bit_rate(profile_rate)
+            already_there = codec == profile_codec and (not bit_rate or not target_rate or bit_rate <= target_rate)
+            target = None if already_there else [profile_codec, profile_rate]
+
+        switches += ['-map', f'{input_index}:{stream["index"]}']
+        if target:
+            switches += [f'-c:a:{audio_out}', target[0]]
+            if target[1]:
+                switches += [f'-b:a:{audio_out}', target[1]]
+            notes.append(f'a:{audio_out} {codec}->{target[0]}{" " + target[1] if target[1] else ""}')
+        else:
+            switches += [f'-c:a:{audio_out}', 'copy']
+            notes.append(f'a:{audio_out} {codec} copy')
+        audio_out += 1
+
+    subtitle_out = 0
+    for stream in streams_of_type(probe_data, 'subtitle'):
+        codec = stream.get('codec_name')
+        if output_ext in MATROSKA:
+            subtitle_codec = 'srt' if codec == 'mov_text' else 'copy'
+        elif output_ext in MP4_FAMILY and codec in TEXT_SUBTITLE_CODECS:
+            subtitle_codec = 'copy' if codec == 'mov_text' else 'mov_text'
+        else:
+            notes.append(f'{codec} subtitle dropped')
+            continue
+        switches += ['-map', f'{input_index}:{stream["index"]}', f'-c:s:{subtitle_out}', subtitle_codec]
+        notes.append(f's:{subtitle_out} {codec} {"copy" if subtitle_codec == "copy" else "->" + subtitle_codec}')
+        subtitle_out += 1
+
+    # Fonts and other attachments only survive in Matroska
+    if output_ext in MATROSKA and streams_of_type(probe_data, 'attachment'):
+        switches += ['-map', f'{input_index}:t?', '-c:t', 'copy']
+        notes.append('attachments copy')
+
+    return switches, ', '.join(notes) or 'no audio or subtitles'
+####################################################################################
+
+
+####################################################################################
+# A source that is already HEVC but isn't tagged hvc1 in an MP4/MOV only needs a
+# remux, as long as no filtering is planned for it (see probe.summarize)
+def needs_remux(summary, output_ext):
+    return (
+        summary.get('codec') == 'hevc'
+        and output_ext.lower() in MP4_FAMILY
+        and summary.get('codec_tag') != 'hvc1'
+    )
+####################################################################################
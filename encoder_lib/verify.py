@@ -0,0 +1,139 @@
+import os
+import re
+import time
+import subprocess
+import concurrent.futures as cf
+from encoder_lib.common import FF_BIN, INDENT
+from encoder_lib.probe import ffprobe, probe_duration, streams_of_type
+
+####################################################################################
+# Verification parameters
+####################################################################################
+# The output's duration may differ from the source's by this much (container
+# rounding, audio priming, the last partial GOP)
+DURATION_TOLERANCE_SECONDS = 1.0
+DURATION_TOLERANCE_FRACTION = 0.005
+
+# Windows of the output decoded in full: the start, the middle and the end,
+# where a truncated file shows up
+VERIFY_WINDOW_SECONDS = 5
+VERIFY_WINDOW_COUNT = 3
+
+# Outputs verified at once, alongside the next encode
+VERIFY_WORKERS = 2
+####################################################################################
+
+
+####################################################################################
+# Stream counts an output made with these switches should have. The per-stream
+# codec switches from streams.plan_streams say exactly what was mapped; without
+# them ffmpeg picked the streams, and only the video stream is certain.
+def expected_streams(switches):
+    expected = {'video': 1}
+    mapped = {'audio': r'-c:a:(\d+)', 'subtitle': r'-c:s:(\d+)'}
+    if any(re.fullmatch(pattern, switch) for pattern in mapped.values() for switch in switches):
+        for codec_type, pattern in mapped.items():
+            expected[codec_type] = len({switch for switch in switches if re.fullmatch(pattern, switch)})
+    return expected
+####################################################################################
+
+
+####################################################################################
+def window_starts(duration):
+    if not duration or duration <= VERIFY_WINDOW_SECONDS * VERIFY_WINDOW_COUNT:
+        return [0.0]
+    last = duration - VERIFY_WINDOW_SECONDS
+    return [last * i / (VERIFY_WINDOW_COUNT - 1) for i in range(VERIFY_WINDOW_COUNT)]
+####################################################################################
+
+
+####################################################################################
+# Decode one window of a file. Returns the first error ffmpeg reported, or None.
+def decode_errors(output_file, start):
+    result = subprocess.run([
+        FF_BIN, '-hide_banner', '-nostdin', '-v', 'error',
+        '-ss', f'{start:.3f}', '-t', str(VERIFY_WINDOW_SECONDS), '-i', output_file,
+        '-map', '0:v:0', '-map', '0:a?', '-f', 'null', '-'
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    errors = result.stderr.decode(errors='replace').strip()
+    if result.returncode or errors:
+        return errors.splitlines()[0] if errors else f'ffmpeg exited with {result.returncode}'
+    return None
+####################################################################################
+
+
+####################################################################################
+# Check a finished output before the source is archived and replaced: it probes,
+# its duration matches the source's, it has the streams that were mapped, and
+# sampled windows decode without errors (decoded in parallel).
+# Returns None when the output is good, otherwise the reason it isn't.
+def verify_output(output_file, source_duration, expected):
+    try:
+        probe_data = ffprobe(output_file)
+    except Exception as e:
+        return f'output does not probe ({str(e).strip() or type(e).__name__})'
+
+    duration = probe_duration(probe_data)
+    if source_duration:
+        tolerance = max(DURATION_TOLERANCE_SECONDS, source_duration * DURATION_TOLERANCE_FRACTION)
+        if not duration or abs(duration - source_duration) > tolerance:
+            return f'duration {duration or 0:.2f}s against {source_duration:.2f}s for the source'
+
+    for codec_type, count in expected.items():
+        found = len(streams_of_type(probe_data, codec_type))
+        if found != count:
+            return f'{found} {codec_type} streams, expected {count}'
+
+    starts = window_starts(duration)
+    with cf.ThreadPoolExecutor(max_workers=len(starts)) as executor:
+        for start, error in zip(starts, executor.map(lambda start: decode_errors(output_file, start), starts)):
+            if error:
+                return f'decode error at {start:.0f}s: {error}'
+    return None
+####################################################################################
+
+
+####################################################################################
+# Runs verifications on background threads so the next encode isn't held up.
+# submit() takes the check and what to do with its outcome: on_pass() or
+# on_fail(reason), and optionally a dict to record the check's duration in under
+# 'verify', and on_error(reason) to record an on_pass()/on_fail() that raised.
+# Failed targets, and those whose outcome raised, are kept in failures (absolute
+# path -> reason) for the batch totals. close() waits for everything outstanding.
+class Verifier:
+    def __init__(self, log, workers=VERIFY_WORKERS):
+        self.log = log
+        self.executor = cf.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='verify')
+        self.pending = []
+        self.failures = {}
+
+    def submit(self, target_file, check, on_pass, on_fail, timings=None, on_error=None):
+        def run():
+            name = os.path.basename(target_file)
+            started = time.monotonic()
+            try:
+                reason = check()
+            except Exception as e:
+                reason = f'verification error ({str(e)})'
+            if timings is not None:
+                timings['verify'] = round(time.monotonic() - started, 3)
+            try:
+                if reason:
+                    self.failures[os.path.abspath(target_file)] = reason
+                    on_fail(reason)
+                else:
+                    self.log('success', f'{INDENT}Verified "{name}"')
+                    on_pass()
+            except Exception as e:
+                error = f'file operations failed ({str(e)})'
+                self.failures[os.path.abspath(target_file)] = error
+                self.log('failure', f'{INDENT}Could not finish "{name}" after verification. Please check it manually')
+                self.log('failure', f'{INDENT}Response:\t {str(e)}')
+                if on_error:
+                    on_error(error)
+        self.pending.append(self.executor.submit(run))
+
+    def close(self):
+        cf.wait(self.pending)
+        self.executor.shutdown(wait=True)
+####################################################################################
@@ -0,0 +1,254 @@
+import os
+import time
+import select
+import struct
+import sqlite3
+import ctypes
+import ctypes.util
+from contextlib import closing
+from encoder_lib.common import INDENT, STATE_DIR
+from encoder_lib.profiles import PROFILE_SCRIPTS
+
+####################################################################################
+# Watch parameters
+####################################################################################
+# A new file is handed to the encoder once its size and mtime have stayed the
+# same for SETTLE_SECONDS, so half-copied files are never picked up
+SETTLE_SECONDS = 30
+POLL_SECONDS = 10
+
+# Files already handed to the encoder. A directory is only listed again when its
+# mtime changes (or inotify reports a change), and only names that aren't in
+# here are stat'ed, so rescans of large libraries stay cheap.
+WATCH_DB_PATH = os.path.join(STATE_DIR, 'watch_seen.sqlite')
+
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.m4v', '.mov', '.avi', '.wmv', '.ts', '.m2ts', '.webm')
+SKIP_DIRS = ('_Encoder_Archive',)
+# Segment work dirs (see encoder_lib.segments) sit next to the source mid-encode
+SKIP_DIR_SUFFIXES = ('.SEGMENTS',)
+
+# inotify event bits (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+####################################################################################
+
+
+####################################################################################
+def _watch_connection():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    connection = sqlite3.connect(WATCH_DB_PATH, timeout=30)
+    connection.execute('CREATE TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)')
+    return connection
+####################################################################################
+
+
+####################################################################################
+# Files the encoder itself creates next to a source, or that aren't video
+def is_candidate(name):
+    if name.startswith('.') or '.TEMP.' in name or name.endswith('.partial'):
+        return False
+    return name.lower().endswith(VIDEO_EXTENSIONS)
+####################################################################################
+
+
+####################################################################################
+# A finished rendition ("Movie.720p.mkv", see encoder_lib.renditions) of a
+# source listed alongside it
+def is_rendition(name, sibling_names):
+    stem, ext = os.path.splitext(name)
+    return any(
+        stem.endswith(f'.{profile}') and f'{stem[:-len(profile) - 1]}{ext}' in sibling_names
+        for profile in PROFILE_SCRIPTS
+    )
+####################################################################################
+
+
+####################################################################################
+# Minimal inotify binding over libc. Only available on Linux; elsewhere
+# Inotify.create() returns None and the watcher falls back to polling.
+class Inotify:
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.dirs = {}
+
+    @classmethod
+    def create(cls):
+        library = ctypes.util.find_library('c')
+        if not library:
+            return None
+        libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | os.O_CLOEXEC)
+        return cls(libc, fd) if fd >= 0 else None
+
+    def add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_MASK)
+        if wd >= 0:
+            self.dirs[wd] = path
+
+    # Wait up to timeout seconds, then return (directory, name, mask) for each event
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events, offset = [], 0
+        while offset + 16 <= len(data):
+            wd, mask, _, length = struct.unpack_from('=iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0').decode(errors='surrogateescape')
+            offset += 16 + length
+            if wd in self.dirs:
+                events.append((self.dirs[wd], name, mask))
+                if mask & IN_DELETE_SELF:
+                    del self.dirs[wd]
+        return events
+
+    def close(self):
+        os.close(self.fd)
+####################################################################################
+
+
+####################################################################################
+# Watch one drop folder per profile and hand settled new files to
+# enqueue(profile, paths). Uses inotify where available, and otherwise polls
+# directory mtimes every POLL_SECONDS.
+class FolderWatcher:
+    def __init__(self, folders, enqueue, log, settle_seconds=SETTLE_SECONDS, poll_seconds=POLL_SECONDS):
+        self.folders = {profile: os.path.abspath(folder) for profile, folder in folders.items()}
+        self.enqueue = enqueue
+        self.log = log
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.dir_mtimes = {}
+        self.dirty = set()
+        # path -> [profile, size, mtime_ns, first time seen at this size]
+        self.pending = {}
+        self.inotify = None
+
+    def _profile_of(self, path):
+        for profile, folder in self.folders.items():
+            if path == folder or path.startswith(folder + os.sep):
+                return profile
+        return None
+
+    def _add_dir(self, path):
+        if path not in self.dir_mtimes:
+            self.dir_mtimes[path] = None
+            self.dirty.add(path)
+            if self.inotify:
+                self.inotify.add(path)
+
+    # Directories whose mtime moved since they were last listed
+    def _poll_dirs(self):
+        for path, listed_mtime in list(self.dir_mtimes.items()):
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                del self.dir_mtimes[path]
+                continue
+            if mtime_ns != listed_mtime:
+                self.dirty.add(path)
+
+    def _scan_dir(self, connection, path):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            self.dir_mtimes.pop(path, None)
+            return
+
+        profile = self._profile_of(path)
+        listed = {entry.path for entry in entries}
+        names = {entry.name for entry in entries}
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.') and entry.name not in SKIP_DIRS \
+                        and not entry.name.endswith(SKIP_DIR_SUFFIXES):
+                    self._add_dir(entry.path)
+            elif is_candidate(entry.name) and not is_rendition(entry.name, names) and entry.path not in self.pending:
+                if connection.execute('SELECT 1 FROM seen WHERE path = ?', (entry.path,)).fetchone():
+                    continue
+                stat = entry.stat()
+                self.pending[entry.path] = [profile, stat.st_size, stat.st_mtime_ns, time.monotonic()]
+
+        self.dir_mtimes[path] = mtime_ns
+
+        # Forget files that have gone, so a new file dropped under the same name is picked up
+        prefix = path + os.sep
+        gone = [
+            (seen_path,) for (seen_path,) in connection.execute(
+                'SELECT path FROM seen WHERE path >= ? AND path < ?', (prefix, prefix + '\uffff')
+            )
+            if os.path.dirname(seen_path) == path and seen_path not in listed
+        ]
+        if gone:
+            with connection:
+                connection.executemany('DELETE FROM seen WHERE path = ?', gone)
+
+    # Hand over files whose size and mtime have held still for settle_seconds
+    def _settle(self, connection):
+        now = time.monotonic()
+        settled = {}
+        for path, state in list(self.pending.items()):
+            profile, size, mtime_ns, since = state
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = [profile, stat.st_size, stat.st_mtime_ns, now]
+            elif stat.st_size and now - since >= self.settle_seconds:
+                del self.pending[path]
+                settled.setdefault(profile, []).append((path, stat))
+
+        for profile, files in settled.items():
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO seen (path, size, mtime_ns) VALUES (?, ?, ?)',
+                    [(path, stat.st_size, stat.st_mtime_ns) for path, stat in files]
+                )
+            self.log('info', f'{INDENT}Watch folder ({profile}):\t {len(files)} new files ready')
+            self.enqueue(profile, sorted(path for path, _ in files))
+
+    def run(self):
+        self.inotify = Inotify.create()
+        self.log('info', f'Watching {len(self.folders)} folders '
+                         f'({"inotify" if self.inotify else f"polling every {self.poll_seconds}s"})')
+
+        with closing(_watch_connection()) as connection:
+            # The first pass lists every directory, but only stats files not seen before
+            for folder in self.folders.values():
+                os.makedirs(folder, exist_ok=True)
+                self._add_dir(folder)
+
+            while True:
+                while self.dirty:
+                    self._scan_dir(connection, self.dirty.pop())
+                self._settle(connection)
+
+                # Wake early for pending files so they're handed over soon after settling
+                timeout = min(self.poll_seconds, self.settle_seconds) if self.pending else self.poll_seconds
+                if self.inotify:
+                    for directory, name, mask in self.inotify.read(timeout):
+                        if mask & IN_DELETE_SELF:
+                            self.dir_mtimes.pop(directory, None)
+                        elif mask & IN_ISDIR:
+                            self.dirty.add(directory)
+                        elif is_candidate(name):
+                            self.dirty.add(directory)
+                else:
+                    time.sleep(timeout)
+                    self._poll_dirs()
+####################################################################################
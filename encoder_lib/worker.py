@@ -0,0 +1,155 @@
+import os
+import time
+import shutil
+import signal
+import pathlib
+import platform
+import threading
+import contextlib
+from encoder_lib.cli import parse_submission
+from encoder_lib.client import JOB_SERVER_URL, server_request
+from encoder_lib.common import INDENT
+from encoder_lib.governor import child_ffmpeg_pids
+from encoder_lib.ledger import ledger_record
+from encoder_lib.profiles import load_profile
+from encoder_lib.renditions import rendition_paths
+from encoder_lib.segments import segment_work_dir
+
+####################################################################################
+# Worker parameters
+####################################################################################
+# How long an idle worker waits before asking the server for work again
+WORKER_POLL_SECONDS = 5
+
+# Heartbeats in a row that may fail to reach the server before the worker gives
+# its job up. Kept below the server's heartbeats per lease, so the worker stops
+# before the server can hand the job to someone else.
+MISSED_HEARTBEATS = 3
+####################################################################################
+
+
+####################################################################################
+# Partial outputs (and segment work dirs) a worker that died mid-encode left next
+# to the source. ffmpeg won't overwrite them, so they go before the job is encoded again.
+def stale_outputs(target_file, options):
+    p = pathlib.Path(target_file)
+    temp_file = str(p.with_name(f'{p.stem}.TEMP{p.suffix}'))
+    paths = [temp_file, segment_work_dir(temp_file)]
+    paths += [rendition_paths(target_file, profile)[0] for profile in options.rendition or []]
+    return [path for path in paths if os.path.exists(path)]
+####################################################################################
+
+
+####################################################################################
+# Worker agent for Encoder_Job_Server.py. Pulls one job at a time and runs it
+# through the profile's run_batch(), exactly as the script would for that one
+# file, heartbeating the job (with host load and the job's ledger state) until
+# it is done, then reports the result. A rejected heartbeat (or missed_heartbeats
+# in a row that never reached the server) means the job may be another worker's:
+# the encode is killed and the script leaves the source and temp outputs to the
+# new attempt.
+class EncoderWorker:
+    def __init__(self, log, name=None, server_url=JOB_SERVER_URL, missed_heartbeats=MISSED_HEARTBEATS):
+        self.log = log
+        self.name = name or platform.node()
+        self.server_url = server_url
+        self.missed_heartbeats = missed_heartbeats
+
+    def request(self, path, payload=None):
+        return server_request(path, payload, server_url=self.server_url)
+
+    def telemetry(self, job, started):
+        record = ledger_record(job['target'], job['profile']) or {}
+        return {
+            'host': platform.node(),
+            'load': os.getloadavg(),
+            'cpu_count': os.cpu_count(),
+            'seconds': round(time.monotonic() - started, 1),
+            'state': record.get('state'),
+        }
+
+    def _heartbeat(self, job, started, stop, lease_lost):
+        missed = 0
+        while not stop.wait(job['heartbeat_seconds']):
+            try:
+                if self.request('/heartbeat', {'worker': self.name, 'job': job['id'],
+                                               'telemetry': self.telemetry(job, started)})['ok']:
+                    missed = 0
+                    continue
+                self.log('warning', f'{INDENT}The server gave {job["target"]} to another worker. Stopping the encode')
+            except OSError as e:
+                missed += 1
+                self.log('warning', f'{INDENT}Heartbeat failed ({str(e)}). {missed} of {self.missed_heartbeats} missed')
+                if missed < self.missed_heartbeats:
+                    continue
+                self.log('warning', f'{INDENT}Lost touch with the server. Giving up {job["target"]}')
+            lease_lost.set()
+            for pid in child_ffmpeg_pids():
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGKILL)
+            return
+
+    def run_job(self, job):
+        started = time.monotonic()
+        stop, lease_lost = threading.Event(), threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, started, stop, lease_lost), name='worker-heartbeat',
+                         daemon=True).start()
+        try:
+            options = parse_submission(job['profile'], job['argv'], job['cwd'])
+            options.targets, options.resume, options.cancel = [job['target']], False, lease_lost
+            if job['attempts'] > 1:
+                for path in stale_outputs(job['target'], options):
+                    self.log('info', f'{INDENT}Removing partial output left by an earlier attempt:\t {path}')
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(path)
+
+            message_content = load_profile(job['profile']).run_batch(options)
+
+            # This run's result for the target. A target the batch skipped has none, and
+            # its ledger row (if any) is from an earlier run.
+            outcome = options.outcomes.get(os.path.abspath(job['target']))
+            if outcome:
+                encoded, _, before_size, after_size = outcome
+                state = (ledger_record(job['target'], job['profile']) or {}).get('state')
+                result = {'ok': bool(encoded) or state == 'not_worth_it', 'state': state,
+                          'before_size': before_size, 'after_size': after_size}
+            else:
+                result = {'ok': True, 'state': 'skipped'}
+            result['message'] = message_content
+        except Exception as e:
+            result = {'ok': False, 'error': str(e)}
+        finally:
+            stop.set()
+        result['seconds'] = round(time.monotonic() - started, 3)
+        result['host'] = platform.node()
+        return result
+
+    def run(self):
+        self.log('info', f'Worker {self.name} pulling jobs from {self.server_url}')
+        while True:
+            try:
+                job = self.request('/claim', {'worker': self.name}).get('job')
+            except OSError as e:
+                self.log('warning', f'Job server unreachable ({str(e)})')
+                job = None
+            if not job:
+                time.sleep(WORKER_POLL_SECONDS)
+                continue
+
+            self.log('info', f'Job {job["id"]}: {job["profile"]} {job["target"]} (attempt {job["attempts"]})')
+            result = self.run_job(job)
+            self.log('success' if result['ok'] else 'failure',
+                     f'{INDENT}Job {job["id"]} {result.get("state") or result.get("error")} in {result["seconds"]}s')
+
+            # Keep trying: the result is the only record the server gets of this job
+            while True:
+                try:
+                    self.request('/complete', {'worker': self.name, 'job': job['id'], 'result': result})
+                    break
+                except OSError as e:
+                    self.log('warning', f'{INDENT}Could not report job {job["id"]} ({str(e)}). Retrying')
+                    time.sleep(WORKER_POLL_SECONDS)
+####################################################################################